@@ -1 +1,6 @@
-from .main import app
\ No newline at end of file
+from .main import app
+
+
+__all__ = [
+    "app",
+]
@@ -1,23 +1,35 @@
+import logging
 import os
+import asyncio
+import base64
 import mimetypes
+from urllib.parse import unquote, urlparse
 
 from dotenv import load_dotenv
 from azure.storage.blob.aio import BlobServiceClient
-from azure.storage.blob import ContentSettings
-from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobBlock, ContentSettings
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+from . import config
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
 
-blob_service_client = BlobServiceClient.from_connection_string(
-    connection_string
-)
+if config.blob_store_backend == "memory":
+    from .memory_blob_store import memory_container
+    container_client = memory_container(container_name or "files")
+else:
+    blob_service_client = BlobServiceClient.from_connection_string(
+        connection_string
+    )
 
-container_client = blob_service_client.get_container_client(
-    container_name
-)
+    container_client = blob_service_client.get_container_client(
+        container_name
+    )
 
 
 async def init_container():
@@ -27,16 +39,25 @@ async def init_container():
         pass
 
 
-async def upload_file(filename: str, buffer: bytes):
+class UploadTooLarge(Exception):
+    pass
 
-    blob_client = container_client.get_blob_client(filename)
 
+def _content_type(filename: str):
     # Detect MIME type from extension
     content_type, _ = mimetypes.guess_type(filename)
 
     if content_type is None:
         content_type = "application/octet-stream"
 
+    return content_type
+
+
+async def upload_file(filename: str, buffer: bytes):
+
+    blob_client = container_client.get_blob_client(filename)
+    content_type = _content_type(filename)
+
     await blob_client.upload_blob(
         buffer,
         overwrite=True,
@@ -45,12 +66,123 @@ async def upload_file(filename: str, buffer: bytes):
         ),
     )
 
-    print(f"File uploaded successfully: {blob_client.url}")
+    logger.debug("blob uploaded", extra={"url": blob_client.url})
+
+    return blob_client.url
+
+
+def block_id(part: int, index: int):
+    # Every block id of a blob must have the same length.
+    return base64.b64encode(f"{part:05d}{index:05d}".encode()).decode()
+
+
+def read_chunks(stream, chunk_size: int = config.upload_chunk_size):
+    """Adapts an async byte iterator (e.g. ``Request.stream()``) to ``read()`` of fixed-size chunks."""
+    iterator = stream.__aiter__()
+    buffer = bytearray()
+
+    async def read():
+        while len(buffer) < chunk_size:
+            try:
+                buffer.extend(await iterator.__anext__())
+            except StopAsyncIteration:
+                break
+        chunk = bytes(buffer[:chunk_size])
+        del buffer[:chunk_size]
+        return chunk
+
+    return read
+
+
+async def stage_blocks(blob_name: str, read, max_size: int, part: int = 0):
+    """Stages everything ``read()`` returns as uncommitted blocks of ``blob_name``.
+
+    Only one chunk is read ahead while the previous one is being staged, so
+    memory stays O(chunk). Raises ``UploadTooLarge`` as soon as more than
+    ``max_size`` bytes arrive; blocks that are never committed are discarded
+    by the storage service. Returns ``(block_ids, size)``.
+    """
+    blob_client = container_client.get_blob_client(blob_name)
+
+    block_ids = []
+    size = 0
+    staging = None
+    try:
+        while True:
+            chunk = await read()
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(f"File is larger than {max_size} bytes")
+
+            if staging:
+                await staging
+            block_ids.append(block_id(part, len(block_ids)))
+            staging = asyncio.create_task(blob_client.stage_block(block_ids[-1], chunk))
+
+        if staging:
+            await staging
+    except BaseException:
+        if staging and not staging.done():
+            staging.cancel()
+        raise
+
+    return block_ids, size
+
+
+async def commit_blocks(blob_name: str, block_ids: list, filename: str = None):
+    blob_client = container_client.get_blob_client(blob_name)
+
+    await blob_client.commit_block_list(
+        [BlobBlock(block_id=id) for id in block_ids],
+        content_settings=ContentSettings(
+            content_type=_content_type(filename or blob_name)
+        ),
+    )
+
+    logger.debug("blob uploaded", extra={"url": blob_client.url})
 
     return blob_client.url
 
 
+async def upload_stream(filename: str, file, max_size: int = config.max_upload_size,
+                        chunk_size: int = config.upload_chunk_size):
+    """Streams an ``UploadFile`` (or anything with ``async read(n)``) into a block blob.
+
+    Returns ``(url, size)``, or ``(None, 0)`` for an empty file.
+    """
+    block_ids, size = await stage_blocks(filename, lambda: file.read(chunk_size), max_size)
+    if not block_ids:
+        return None, 0
+
+    return await commit_blocks(filename, block_ids), size
+
+
+def blob_name_from_url(url: str):
+    # https://<account>.blob.core.windows.net/<container>/<blob name>
+    path = unquote(urlparse(url).path).lstrip("/")
+    prefix = f"{container_name}/"
+    return path[len(prefix):] if path.startswith(prefix) else path.split("/", 1)[-1]
+
+
+async def delete_blob(blob_name: str):
+    """Deletes a blob; one that is already gone counts as deleted."""
+    try:
+        await container_client.get_blob_client(blob_name).delete_blob(delete_snapshots="include")
+    except ResourceNotFoundError:
+        pass
+
+
 __all__ = [
     "init_container",
     "upload_file",
-]
\ No newline at end of file
+    "upload_stream",
+    "read_chunks",
+    "stage_blocks",
+    "commit_blocks",
+    "delete_blob",
+    "blob_name_from_url",
+    "UploadTooLarge",
+]
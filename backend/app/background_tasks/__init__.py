@@ -1 +1,6 @@
-# from .file_deletion import cleanup_expired_files
\ No newline at end of file
+from .file_deletion import reaper
+
+
+__all__ = [
+    "reaper",
+]
@@ -1,25 +1,237 @@
-# from ..db import get_collection
-# from datetime import datetime
-# from ..firebase_utils import delete_file_from_firebase
-# import asyncio
+import logging
+import asyncio
+import time
+from datetime import datetime, timedelta
 
-# file_collection = get_collection("files")
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 
+from .. import config
+from .. import metrics
+from ..db import get_collection
+from ..azure_upload import delete_blob, blob_name_from_url
+from ..services import blob_service
 
-# async def cleanup_expired_files():
-#     while True:
-#         try:
-#             now = datetime.utcnow()
-#             expired_files = await file_collection.find({"file_exp": {"$lt": now}}).to_list(length=100)
+logger = logging.getLogger(__name__)
 
-#             for file in expired_files:
-#                 file_url = file.get("file_url")  # or storage_path
-#                 if file_url:
-#                     delete_file_from_firebase(file_url)
-#                     await file_collection.delete_one({"_id": file["_id"]})
-#                     print(f"Deleted expired file: {file_url}")
+file_collection = get_collection("files")
+locks_collection = get_collection("locks")
 
-#         except Exception as e:
-#             print("Error during cleanup:", e)
+LOCK_NAME = "file_reaper"
 
-#         await asyncio.sleep(3600)  # Wait 1 hour before next check
\ No newline at end of file
+
+async def acquire_lease(name: str, holder: str, ttl: float):
+    """Takes or renews the named lease; False while another holder's lease is live."""
+    now = datetime.utcnow()
+    try:
+        await locks_collection.find_one_and_update(
+            {"_id": name, "$or": [{"holder": holder}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"holder": holder, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists and belongs to someone else, so the upsert collided.
+        return False
+
+
+async def release_lease(name: str, holder: str):
+    await locks_collection.delete_one({"_id": name, "holder": holder})
+
+
+def _blob_name(file: dict):
+    # Documents written before blob_name was recorded only have the URL.
+    if file.get("blob_name"):
+        return file["blob_name"]
+    return blob_name_from_url(file["file_url"]) if file.get("file_url") else None
+
+
+class expired_file_reaper:
+    """Deletes the blobs of expired files, then their metadata.
+
+    Every worker runs the loop, but only the one holding the ``file_reaper``
+    lease does any work. Expired documents are paged by ``(file_exp, _id)``;
+    each page's blobs are deleted concurrently (at most ``concurrency`` at a
+    time) and the documents whose blob is gone are removed with one
+    ``delete_many``. A blob still referenced by an unexpired file (same name
+    uploaded again) is left alone. Failed deletions stay in place and are
+    retried on the next run.
+
+    Content-addressed files (those with a ``digest``) only drop their
+    reference; the shared blob is deleted by a second pass once it has been
+    unreferenced for ``blob_release_grace`` seconds.
+
+    Documents written before ``blob_name`` was recorded get it filled in from
+    their URL by the first run after the worker starts, so the in-use check
+    sees them too. Nothing writes such documents any more, so later runs
+    skip the scan.
+
+    Backlog and throughput are exported as ``cipherchats_file_reaper_*``
+    metrics.
+    """
+
+    def __init__(self, holder: str = config.worker_id, interval: float = config.file_reaper_interval,
+                 batch_size: int = config.file_reaper_batch_size, concurrency: int = config.file_reaper_concurrency,
+                 lease: float = config.file_reaper_lease):
+        self.holder = holder
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease = lease
+        self._task = None
+        self.is_leader = False
+        self._backfilled = False
+
+    def _lead(self, is_leader: bool):
+        self.is_leader = is_leader
+        metrics.reaper_leader.set(1 if is_leader else 0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            self._lead(False)
+            try:
+                await release_lease(LOCK_NAME, self.holder)
+            except Exception:
+                logger.exception("release_lease failed")
+
+    async def _run(self):
+        while True:
+            try:
+                self._lead(await acquire_lease(LOCK_NAME, self.holder, self.lease))
+                if self.is_leader:
+                    await self.reap()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("reaper run failed")
+
+            await asyncio.sleep(self.interval)
+
+    async def backfill_blob_names(self):
+        filled = 0
+        while True:
+            batch = await file_collection.find(
+                {"blob_name": {"$exists": False}}, {"file_url": 1}
+            ).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                break
+            await file_collection.bulk_write([
+                UpdateOne({"_id": file["_id"]}, {"$set": {"blob_name": _blob_name(file)}})
+                for file in batch
+            ], ordered=False)
+            filled += len(batch)
+        if filled:
+            logger.info("recorded blob names of legacy files", extra={"files": filled})
+        self._backfilled = True
+
+    async def reap(self, now: datetime | None = None):
+        now = now or datetime.utcnow()
+        started = time.monotonic()
+        if not self._backfilled:
+            await self.backfill_blob_names()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        deleted = 0
+
+        expired = {"file_exp": {"$lt": now}}
+        backlog = await file_collection.count_documents(expired)
+        metrics.reaper_backlog.set(backlog)
+
+        async def delete(name: str):
+            async with semaphore:
+                try:
+                    await delete_blob(name)
+                    return True
+                except Exception as e:
+                    logger.warning("failed to delete blob", extra={"blob": name, "error": repr(e)})
+                    return False
+
+        async def delete_all(names):
+            names = list(names)
+            results = await asyncio.gather(*(delete(name) for name in names))
+            return {name for name, ok in zip(names, results) if not ok}
+
+        leader = True
+        last = None
+        while True:
+            query = expired
+            if last is not None:
+                query = {"$and": [expired, {"$or": [
+                    {"file_exp": {"$gt": last["file_exp"]}},
+                    {"file_exp": last["file_exp"], "_id": {"$gt": last["_id"]}}
+                ]}]}
+
+            batch = await file_collection.find(
+                query, {"file_exp": 1, "file_url": 1, "blob_name": 1, "digest": 1}
+            ).sort([("file_exp", 1), ("_id", 1)]).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                break
+            last = batch[-1]
+
+            # Content-addressed files only hold a reference; the blob goes once
+            # nothing references it (see the pass over released blobs below).
+            shared = [file for file in batch if file.get("digest")]
+            owned = [file for file in batch if not file.get("digest")]
+
+            names = {_blob_name(file) for file in owned} - {None}
+            in_use = await file_collection.distinct("blob_name", {
+                "blob_name": {"$in": list(names)},
+                "file_exp": {"$gte": now}
+            }) if names else []
+            to_delete = names - set(in_use)
+            failed = await delete_all(to_delete)
+
+            done = [file["_id"] for file in shared]
+            done += [file["_id"] for file in owned if _blob_name(file) not in failed]
+            if done:
+                await file_collection.delete_many({"_id": {"$in": done}})
+            # Released after the documents are gone: a crash in between leaks a
+            # reference (the blob stays) rather than dropping one twice.
+            await blob_service.release_blobs(file["digest"] for file in shared)
+
+            deleted += len(to_delete) - len(failed)
+            metrics.reaper_blobs.labels("deleted").inc(len(to_delete) - len(failed))
+            metrics.reaper_blobs.labels("failed").inc(len(failed))
+            metrics.reaper_files_deleted.inc(len(done))
+            backlog = max(backlog - len(done), 0)
+            metrics.reaper_backlog.set(backlog)
+
+            # Keep the lease for as long as the run lasts; stop if it was lost.
+            if not await acquire_lease(LOCK_NAME, self.holder, self.lease):
+                self._lead(False)
+                leader = False
+                break
+
+        # Content-addressed blobs nobody has referenced for the grace period.
+        released_before = now - timedelta(seconds=config.blob_release_grace)
+        while leader:
+            released = await blob_service.released_blobs(released_before, self.batch_size)
+            if not released:
+                break
+            names = await blob_service.forget_blobs(released, released_before)
+            failed = await delete_all(names)
+            deleted += len(names) - len(failed)
+            metrics.reaper_blobs.labels("deleted").inc(len(names) - len(failed))
+            metrics.reaper_blobs.labels("failed").inc(len(failed))
+            if len(released) < self.batch_size:
+                break
+
+        elapsed = time.monotonic() - started
+        metrics.reaper_last_run.set_to_current_time()
+        metrics.reaper_run_seconds.set(elapsed)
+        metrics.reaper_blobs_per_second.set(deleted / elapsed if elapsed else 0.0)
+        if deleted:
+            logger.info("reaped expired blobs", extra={"deleted": deleted, "seconds": round(elapsed, 1), "backlog": backlog})
+
+
+reaper = expired_file_reaper()
@@ -0,0 +1,157 @@
+import os
+import socket
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cross-worker websocket delivery. "memory" keeps everything in this process,
+# "redis" routes messages through a broker so several workers/pods can share users.
+delivery_bus_backend = os.getenv('DELIVERY_BUS', 'memory')
+redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+worker_id = os.getenv('WORKER_ID', f"{socket.gethostname()}:{os.getpid()}")
+
+# Where uploads are stored. "azure" uses AZURE_STORAGE_CONNECTION_STRING;
+# "memory" keeps blobs in this process (tests and load tests only). For the
+# database, MONGO_URL=mongomock:// is the in-process counterpart; it needs
+# mongomock-motor, which is not in requirements.txt.
+blob_store_backend = os.getenv('BLOB_STORE', 'azure')
+
+# Offline queue replay on reconnect: documents per websocket frame, and how many
+# frames may be waiting for the client's ack before we stop reading the queue.
+pending_batch_size = int(os.getenv('PENDING_BATCH_SIZE', '100'))
+pending_batch_window = int(os.getenv('PENDING_BATCH_WINDOW', '2'))
+
+# Acknowledged delivery: sequence numbers are reserved from Mongo in blocks so
+# live messages do not pay a round trip each, and a client that stops acking
+# has its oldest unacked messages moved back to the offline queue.
+sequence_block_size = int(os.getenv('SEQUENCE_BLOCK_SIZE', '1000'))
+max_unacked_messages = int(os.getenv('MAX_UNACKED_MESSAGES', '500'))
+# Live messages held back while the offline queue is replayed; a connection
+# that would hold more is closed and they go to the offline queue.
+max_held_messages = int(os.getenv('MAX_HELD_MESSAGES', '1000'))
+
+# Per-connection outbound queue. A socket with this many frames waiting, or one
+# that takes longer than the timeout to accept a frame, is disconnected and its
+# messages go back to the offline queue.
+outbound_high_water = int(os.getenv('WS_OUTBOUND_HIGH_WATER', '256'))
+send_timeout = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+
+# Per-worker caches for decoded access tokens and user profile lookups.
+token_cache_size = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+token_cache_ttl = float(os.getenv('TOKEN_CACHE_TTL', '300'))
+user_cache_size = int(os.getenv('USER_CACHE_SIZE', '10000'))
+user_cache_ttl = float(os.getenv('USER_CACHE_TTL', '60'))
+
+# Per-user chat list cache behind /chat/get_chats. Channel activity is written to
+# Mongo at most once per interval per channel. The cache is per worker, so a
+# chat approved, deleted or active on another worker can take up to
+# chat_list_cache_ttl seconds to show up here.
+chat_list_cache_size = int(os.getenv('CHAT_LIST_CACHE_SIZE', '5000'))
+chat_list_cache_ttl = float(os.getenv('CHAT_LIST_CACHE_TTL', '120'))
+chat_list_page_size = int(os.getenv('CHAT_LIST_PAGE_SIZE', '50'))
+chat_activity_interval = float(os.getenv('CHAT_ACTIVITY_INTERVAL', '60'))
+
+# Indexes are created at startup unless disabled; either way the app refuses to
+# start without the unique indexes on user email/username and channel key.
+# File metadata is kept this long past file_exp before Mongo's TTL monitor
+# removes it.
+ensure_indexes_on_startup = os.getenv('ENSURE_INDEXES', 'true').lower() == 'true'
+file_metadata_ttl_grace = int(os.getenv('FILE_METADATA_TTL_GRACE', str(7 * 24 * 3600)))
+
+# Uploads are streamed to blob storage in blocks of this size and rejected as
+# soon as they pass the limit.
+upload_chunk_size = int(os.getenv('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+max_upload_size = int(os.getenv('MAX_UPLOAD_SIZE', str(100 * 1024 * 1024)))
+max_profile_photo_size = int(os.getenv('MAX_PROFILE_PHOTO_SIZE', str(5 * 1024 * 1024)))
+
+# Resumable uploads: the client PUTs parts of upload_part_size bytes (in
+# parallel) and sessions untouched for upload_session_ttl seconds are dropped.
+upload_part_size = int(os.getenv('UPLOAD_PART_SIZE', str(8 * 1024 * 1024)))
+max_session_upload_size = int(os.getenv('MAX_SESSION_UPLOAD_SIZE', str(2 * 1024 * 1024 * 1024)))
+upload_session_ttl = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 60 * 60)))
+
+# Expired-file reaper: one worker at a time (holding a lease in the locks
+# collection) deletes expired blobs in batches with bounded concurrency.
+file_reaper_enabled = os.getenv('FILE_REAPER', 'true').lower() == 'true'
+file_reaper_interval = float(os.getenv('FILE_REAPER_INTERVAL', '3600'))
+file_reaper_batch_size = int(os.getenv('FILE_REAPER_BATCH_SIZE', '500'))
+file_reaper_concurrency = int(os.getenv('FILE_REAPER_CONCURRENCY', '16'))
+file_reaper_lease = float(os.getenv('FILE_REAPER_LEASE', '300'))
+
+# Content-addressed blobs are deleted once they have had no references for
+# this many seconds.
+blob_release_grace = float(os.getenv('BLOB_RELEASE_GRACE', '3600'))
+
+# bcrypt runs in a small process pool. Password requests beyond
+# workers + queue are rejected with 503 right away.
+password_workers = int(os.getenv('PASSWORD_WORKERS', str(min(4, os.cpu_count() or 1))))
+password_queue_size = int(os.getenv('PASSWORD_QUEUE_SIZE', '32'))
+password_retry_after = int(os.getenv('PASSWORD_RETRY_AFTER', '2'))
+
+# Firebase ID token signing certificates, refreshed in the background at
+# most every google_certs_refresh seconds (sooner if Google's max-age says so).
+google_certs_url = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com')
+google_certs_refresh = float(os.getenv('GOOGLE_CERTS_REFRESH', '3600'))
+google_certs_min_refresh = float(os.getenv('GOOGLE_CERTS_MIN_REFRESH', '60'))
+
+# Channel membership (owner, partner) cache used to authorize channel routes.
+membership_cache_size = int(os.getenv('MEMBERSHIP_CACHE_SIZE', '20000'))
+membership_cache_ttl = float(os.getenv('MEMBERSHIP_CACHE_TTL', '60'))
+
+# Typing indicators: at most one "typing" per sender and channel every
+# typing_window seconds, and "stop_typing" after typing_timeout seconds of quiet.
+typing_window = float(os.getenv('TYPING_WINDOW', '3'))
+typing_timeout = float(os.getenv('TYPING_TIMEOUT', '5'))
+
+# Inbound websocket frames per connection: ws_frame_rate a second with bursts of
+# ws_frame_burst. Faster clients are read more slowly, and one that stays over
+# the limit for ws_throttle_grace seconds is disconnected.
+ws_frame_rate = float(os.getenv('WS_FRAME_RATE', '20'))
+ws_frame_burst = int(os.getenv('WS_FRAME_BURST', '40'))
+ws_throttle_grace = float(os.getenv('WS_THROTTLE_GRACE', '10'))
+
+# Largest {"event": "batch"} envelope a client may send over /ws/chat.
+ws_max_batch_size = int(os.getenv('WS_MAX_BATCH_SIZE', '100'))
+
+# Presence: every socket is pinged each interval, and one that has sent nothing
+# for the idle timeout is closed and its user reported offline.
+presence_ping_interval = float(os.getenv('PRESENCE_PING_INTERVAL', '25'))
+presence_idle_timeout = float(os.getenv('PRESENCE_IDLE_TIMEOUT', '75'))
+max_presence_batch = int(os.getenv('MAX_PRESENCE_BATCH', '200'))
+
+# Structured (JSON) logging: level, and the fraction of records below WARNING
+# that are kept on busy paths.
+log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+log_sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+# Prometheus metrics on GET /metrics (per worker).
+metrics_enabled = os.getenv('METRICS', 'true').lower() == 'true'
+
+# MongoDB client. The pool is warmed with mongo_warm_connections connections
+# at startup, and the app does not start serving until a ping succeeds (for
+# up to mongo_startup_timeout seconds). Compressors missing from the
+# environment are skipped without an error: zstd needs backports.zstd before
+# Python 3.14 (the standard library has it from 3.14), snappy needs
+# python-snappy.
+mongo_max_pool_size = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+mongo_min_pool_size = int(os.getenv('MONGO_MIN_POOL_SIZE', '10'))
+mongo_max_idle_ms = int(os.getenv('MONGO_MAX_IDLE_MS', '300000'))
+mongo_wait_queue_timeout_ms = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+mongo_connect_timeout_ms = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+mongo_server_selection_timeout_ms = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+mongo_socket_timeout_ms = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '20000'))
+mongo_compressors = os.getenv('MONGO_COMPRESSORS', 'zstd,zlib')
+mongo_read_preference = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+mongo_write_concern = os.getenv('MONGO_WRITE_CONCERN', 'majority')
+mongo_warm_connections = int(os.getenv('MONGO_WARM_CONNECTIONS', '10'))
+mongo_startup_timeout = float(os.getenv('MONGO_STARTUP_TIMEOUT', '30'))
+
+# Offline queue: messages expire queued_message_ttl seconds after being queued,
+# and each recipient keeps at most max_queued_messages / max_queued_bytes (the
+# oldest go first). Limits are enforced every queue_trim_interval messages per
+# recipient rather than on every insert.
+queued_message_ttl = int(os.getenv('QUEUED_MESSAGE_TTL', str(30 * 24 * 3600)))
+max_queued_messages = int(os.getenv('MAX_QUEUED_MESSAGES', '1000'))
+max_queued_bytes = int(os.getenv('MAX_QUEUED_BYTES', str(5 * 1024 * 1024)))
+queue_trim_interval = int(os.getenv('QUEUE_TRIM_INTERVAL', '50'))
@@ -1 +1,12 @@
-from .connection import get_collection, get_client
+from .connection import get_collection, get_client, open_database, close_database
+from .indexes import ensure_indexes, verify_unique_indexes
+
+
+__all__ = [
+    "get_collection",
+    "get_client",
+    "open_database",
+    "close_database",
+    "ensure_indexes",
+    "verify_unique_indexes",
+]
@@ -1,50 +1,98 @@
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
+import asyncio
+import logging
 import os
+import time
+
 from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
 
-import asyncio
+from .. import config
+from ..metrics import mongo_command_listener, mongo_pool_listener
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 mongodb_url = os.getenv('MONGO_URL')
+mongodb_name = os.getenv('MONGO_DB', 'cipherchat')
 
-# Define placeholders
+# Modules grab their collections at import time, so the client is created on
+# first use (no I/O happens until the first operation). open_database() warms
+# it up during the FastAPI lifespan and close_database() shuts it down.
 _client = None
 _db = None
 
+
+def _write_concern():
+    w = config.mongo_write_concern
+    return int(w) if w.isdigit() else w
+
+
+def _create_client():
+    if mongodb_url and mongodb_url.startswith('mongomock://'):
+        # In-process stand-in for tests and load tests; see config.blob_store_backend.
+        from mongomock_motor import AsyncMongoMockClient
+        return AsyncMongoMockClient()
+
+    return AsyncIOMotorClient(
+        mongodb_url,
+        maxPoolSize=config.mongo_max_pool_size,
+        minPoolSize=config.mongo_min_pool_size,
+        maxIdleTimeMS=config.mongo_max_idle_ms,
+        waitQueueTimeoutMS=config.mongo_wait_queue_timeout_ms,
+        connectTimeoutMS=config.mongo_connect_timeout_ms,
+        serverSelectionTimeoutMS=config.mongo_server_selection_timeout_ms,
+        socketTimeoutMS=config.mongo_socket_timeout_ms,
+        compressors=config.mongo_compressors,
+        readPreference=config.mongo_read_preference,
+        w=_write_concern(),
+        event_listeners=[mongo_command_listener(), mongo_pool_listener()],
+    )
+
+
 def _init_db_lazy():
-    """Initializes the MongoDB client only when needed within the active event loop."""
     global _client, _db
     if _client is None:
-        _client = AsyncIOMotorClient(mongodb_url)
-        _db = _client['cipherchat']
-        
-        # FIX: Check if an event loop is active before scheduling background tasks
-        try:
-            loop = asyncio.get_running_loop()
-            if loop.is_running():
-                loop.create_task(_ping_db(_client))
-        except RuntimeError:
-            # No running loop yet (compile/import time). 
-            # We skip the ping background task safely; Motor handles lazily anyway.
-            pass
-            
+        _client = _create_client()
+        _db = _client[mongodb_name]
     return _db
 
 
-async def _ping_db(client):
-    try:
-        await client.admin.command('ping')
-        print("Pinged your deployment. You successfully connected to MongoDB!")
-    except Exception as e:
-        print(f"Database connection warning: {e}")
+async def open_database():
+    """Blocks startup until MongoDB answers, then opens the warm-up connections.
+
+    Raises if no ping succeeds within ``mongo_startup_timeout`` seconds, so a
+    worker that cannot reach the database never starts taking traffic.
+    """
+    client = get_client()
+    deadline = time.monotonic() + config.mongo_startup_timeout
+    while True:
+        try:
+            await client.admin.command('ping')
+            break
+        except Exception as e:
+            if time.monotonic() >= deadline:
+                raise
+            logger.warning("MongoDB not reachable yet", extra={"error": repr(e)})
+            await asyncio.sleep(1)
+
+    # Concurrent pings each need their own connection, which fills the pool
+    # ahead of the first requests instead of during them.
+    warm = min(config.mongo_warm_connections, config.mongo_max_pool_size)
+    await asyncio.gather(*(client.admin.command('ping') for _ in range(warm)))
+    logger.info("connected to MongoDB", extra={"database": mongodb_name, "warm_connections": warm})
+
+
+def close_database():
+    # Collections handed out at import time keep pointing at this client.
+    if _client is not None:
+        _client.close()
+
 
 def get_collection(collection):
-    # This automatically grabs the database instance bound to the running loop
     db_instance = _init_db_lazy()
     return db_instance[collection]
 
+
 def get_client():
-    """Safely retrieves the raw MongoDB client bound to the active loop."""
     _init_db_lazy()
-    return _client
\ No newline at end of file
+    return _client
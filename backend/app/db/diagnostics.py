@@ -0,0 +1,100 @@
+"""Checks that every known query shape is served by an index.
+
+Run with ``python -m app.db.diagnostics``; exits non-zero if any shape
+falls back to a collection scan.
+"""
+import asyncio
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+
+from .connection import get_collection
+
+_user = ObjectId()
+_partner = ObjectId()
+_channel = ObjectId()
+
+# (name, collection, filter, sort) for find() shapes and
+# (name, collection, pipeline) for aggregations, mirroring the routes.
+FIND_SHAPES = [
+    ("join_chat key lookup", "channels", {"key": "x"}, None),
+    ("get_chat by members", "channels", {"$or": [
+        {"user_id": _user, "partner_id": _partner},
+        {"user_id": _partner, "partner_id": _user}
+    ]}, None),
+    ("join_chat existing request", "joining_requests", {"channel_id": _channel, "user_id": _user}, None),
+    ("delete_key requests", "joining_requests", {"channel_id": _channel}, None),
+    ("store_public_key lookup", "public_keys", {"user_id": _user, "channel_id": _channel}, None),
+    ("delete_key public keys", "public_keys", {"channel_id": _channel}, None),
+    ("offline queue replay", "queued_messages", {
+        "recipient_id": str(_user),
+        "$or": [{"seq": {"$gt": 0}}, {"seq": {"$exists": False}}]
+    }, [("seq", 1), ("_id", 1)]),
+    ("offline queue ack", "queued_messages", {"recipient_id": str(_user), "seq": {"$lte": 10}}, None),
+    ("offline queue trim", "queued_messages", {"recipient_id": str(_user)}, [("queued_at", -1)]),
+    ("offline queue collapse", "queued_messages", {"recipient_id": str(_user), "collapse_key": "e2ee:x"}, None),
+    ("signin", "user", {"$or": [{"email": "x"}, {"username": "x"}]}, None),
+    ("check_username", "user", {"username": "x"}, None),
+    ("expired files", "files", {"file_exp": {"$lt": datetime.utcnow()}}, [("file_exp", 1), ("_id", 1)]),
+    ("released blobs", "blobs", {"released_at": {"$lt": datetime.utcnow()}, "refs": {"$lte": 0}}, None),
+    ("blob still in use", "files", {"blob_name": {"$in": ["x"]}, "file_exp": {"$gte": datetime.utcnow()}}, None),
+]
+
+AGGREGATE_SHAPES = [
+    ("get_chats page", "channels", [
+        {"$match": {"partner_id": {"$exists": True}, "$or": [{"partner_id": _user}, {"user_id": _user}]}},
+        {"$sort": {"last_activity_at": -1, "_id": -1}},
+        {"$limit": 50},
+    ]),
+    ("get_keys_data page", "channels", [
+        {"$match": {"user_id": _user, "key": {"$exists": True}}},
+        {"$sort": {"_id": 1}},
+        {"$limit": 51},
+    ]),
+]
+
+
+def collection_scans(plan):
+    """Returns the COLLSCAN stages found anywhere in an explain() document."""
+    if isinstance(plan, dict):
+        found = [plan] if plan.get("stage") == "COLLSCAN" else []
+        for value in plan.values():
+            found.extend(collection_scans(value))
+        return found
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in collection_scans(item)]
+    return []
+
+
+async def explain_query_shapes():
+    """Explains every known shape and returns ``[(name, collection, uses_collscan)]``."""
+    report = []
+
+    for name, collection, query, sort in FIND_SHAPES:
+        cursor = get_collection(collection).find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = await cursor.explain()
+        report.append((name, collection, bool(collection_scans(plan.get("queryPlanner", plan)))))
+
+    for name, collection, pipeline in AGGREGATE_SHAPES:
+        db = get_collection(collection).database
+        plan = await db.command({
+            "explain": {"aggregate": collection, "pipeline": pipeline, "cursor": {}},
+            "verbosity": "queryPlanner"
+        })
+        report.append((name, collection, bool(collection_scans(plan))))
+
+    return report
+
+
+async def main():
+    report = await explain_query_shapes()
+    for name, collection, scan in report:
+        print(f"{'COLLSCAN' if scan else 'ok':8}  {collection:16}  {name}")
+    return 1 if any(scan for _, _, scan in report) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
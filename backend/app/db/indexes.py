@@ -0,0 +1,91 @@
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from .. import config
+from .connection import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Every index the hot queries rely on, per collection. ensure_indexes() applies
+# them at startup; creating an index that already exists with the same spec is
+# a no-op, so this is safe to run on every boot.
+INDEXES = {
+    "channels": [
+        # The chat list is an $or over both members, newest activity first.
+        IndexModel([("user_id", ASCENDING), ("last_activity_at", DESCENDING), ("_id", DESCENDING)], name="user_activity"),
+        IndexModel([("partner_id", ASCENDING), ("last_activity_at", DESCENDING), ("_id", DESCENDING)], name="partner_activity"),
+        # Keys are unset once a request is approved, so only enforce uniqueness where one exists.
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True, partialFilterExpression={"key": {"$exists": True}}),
+    ],
+    "joining_requests": [
+        IndexModel([("channel_id", ASCENDING), ("user_id", ASCENDING)], name="channel_user"),
+    ],
+    "public_keys": [
+        IndexModel([("channel_id", ASCENDING), ("user_id", ASCENDING)], name="channel_user"),
+    ],
+    "queued_messages": [
+        # Replay and acks walk a recipient's queue in delivery (seq) order.
+        IndexModel([("recipient_id", ASCENDING), ("seq", ASCENDING)], name="recipient_seq"),
+        # Cap enforcement keeps the newest messages per recipient.
+        IndexModel([("recipient_id", ASCENDING), ("queued_at", DESCENDING)], name="recipient_queued_at"),
+        IndexModel([("queued_at", ASCENDING)], name="queued_at_ttl", expireAfterSeconds=config.queued_message_ttl),
+        # At most one queued state notification per recipient and key.
+        IndexModel([("recipient_id", ASCENDING), ("collapse_key", ASCENDING)], name="recipient_collapse_key",
+                   unique=True, partialFilterExpression={"collapse_key": {"$exists": True}}),
+    ],
+    "user": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "files": [
+        # Backstop only: blobs are removed by the expiry reaper, the metadata is
+        # dropped by Mongo once it is well past file_exp.
+        IndexModel([("file_exp", ASCENDING)], name="file_exp_ttl", expireAfterSeconds=config.file_metadata_ttl_grace),
+        # The reaper pages through expired files in (file_exp, _id) order.
+        IndexModel([("file_exp", ASCENDING), ("_id", ASCENDING)], name="file_exp_id"),
+        IndexModel([("blob_name", ASCENDING), ("file_exp", ASCENDING)], name="blob_name_exp"),
+    ],
+    "blobs": [
+        # Content-addressed blobs waiting out the grace period after their last reference went.
+        IndexModel([("released_at", ASCENDING)], name="released_at", sparse=True),
+    ],
+    "upload_sessions": [
+        # Abandoned resumable uploads; expires_at is pushed forward by every part.
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+# Fields whose uniqueness allocation_service and signup leave entirely to the
+# index: without it duplicates are accepted silently.
+REQUIRED_UNIQUE = {
+    "channels": ["key"],
+    "user": ["email", "username"],
+}
+
+
+async def ensure_indexes():
+    for collection, indexes in INDEXES.items():
+        try:
+            # One index at a time: mongomock's create_indexes drops partialFilterExpression,
+            # which the in-memory load test relies on as much as MongoDB does.
+            for index in indexes:
+                spec = dict(index.document)
+                await get_collection(collection).create_index(list(spec.pop("key").items()), **spec)
+        except OperationFailure as e:
+            # Usually existing duplicates blocking a unique index; verify_unique_indexes
+            # stops startup if it was one of the required ones.
+            logger.warning("could not create indexes", extra={"collection": collection, "error": repr(e)})
+
+
+async def verify_unique_indexes():
+    """Raises ``RuntimeError`` unless every field in ``REQUIRED_UNIQUE`` has a unique index."""
+    missing = []
+    for collection, fields in REQUIRED_UNIQUE.items():
+        info = await get_collection(collection).index_information()
+        keys = [list(index["key"]) for index in info.values() if index.get("unique")]
+        unique = {key[0][0] for key in keys if len(key) == 1}
+        missing += [f"{collection}.{field}" for field in fields if field not in unique]
+    if missing:
+        raise RuntimeError(f"missing unique indexes on {', '.join(missing)}; remove the duplicates and restart")
@@ -1,5 +1,5 @@
 import firebase_admin
-from firebase_admin import credentials, auth, storage
+from firebase_admin import credentials
 import pathlib
 
 cred_path = pathlib.Path(__file__).parent / "../cipherchats_firebase_config.json"
@@ -0,0 +1,76 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+from . import config
+
+# Attributes every LogRecord has; anything else was passed through ``extra=``
+# and is emitted as a field of its own.
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class json_formatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, extra fields and traceback."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class sampling_filter(logging.Filter):
+    """Keeps ``rate`` of the records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def setup_logging():
+    """Routes the root logger through a queue drained by a background thread,
+    so a slow stdout never blocks the event loop. Records below WARNING are
+    sampled before they are queued."""
+    global _listener
+    if _listener is not None:
+        return
+
+    records = queue.SimpleQueue()
+    # QueueHandler renders the record (traceback included) with its formatter
+    # before queueing it; the listener thread only writes the line out.
+    handler = logging.handlers.QueueHandler(records)
+    handler.setFormatter(json_formatter())
+    handler.addFilter(sampling_filter(config.log_sample_rate))
+
+    output = logging.StreamHandler(sys.stdout)
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(config.log_level)
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,12 +1,51 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import chat_router, auth_router, user_router, file_router
-from .websocket import websocket_router
-from .firebase import firebase_app
-# from .background_tasks import cleanup_expired_files
-import asyncio
+from .routes import chat_router, auth_router, user_router, file_router, metrics_router
+from .websocket import websocket_router, manager
+from .db import ensure_indexes, verify_unique_indexes, open_database, close_database
+from .azure_upload import init_container
+from . import config
+from .background_tasks import reaper
+from .services.user_auth_services import password_executor
+from .services.google_token_service import google_keys
+from .services.serialization_service import fast_json_response
+from .logging_config import setup_logging, stop_logging
+from .metrics import metrics_middleware, loop_lag
 
-app = FastAPI()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_database()
+    if config.ensure_indexes_on_startup:
+        await ensure_indexes()
+    # Serving without these would let duplicate emails, usernames and keys through.
+    await verify_unique_indexes()
+    try:
+        await init_container()
+    except Exception:
+        logger.exception("init_container failed")
+    await manager.start()
+    await google_keys.start()
+    if config.file_reaper_enabled:
+        reaper.start()
+    if config.metrics_enabled:
+        loop_lag.start()
+    yield
+    await loop_lag.stop()
+    await reaper.stop()
+    await google_keys.stop()
+    await manager.stop()
+    password_executor.shutdown()
+    close_database()
+    stop_logging()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=fast_json_response)
 
 origins = [
     "http://localhost:5173",  # Replace with your frontend URL
@@ -27,8 +66,6 @@ app.include_router(websocket_router)
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(file_router)
-
-# @app.on_event("startup")
-# async def startup():
-#     print("Background task for cleaning up expired files has started.")
-#     asyncio.create_task(cleanup_expired_files())
\ No newline at end of file
+if config.metrics_enabled:
+    app.add_middleware(metrics_middleware)
+    app.include_router(metrics_router)
\ No newline at end of file
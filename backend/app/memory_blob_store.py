@@ -0,0 +1,44 @@
+from urllib.parse import quote
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+# In-process stand-in for the Azure container client, for BLOB_STORE=memory
+# (the tests and the load test's --in-memory mode). Only the calls
+# azure_upload makes are implemented; nothing survives a restart.
+
+
+class memory_blob:
+    def __init__(self, container: "memory_container", name: str):
+        self.container = container
+        self.name = name
+        self.url = f"http://memory.invalid/{container.name}/{quote(name)}"
+
+    async def upload_blob(self, data, overwrite=False, content_settings=None):
+        if not overwrite and self.name in self.container.blobs:
+            raise ResourceExistsError(f"blob {self.name} exists")
+        self.container.blobs[self.name] = bytes(data)
+
+    async def stage_block(self, block_id, data):
+        self.container.blocks.setdefault(self.name, {})[block_id] = bytes(data)
+
+    async def commit_block_list(self, blocks, content_settings=None):
+        staged = self.container.blocks.pop(self.name, {})
+        self.container.blobs[self.name] = b"".join(staged[block.id] for block in blocks)
+
+    async def delete_blob(self, delete_snapshots=None):
+        if self.container.blobs.pop(self.name, None) is None:
+            raise ResourceNotFoundError(f"blob {self.name} not found")
+
+
+class memory_container:
+    def __init__(self, name: str):
+        self.name = name
+        self.blobs = {}
+        # Uncommitted blocks per blob name, as staged by stage_block.
+        self.blocks = {}
+
+    async def create_container(self):
+        pass
+
+    def get_blob_client(self, name: str):
+        return memory_blob(self, name)
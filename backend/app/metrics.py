@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from pymongo import monitoring
+
+from . import config
+
+# Everything is registered on prometheus_client's default registry and served by
+# GET /metrics. Each worker exposes its own numbers; Prometheus scrapes them all.
+
+http_request_seconds = Histogram(
+    "cipherchats_http_request_duration_seconds", "HTTP request latency by route template.",
+    ["method", "route", "status"]
+)
+mongo_command_seconds = Histogram(
+    "cipherchats_mongo_command_duration_seconds", "MongoDB command latency as reported by the driver.",
+    ["command", "outcome"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+mongo_pool_connections = Gauge("cipherchats_mongo_pool_connections", "Open connections in the MongoDB pools.")
+mongo_pool_checked_out = Gauge("cipherchats_mongo_pool_checked_out", "MongoDB connections currently in use.")
+mongo_pool_max_size = Gauge("cipherchats_mongo_pool_max_size", "maxPoolSize per server; in use / max is the saturation.")
+mongo_pool_checkout_seconds = Histogram(
+    "cipherchats_mongo_pool_checkout_duration_seconds", "Time spent waiting for a pooled MongoDB connection.",
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+)
+mongo_pool_checkout_failures = Counter(
+    "cipherchats_mongo_pool_checkout_failures_total", "Failed connection checkouts (e.g. wait queue timeouts).", ["reason"]
+)
+ws_connections = Gauge("cipherchats_ws_active_connections", "Open /ws/chat connections on this worker.")
+ws_frames = Counter("cipherchats_ws_frames_total", "WebSocket frames received and sent.", ["direction"])
+ws_frames_in = ws_frames.labels("in")
+ws_frames_out = ws_frames.labels("out")
+event_loop_lag_seconds = Histogram(
+    "cipherchats_event_loop_lag_seconds", "How late the event loop wakes up from a short sleep.",
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+queued_messages_backlog = Gauge("cipherchats_queued_messages", "Documents in queued_messages (estimated).")
+queued_messages_dropped = Counter(
+    "cipherchats_queued_messages_dropped_total", "Queued messages replaced by a newer one or trimmed by the caps.", ["reason"]
+)
+reaper_leader = Gauge("cipherchats_file_reaper_leader", "1 while this worker holds the file reaper lease.")
+reaper_backlog = Gauge("cipherchats_file_reaper_backlog", "Expired files not reaped yet, as of the leader's last batch.")
+reaper_blobs = Counter("cipherchats_file_reaper_blobs_total", "Blob deletions by the file reaper.", ["outcome"])
+reaper_files_deleted = Counter("cipherchats_file_reaper_files_deleted_total", "Expired file documents removed.")
+reaper_last_run = Gauge("cipherchats_file_reaper_last_run_timestamp_seconds", "When the leader last finished a run.")
+reaper_run_seconds = Gauge("cipherchats_file_reaper_last_run_duration_seconds", "How long the last run took.")
+reaper_blobs_per_second = Gauge("cipherchats_file_reaper_blobs_per_second", "Blobs deleted per second in the last run.")
+cache_lookups = Counter(
+    "cipherchats_cache_lookups_total", "In-process cache lookups (tokens, users, memberships, chat lists).", ["cache", "result"]
+)
+upload_bytes = Counter("cipherchats_upload_bytes_total", "Bytes received through uploads.", ["kind"])
+upload_seconds = Histogram(
+    "cipherchats_upload_duration_seconds", "Time to receive and store an upload or part.", ["kind"],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+
+
+class mongo_command_listener(monitoring.CommandListener):
+    """Feeds driver command timings into ``mongo_command_seconds``.
+
+    Called on the driver's threads; prometheus_client metrics are thread safe.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_seconds.labels(event.command_name, "ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        mongo_command_seconds.labels(event.command_name, "error").observe(event.duration_micros / 1e6)
+
+
+class mongo_pool_listener(monitoring.ConnectionPoolListener):
+    """Tracks pool size, connections in use and checkout waits.
+
+    When checkouts start timing out, or in-use stays at max size, the pool
+    is too small for the load the worker receives (or there are too many
+    workers for the cluster).
+    """
+
+    def pool_created(self, event):
+        # options only lists non-default settings.
+        mongo_pool_max_size.set(event.options.get("maxPoolSize", config.mongo_max_pool_size))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_pool_checkout_failures.labels(str(event.reason)).inc()
+        if getattr(event, "duration", None) is not None:
+            mongo_pool_checkout_seconds.observe(event.duration)
+
+    def connection_checked_out(self, event):
+        mongo_pool_checked_out.inc()
+        # The event carries the wait time since pymongo 4.7.
+        if getattr(event, "duration", None) is not None:
+            mongo_pool_checkout_seconds.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.dec()
+
+
+class loop_lag_monitor:
+    """Sleeps ``interval`` seconds at a time and records how late each wake-up was."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            event_loop_lag_seconds.observe(max(time.perf_counter() - started - self.interval, 0))
+
+
+loop_lag = loop_lag_monitor()
+
+
+class metrics_middleware:
+    """ASGI middleware timing every HTTP request.
+
+    Requests are labelled with the matched route's path template (``/chat/get_chat/{id}``),
+    never the raw path, so the label set stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_seconds.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,4 +1,18 @@
 from .auth import UserModel, Token, SignInModel, GoogleAuthModel
 from .user import editProfileModel
 from .channel import store_public_key_model, get_public_key_model, create_channel_model
-from .channel import create_channel_response_model, edit_key_note_model
\ No newline at end of file
+from .channel import create_channel_response_model, edit_key_note_model
+
+
+__all__ = [
+    "UserModel",
+    "Token",
+    "SignInModel",
+    "GoogleAuthModel",
+    "editProfileModel",
+    "store_public_key_model",
+    "get_public_key_model",
+    "create_channel_model",
+    "create_channel_response_model",
+    "edit_key_note_model",
+]
@@ -1,5 +1,3 @@
-from fastapi import UploadFile, File
-from typing import Optional
 from pydantic import BaseModel
 
 class editProfileModel(BaseModel):
@@ -1,4 +1,14 @@
 from .chat_routes import router as chat_router
 from .auth_routes import router as auth_router
 from .user_routes import router as user_router
-from .file_routes import router as file_router
\ No newline at end of file
+from .file_routes import router as file_router
+from .metrics_routes import router as metrics_router
+
+
+__all__ = [
+    "chat_router",
+    "auth_router",
+    "user_router",
+    "file_router",
+    "metrics_router",
+]
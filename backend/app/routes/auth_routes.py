@@ -1,12 +1,16 @@
+import logging
 from fastapi import APIRouter, Depends
 from fastapi import HTTPException
 from ..db import get_collection
 from ..services import user_auth_services
-from ..services import user_auth_services
+from ..services import google_token_service, allocation_service
+from pymongo.errors import DuplicateKeyError
 from ..models import Token, UserModel, SignInModel, GoogleAuthModel
-from ..firebase import auth
+from ..firebase import firebase_app
 from typing import Literal
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 user_collection = get_collection('user')
@@ -15,16 +19,30 @@ user_collection = get_collection('user')
 async def signup(user: UserModel):
     try:
         user_dict = user.dict()
-        existing_user  = await user_collection.find_one({ 'email' : user_dict['email']})
-        if existing_user:
-            return HTTPException(status_code=400, detail="Email is already registered")
-        
-        hashed_password = user_auth_services.hash_password(user_dict['password'])
+
+        # Checked before hashing so a duplicate doesn't take a password worker slot.
+        existing = await user_collection.find_one(
+            {"$or": [{"email": user_dict['email']}, {"username": user_dict['username']}]},
+            {"email": 1}
+        )
+        if existing:
+            if existing.get('email') == user_dict['email']:
+                raise HTTPException(status_code=400, detail="Email is already registered")
+            raise HTTPException(status_code=400, detail="Username already exists")
+
+        hashed_password = await user_auth_services.hash_password(user_dict['password'])
         user_dict['password_hash'] = hashed_password
         del user_dict['password']
         user_dict['role'] = "user"
 
-        await user_collection.insert_one(user_dict)
+        # The unique indexes on email and username reject duplicates that raced the check.
+        try:
+            await user_collection.insert_one(user_dict)
+        except DuplicateKeyError as e:
+            if allocation_service.duplicate_field(e) == "email":
+                raise HTTPException(status_code=400, detail="Email is already registered")
+            raise HTTPException(status_code=400, detail="Username already exists")
+        user_auth_services.invalidate_user(user_dict['_id'])
 
         access_token = user_auth_services.create_access_token({ 'sub' : str(user_dict['_id'])})
         return {
@@ -33,8 +51,10 @@ async def signup(user: UserModel):
             "token_type": "bearer"
         }
     
-    except Exception as e:
-        print(e)
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("signup failed")
         return {"message" : "error"}
         
 
@@ -51,7 +71,7 @@ async def signin(user : SignInModel):
         if user_data is None:
             raise HTTPException(status_code=400, detail="invalid credentials")
 
-        if not user_auth_services.verify_password(user.password, user_data['password_hash']):
+        if not await user_auth_services.verify_password(user.password, user_data['password_hash']):
             raise HTTPException(status_code=400, detail="invalid credentials")
         
         access_token = user_auth_services.create_access_token(data={"sub": str(user_data['_id'])})
@@ -63,8 +83,8 @@ async def signin(user : SignInModel):
     
     except HTTPException as http_exc:
         raise http_exc  # Re-raise HTTP exceptions to maintain status code
-    except Exception as e:
-        print("signin : ", e)
+    except Exception:
+        logger.exception("signin failed")
         raise HTTPException(status_code=500, detail="Internal server error")  # Raise an HTTPException for consistency
 
 
@@ -73,50 +93,54 @@ async def googleAuth(user: GoogleAuthModel):
     try:
         user_data = user.dict()
 
-        decoded_token = auth.verify_id_token(user_data['id_token'])
+        try:
+            decoded_token = await google_token_service.verify_id_token(user_data['id_token'], firebase_app.project_id)
+        except google_token_service.invalid_token as e:
+            raise HTTPException(status_code=401, detail=f"Invalid Google token: {e}")
         uid = decoded_token["uid"]
         email = decoded_token.get("email")
         name = decoded_token.get("name")
         pic = decoded_token.get('picture')
 
         user_exists = await user_collection.find_one({ 'email' : email})
-        if user_exists:
-            if user_exists.get('password_hash'):
-                raise HTTPException(status_code=400, detail="Try with email")
-            
-            access_token = user_auth_services.create_access_token({ 'sub' : str(user_exists['_id'])})
-            return {
-                "success": True,
-                "access_token": access_token,
-                "token_type": "bearer"
-            }
-
-        else:
-            username = await user_auth_services.create_username(name)
-
+        if not user_exists:
             user_data = {
                 "email" : email,
                 "google_uid" : uid,
                 "name" : name,
-                "username" : username,
                 "profile_photo_url" : pic,
                 "acc_type" : "Google",
                 "role": "user"
             }
 
-            await user_collection.insert_one(user_data)
-
-            access_token = user_auth_services.create_access_token({ 'sub' : str(user_data['_id'])})
-            return {
-                "success": True,
-                "access_token": access_token, 
-                "token_type": "bearer"
-            }
+            try:
+                await allocation_service.insert_with_username(user_collection, user_data, name)
+                user_auth_services.invalidate_user(user_data['_id'])
+
+                access_token = user_auth_services.create_access_token({ 'sub' : str(user_data['_id'])})
+                return {
+                    "success": True,
+                    "access_token": access_token, 
+                    "token_type": "bearer"
+                }
+            except DuplicateKeyError:
+                # A concurrent first sign-in with the same email created the account.
+                user_exists = await user_collection.find_one({ 'email' : email})
+
+        if user_exists.get('password_hash'):
+            raise HTTPException(status_code=400, detail="Try with email")
+        
+        access_token = user_auth_services.create_access_token({ 'sub' : str(user_exists['_id'])})
+        return {
+            "success": True,
+            "access_token": access_token,
+            "token_type": "bearer"
+        }
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("googleAuth failed")
         raise HTTPException(status_code = 500, detail="Internal server error")
 
 
@@ -133,7 +157,7 @@ async def check_username(username : str):
         }
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
+    except Exception:
         raise HTTPException(status_code=500, detail="Internal server Error")
 
 
@@ -155,7 +179,7 @@ async def signin_as_john(username: Literal["john", "mark"]):
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
+    except Exception:
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -1,14 +1,18 @@
-from fastapi import APIRouter
+import logging
+from fastapi import APIRouter, Query
 from fastapi import Depends, HTTPException
 from ..db import get_collection
-from ..services import user_auth_services, clean_get_chats_doc, clean_object_ids
-from bson import ObjectId, json_util
-import json
+from ..services import user_auth_services
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
-from ..services import chat_service
+from ..services import chat_list_service, allocation_service, membership_service
+from ..services.serialization_service import fast_json_response
 from ..models import store_public_key_model, get_public_key_model, create_channel_model, create_channel_response_model, edit_key_note_model
 from ..websocket import manager
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 user_collection = get_collection('user')
@@ -18,15 +22,32 @@ channels_collection = get_collection('channels')
 joining_requests_collection = get_collection('joining_requests')
 
 
+async def get_channel_membership(channel_id, user_id):
+    """The channel's membership if ``user_id`` belongs to it; 404 otherwise."""
+    try:
+        membership = await membership_service.get_membership(channel_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+
+    if membership is None or not membership.is_member(user_id):
+        raise HTTPException(status_code=404, detail="Channel not found")
+    return membership
+
+
 @router.post('/chat/store_public_key')
 async def store_public_key(request : store_public_key_model, user : dict = Depends(user_auth_services.get_current_user)):
     try:
         user_data = await user_auth_services.get_user_by_id(user['sub'])
         request = request.dict()
 
-        channel_exists = await channels_collection.find_one({"_id" : ObjectId(request['channel_id'])}, {"_id" : 1})
+        # A joiner stores their key before the owner approves them, so this only
+        # checks that the channel exists; other() is None for non-members.
+        try:
+            membership = await membership_service.get_membership(request['channel_id'])
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid ID format")
 
-        if not channel_exists:
+        if not membership:
             raise HTTPException(status_code=404, detail="Channel not found")
 
         public_key_exists = await public_keys_collection.find_one({ 'user_id' : ObjectId(user_data['_id']), 'channel_id' : ObjectId(request['channel_id']) })
@@ -41,49 +62,19 @@ async def store_public_key(request : store_public_key_model, user : dict = Depen
                 }
             })
 
-            partner_id = await channels_collection.aggregate([
-                # Step 1: Match messages where the user is either the sender or recipient
-                {
-                    "$match": {
-                        "_id" : ObjectId(request['channel_id'])
-                    }
-                },
-                # Step 2: Add a new field to identify who the partner (the other person) is
-                {
-                    "$addFields": {
-                        "partner_id": {
-                            "$cond": [
-                                { "$eq": ["$user_id", user_data['_id']] },  # If user is the sender
-                                "$partner_id",                              # Get recipient's ID
-                                "$user_id"                                  # Else get sender's ID
-                            ]
-                        }
-                    }
-                },
-                # Step 3: Group by the partner_id to get unique chat participants
-                {
-                    "$group": {
-                        "_id": "$partner_id",          # Group by the ID of the partner
-                    }
-                },
-                # Step 5: Optionally project the fields you want (e.g., partner details and latest message)
-                {
-                    "$project": {
-                        "_id": 0,                         # Exclude the default _id
-                        "partner_id": "$_id"
-                    }
-                }
-            ]).to_list()
-            
-
-            await manager.send_message_to_user(
-                {
-                    "event": "update_public_key",
-                    "sender_id": str(user["sub"]),
-                    "channel_id": str(request['channel_id']),
-                    "recipient_id": str(partner_id[0]['partner_id']) if partner_id else None,
-                }, str(user['sub']), str(partner_id[0]['partner_id']) if partner_id else None
-            )
+            # A joiner who has not been approved yet tells the owner.
+            partner_id = membership.other(user_data['_id'])
+            if partner_id is None and membership.owner_id != user_data['_id']:
+                partner_id = membership.owner_id
+            if partner_id:
+                await manager.send_message_to_user(
+                    {
+                        "event": "update_public_key",
+                        "sender_id": str(user["sub"]),
+                        "channel_id": str(request['channel_id']),
+                        "recipient_id": str(partner_id),
+                    }, str(user['sub']), str(partner_id)
+                )
         else:
             await public_keys_collection.insert_one({
                 "user_id" : ObjectId(str(user_data['_id'])),
@@ -98,8 +89,8 @@ async def store_public_key(request : store_public_key_model, user : dict = Depen
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("store_public_key : ", e.with_traceback())
+    except Exception:
+        logger.exception("store_public_key failed")
         raise HTTPException(status_code=500, detail="Internal error")
 
 
@@ -126,8 +117,8 @@ async def get_public_key(request : get_public_key_model, user : dict = Depends(u
         }
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("get_public_key: ",e)
+    except Exception:
+        logger.exception("get_public_key failed")
         raise HTTPException(status_code=500, detail="Internal error")
     
 
@@ -140,23 +131,17 @@ async def get_chat(id : str, user : dict = Depends(user_auth_services.get_curren
                 "password_hash": 0,
             })
 
-        channelExists = await channels_collection.find_one({
-            "$or": [
-                {"user_id": ObjectId(user['sub']), "partner_id": ObjectId(id) },
-                {"user_id" : ObjectId(id), "partner_id" : ObjectId(user['sub']) }
-            ]
-        },{ "_id" : 1, "is_e2ee" : 1})
+        membership = await membership_service.find_between(user['sub'], id)
 
-        if not channelExists:
+        if not membership:
             raise HTTPException(status_code=404, detail="Chat not found")
-            
-        response = json.loads(json_util.dumps({"sender_details" : sender_details, "channel_id" : str(channelExists["_id"]), "isE2ee" : channelExists.get('is_e2ee') }))
-        return response
+
+        return fast_json_response({"sender_details" : sender_details, "channel_id" : membership.channel_id, "isE2ee" : await membership_service.is_e2ee(membership.channel_id) })
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("get_chat : ",e)
+    except Exception:
+        logger.exception("get_chat failed")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -169,21 +154,19 @@ async def create_chat(create_channel: create_channel_model, user : dict = Depend
         if(user_data["role"] == "guest"):
             raise HTTPException(status_code=403, detail="Guests cannot create new chats.")
         
-        random_key = await chat_service.genrate_key()
-
-        channel = await channels_collection.insert_one({
-            "key" : random_key,
+        channel = {
             "user_id" : user_data['_id'],
             "note" : create_channel.note,
             "created_at" : datetime.now()
-        })
+        }
+        random_key = await allocation_service.insert_with_key(channels_collection, channel)
 
-        return { "key" : random_key, "channel_id" : str(channel.inserted_id)}
+        return { "key" : random_key, "channel_id" : str(channel['_id'])}
     
     except HTTPException as http_exc:
         raise http_exc  # Re-raise HTTP exceptions to maintain status code
-    except Exception as e:
-        print("create_chat : ",e)
+    except Exception:
+        logger.exception("create_chat failed")
 
 
 @router.post('/chat/join')
@@ -219,113 +202,56 @@ async def join_chat(key : dict, user : dict = Depends(user_auth_services.get_cur
                 "partner_id": channel_record["user_id"]
              }
         
-        return clean_object_ids(res)
+        return fast_json_response(res)
     
     except HTTPException as http_exc:
         raise http_exc  
-    except Exception as e:
-        print("join_chat : ",e)
+    except Exception:
+        logger.exception("join_chat failed")
 
 
 @router.get('/chat/get_chats')
-async def get_chats(user : dict = Depends(user_auth_services.get_current_user)):
+async def get_chats(limit: int | None = Query(None, ge=1, le=200), cursor: str | None = None, user : dict = Depends(user_auth_services.get_current_user)):
     try:
-        user_data = await user_auth_services.get_user_by_id(user['sub'])
-
-        chats = await channels_collection.aggregate([
-            # Step 1: Match messages where the user is either the sender or recipient
-            {
-                "$match": {
-                    "$or": [
-                        { "partner_id": user_data['_id'] },
-                        { "user_id": user_data['_id'] }
-                    ]
-                }
-            },
-            # Step 2: Add a new field to identify who the partner (the other person) is
-            {
-                "$addFields": {
-                    "partner_id": {
-                        "$cond": [
-                            { "$eq": ["$user_id", user_data['_id']] },  # If user is the sender
-                            "$partner_id",                              # Get recipient's ID
-                            "$user_id"                                  # Else get sender's ID
-                        ]
-                    }
-                }
-            },
-            # Step 3: Group by the partner_id to get unique chat participants
-            {
-                "$group": {
-                    "_id": "$partner_id",
-                    "channel_id": { "$first": "$_id" }  # Save the original _id (channel id)
-                }
-            },
-            # Step 4: Join with the users collection to get details of the partner
-            {
-                "$lookup": {
-                    "from": "user",              # Assuming the users are stored in the "user" collection
-                    "localField": "_id",          # Field from the current collection (partner_id)
-                    "foreignField": "_id",        # Field from the "user" collection (_id of the partner)
-                    "as": "partner_details",       # Field name for the joined partner details
-                }
-            },
-            # Step 5: Unwind the user details (since $lookup returns an array)
-            {
-                "$unwind": "$partner_details"
-            },
-            # Step 6: Optionally project the fields you want (e.g., partner details and latest message)
-            {
-                "$project": {
-                    "_id": 0,                         # Exclude the default _id
-                    "partner_id": "$_id",              # Include the partner_id
-                    "partner_details": 1,          # Include the partner details
-                    'channel_id': 1,  # Include the channel_id
-                }
-            }
-        ]).to_list()
+        try:
+            chats, next_cursor = await chat_list_service.get_chat_page(user['sub'], limit, cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
 
-        result_chats = [clean_get_chats_doc(chat) for chat in chats]
+        # Cached entries are shared, so presence goes on copies.
+        presence = await manager.presence([chat["partner_id"] for chat in chats])
+        chats = [{**chat, **presence.get(chat["partner_id"], {})} for chat in chats]
 
-        response = json.loads(json_util.dumps({ "chats" : result_chats }))
+        response = { "chats" : chats }
+        if limit is not None:
+            response["next_cursor"] = next_cursor
         return response
     
     except HTTPException as http_exc:
         raise http_exc  
-    except Exception as e:
-        print("get_chats : ",e)
+    except Exception:
+        logger.exception("get_chats failed")
 
 
 @router.get('/chat/get_chat_details/{channel_id}')
 async def get_chat_details(channel_id: str, user: dict = Depends(user_auth_services.get_current_user)):
     try:
         try:
-            channel_oid = ObjectId(channel_id)
             user_oid = ObjectId(user['sub'])
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid ID format")
 
-        channel_record = await channels_collection.find_one({
-            "_id": channel_oid,
-            "$or": [
-                {"user_id": user_oid},
-                {"partner_id": user_oid}
-            ]
-        })
+        membership = await get_channel_membership(channel_id, user_oid)
 
-        if not channel_record:
-            raise HTTPException(status_code=404, detail="Channel not found")
-        
-        partner_details = {}
-        partner_record = {}
-        if(channel_record["user_id"] == user_oid):
-            partner_record = await user_collection.find_one({ "_id": channel_record["partner_id"] })
-        else:
-            partner_record = await user_collection.find_one({ "_id": channel_record["user_id"] })
+        partner_id = membership.other(user_oid)
+        partner_record = await user_collection.find_one({ "_id": partner_id }) if partner_id else None
+
+        if not partner_record:
+            raise HTTPException(status_code=404, detail="Partner not found")
 
         partner_details = {
             "partner_id": partner_record['_id'],
-            "channel_id": channel_record["_id"],
+            "channel_id": membership.channel_id,
             "partner_details": {
                 "name": partner_record['name'],
                 "username": partner_record['username'],
@@ -333,15 +259,15 @@ async def get_chat_details(channel_id: str, user: dict = Depends(user_auth_servi
             } 
         }
 
-        return {
+        return fast_json_response({
             "success": True,
-            "chat": clean_object_ids(partner_details)
-        }
+            "chat": partner_details
+        })
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("get_chat_details: ",e)
+    except Exception:
+        logger.exception("get_chat_details failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -356,20 +282,28 @@ async def delete_chat(sender_id : str, user : dict = Depends(user_auth_services.
         if not user_data:
             raise HTTPException(status_code=401, detail="Unauthorized access")
         
-        await channels_collection.delete_one({
-            "$or" : [
-                {"user_id" : ObjectId(sender_id), "partner_id" : ObjectId(user_data["_id"])},
-                {"user_id" : ObjectId(user_data["_id"]), "partner_id" : ObjectId(sender_id)}
-            ]
-        })
+        membership = await membership_service.find_between(user_data["_id"], sender_id)
+
+        if membership:
+            # Filter on both members too, in case the cached pair is stale.
+            deleted = await channels_collection.delete_one({
+                "_id" : membership.channel_id,
+                "$or" : [
+                    {"user_id" : ObjectId(sender_id), "partner_id" : ObjectId(user_data["_id"])},
+                    {"user_id" : ObjectId(user_data["_id"]), "partner_id" : ObjectId(sender_id)}
+                ]
+            })
+            membership_service.invalidate(membership.channel_id)
+            if deleted.deleted_count:
+                chat_list_service.remove_chat(membership.channel_id, user_data["_id"], sender_id)
 
         return {
             "msg" : "Channel deleted successfully"
         }
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("delete chat: ",e)
+    except Exception:
+        logger.exception("delete_chat failed")
         raise  HTTPException(status_code=500, detail="Internal Server error")
 
 
@@ -377,53 +311,23 @@ async def delete_chat(sender_id : str, user : dict = Depends(user_auth_services.
 async def enable_e2ee(channel_id, data : dict, user : dict = Depends(user_auth_services.get_current_user)):
     try:
         user_data = await user_auth_services.get_user_by_id(user['sub'])
-        await channels_collection.update_one({ "_id" : ObjectId(channel_id) }, { "$set" : {"is_e2ee" : data['isE2ee'] } })
+        membership = await get_channel_membership(channel_id, user_data['_id'])
 
-        partner_id = await channels_collection.aggregate([
-            # Step 1: Match messages where the user is either the sender or recipient
-            {
-                "$match": {
-                    "_id" : ObjectId(channel_id)
-                }
-            },
-            # Step 2: Add a new field to identify who the partner (the other person) is
-            {
-                "$addFields": {
-                    "partner_id": {
-                        "$cond": [
-                            { "$eq": ["$user_id", user_data['_id']] },  # If user is the sender
-                            "$partner_id",                              # Get recipient's ID
-                            "$user_id"                                  # Else get sender's ID
-                        ]
-                    }
-                }
-            },
-            # Step 3: Group by the partner_id to get unique chat participants
-            {
-                "$group": {
-                    "_id": "$partner_id",          # Group by the ID of the partner
-                }
-            },
-            # Step 5: Optionally project the fields you want (e.g., partner details and latest message)
-            {
-                "$project": {
-                    "_id": 0,                         # Exclude the default _id
-                    "partner_id": "$_id"
-                }
-            }
-        ]).to_list()
+        await channels_collection.update_one({ "_id" : membership.channel_id }, { "$set" : {"is_e2ee" : data['isE2ee'] } })
+
+        partner_id = membership.other(user_data['_id'])
         
-        print("e2ee: ",data['isE2ee'])
-        await manager.send_message_to_user(
-        {
-            "channel_id": channel_id,
-            "sender_id": str(user_data['_id']),
-            "recipient_id": str(partner_id[0]['partner_id']),
-            "type": "e2ee_status",
-            "sub_type": "enable" if data["isE2ee"] else "disable",
-            "message": "",
-            "timestamp": datetime.now().isoformat(),
-        }, str(user_data['_id']), str(partner_id[0]['partner_id']))
+        if partner_id:
+            await manager.send_message_to_user(
+            {
+                "channel_id": channel_id,
+                "sender_id": str(user_data['_id']),
+                "recipient_id": str(partner_id),
+                "type": "e2ee_status",
+                "sub_type": "enable" if data["isE2ee"] else "disable",
+                "message": "",
+                "timestamp": datetime.now().isoformat(),
+            }, str(user_data['_id']), str(partner_id))
 
         return {
             "msg" : "E2ee toggled successfully"
@@ -431,87 +335,116 @@ async def enable_e2ee(channel_id, data : dict, user : dict = Depends(user_auth_s
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print(e.with_traceback)
+    except Exception:
+        logger.exception("enable_e2ee failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 @router.get('/get_e2ee_status/{id}')
 async def get_e2ee_status(id : str, user : dict = Depends(user_auth_services.get_current_user)):
     try:
-        channelExists = await channels_collection.find_one({
-            "$or": [
-                {"user_id": ObjectId(user['sub']), "partner_id": ObjectId(id) },
-                {"user_id" : ObjectId(id), "partner_id" : ObjectId(user['sub']) }
-            ]
-        },{ "_id" : 1, "is_e2ee" : 1})
+        membership = await membership_service.find_between(user['sub'], id)
 
-        if not channelExists:
+        if not membership:
             raise HTTPException(status_code=404, detail="Chat not found")
-            
-        response = {"isE2ee" : channelExists.get('is_e2ee') }
+
+        response = {"isE2ee" : await membership_service.is_e2ee(membership.channel_id) }
         return response
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("get_e2ee_status : ",e)
-        print(e.with_traceback)
+    except Exception:
+        logger.exception("get_e2ee_status failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 @router.get('/get_keys_data')
-async def get_keys_data(user: dict = Depends(user_auth_services.get_current_user)):
+async def get_keys_data(limit: int = Query(50, ge=1, le=200), cursor: str | None = None, user: dict = Depends(user_auth_services.get_current_user)):
     try:
         user_data = await user_auth_services.get_user_by_id(user['sub'])
 
-        keys = await channels_collection.find(
-            {"user_id": user_data['_id'], "key": {"$exists": True}}
-        ).to_list()
-
-        res = []
-
-        for key in keys:
-            requests = await joining_requests_collection.aggregate([
-                {
-                    "$match": {
-                        "channel_id": key['_id']
-                    }
-                },
-                {
-                    "$lookup": {
-                        "from": "user",
-                        "localField": "user_id",
-                        "foreignField": "_id",
-                        "as": "user_data"
-                    }
-                },
-                {
-                    "$unwind": "$user_data"
-                },
-                {
-                    "$project": {
-                        "_id": 1,
-                        "user_id": 1,
-                        "user_data.username": 1,
-                        "user_data.profile_photo_url": 1
+        match = {"user_id": user_data['_id'], "key": {"$exists": True}}
+        if cursor:
+            # The cursor is the _id of the last key on the previous page.
+            try:
+                match["_id"] = {"$gt": ObjectId(cursor)}
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        # One round trip for the page of keys, their joining requests and the requesting users.
+        keys = channels_collection.aggregate([
+            { "$match": match },
+            { "$sort": { "_id": 1 } },
+            { "$limit": limit + 1 },
+            {
+                "$lookup": {
+                    "from": "joining_requests",
+                    "localField": "_id",
+                    "foreignField": "channel_id",
+                    "as": "requests"
+                }
+            },
+            { "$unwind": { "path": "$requests", "preserveNullAndEmptyArrays": True } },
+            {
+                "$lookup": {
+                    "from": "user",
+                    "localField": "requests.user_id",
+                    "foreignField": "_id",
+                    "as": "requester"
+                }
+            },
+            {
+                "$group": {
+                    "_id": "$_id",
+                    "key": { "$first": "$key" },
+                    "user_id": { "$first": "$user_id" },
+                    "note": { "$first": "$note" },
+                    "created_at": { "$first": "$created_at" },
+                    "requests": {
+                        "$push": {
+                            "_id": "$requests._id",
+                            "user_id": "$requests.user_id",
+                            "username": { "$first": "$requester.username" },
+                            # Most users have no photo; an explicit null rather than a missing
+                            # field, which mongomock (the load test's stand-in) drops the whole entry for.
+                            "profile_photo_url": { "$ifNull": [{ "$first": "$requester.profile_photo_url" }, None] }
+                        }
                     }
                 }
-            ]).to_list()
-
-            print(requests)
+            },
+            { "$sort": { "_id": 1 } }
+        ])
 
+        res = []
+        next_cursor = None
+        async for key in keys:
+            if len(res) == limit:
+                next_cursor = str(res[-1]["key"]["_id"])
+                break
+
+            # Keys without requests and requests whose user is gone come back as partial entries.
+            requests = key.pop("requests")
             res.append({
-                "key": clean_object_ids(key),
-                "requests": clean_object_ids(requests)
+                "key": key,
+                "requests": [
+                    {
+                        "_id": request["_id"],
+                        "user_id": request["user_id"],
+                        "user_data": {
+                            "username": request["username"],
+                            "profile_photo_url": request.get("profile_photo_url")
+                        }
+                    }
+                    for request in requests if request.get("_id") and request.get("username")
+                ]
             })
 
-        return {"keys_data": clean_object_ids(res)}
+        return fast_json_response({"keys_data": res, "next_cursor": next_cursor})
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("get_keys : ", e)
+    except Exception:
+        logger.exception("get_keys_data failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -535,8 +468,8 @@ async def edit_key_note(data: edit_key_note_model, user: dict = Depends(user_aut
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("edit_key_note : ", e)
+    except Exception:
+        logger.exception("edit_key_note failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -564,13 +497,15 @@ async def delete_key(key_id: str, user: dict = Depends(user_auth_services.get_cu
 
         await public_keys_collection.delete_many({"channel_id": key_oid})
         await channels_collection.delete_one({"_id": key_oid})
+        membership_service.invalidate(key_oid)
+        chat_list_service.remove_chat(key_oid, user_oid, channelExists.get("partner_id"))
 
         return { "success": True, "msg": "Key deleted successfully"}
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("delete_key : ", e)
+    except Exception:
+        logger.exception("delete_key failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
    
@@ -609,8 +544,8 @@ async def reject_request(req_id: str, user: dict = Depends(user_auth_services.ge
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("reject request: ",e)
+    except Exception:
+        logger.exception("reject_request failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
    
@@ -635,11 +570,13 @@ async def approve_request(req_id: str, user: dict = Depends(user_auth_services.g
         if not channel_record:
             raise HTTPException(status_code=404, detail="Channel not found or unauthorized")
         
+        last_activity_at = datetime.now()
         await channels_collection.update_one(
             {"_id": channel_record["_id"]},
             {
                 "$set": {
-                    "partner_id": request_record["user_id"]
+                    "partner_id": request_record["user_id"],
+                    "last_activity_at": last_activity_at
                 },
                 "$unset": {
                     "key": "",
@@ -648,7 +585,14 @@ async def approve_request(req_id: str, user: dict = Depends(user_auth_services.g
             }
         )
 
-        joining_requests_collection.delete_many({"channel_id": channel_record["_id"]})
+        membership_service.invalidate(channel_record["_id"])
+
+        await joining_requests_collection.delete_many({"channel_id": channel_record["_id"]})
+
+        owner = await user_auth_services.get_user_by_id(user_oid)
+        partner = await user_auth_services.get_user_by_id(request_record["user_id"])
+        if owner and partner:
+            await chat_list_service.add_chat(channel_record["_id"], owner, partner, last_activity_at)
 
         res = {
             "success": True,
@@ -657,12 +601,12 @@ async def approve_request(req_id: str, user: dict = Depends(user_auth_services.g
             "partner_id": request_record["user_id"]
         }
 
-        return clean_object_ids(res)
+        return fast_json_response(res)
     
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("approve request: ", e)
+    except Exception:
+        logger.exception("approve_request failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
     
 
@@ -676,46 +620,8 @@ async def update_connection(channel_id: str, user: dict = Depends(user_auth_serv
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid ID format")
 
-        user_data = await user_auth_services.get_user_by_id(user['sub'])
-
-        channel_exists = await channels_collection.find_one({"_id" : channel_oid}, {"_id" : 1})
-
-        if not channel_exists:
-            raise HTTPException(status_code=404, detail="Channel not found")
-
-        partner_id = await channels_collection.aggregate([
-            # Step 1: Match messages where the user is either the sender or recipient
-            {
-                "$match": {
-                    "_id" : channel_oid
-                }
-            },
-            # Step 2: Add a new field to identify who the partner (the other person) is
-            {
-                "$addFields": {
-                    "partner_id": {
-                        "$cond": [
-                            { "$eq": ["$user_id", user_data['_id']] },  # If user is the sender
-                            "$partner_id",                              # Get recipient's ID
-                            "$user_id"                                  # Else get sender's ID
-                        ]
-                    }
-                }
-            },
-            # Step 3: Group by the partner_id to get unique chat participants
-            {
-                "$group": {
-                    "_id": "$partner_id",          # Group by the ID of the partner
-                }
-            },
-            # Step 5: Optionally project the fields you want (e.g., partner details and latest message)
-            {
-                "$project": {
-                    "_id": 0,                         # Exclude the default _id
-                    "partner_id": "$_id"
-                }
-            }
-        ]).to_list()
+        membership = await get_channel_membership(channel_oid, user_oid)
+        partner_id = membership.other(user_oid)
         
         if not partner_id:
             raise HTTPException(status_code=404, detail="partner not found")
@@ -725,8 +631,8 @@ async def update_connection(channel_id: str, user: dict = Depends(user_auth_serv
                 "event": "update_public_key",
                 "sender_id": str(user["sub"]),
                 "channel_id": channel_oid,
-                "recipient_id": str(partner_id[0]['partner_id']) if partner_id else None,
-            }, str(user['sub']), str(partner_id[0]['partner_id']) if partner_id else None
+                "recipient_id": str(partner_id),
+            }, str(user['sub']), str(partner_id)
         )
 
         return {
@@ -736,6 +642,6 @@ async def update_connection(channel_id: str, user: dict = Depends(user_auth_serv
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("store_public_key : ", e.with_traceback())
+    except Exception:
+        logger.exception("update_connection failed")
         raise HTTPException(status_code=500, detail="Internal error")
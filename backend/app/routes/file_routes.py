@@ -1,11 +1,61 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from ..db import get_collection
+import logging
+import math
+import time
 from datetime import datetime, timedelta
-from ..azure_upload import upload_file
+
+from bson import ObjectId
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+
+from .. import config
+from .. import metrics
+from ..db import get_collection
+from ..services import user_auth_services, blob_service
+from ..azure_upload import read_chunks, stage_blocks, commit_blocks, UploadTooLarge
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 files = get_collection("files")
+upload_sessions = get_collection("upload_sessions")
+
+ALLOWED_FILE_TYPES = [
+    "image",
+    "video",
+    "audio",
+    "application"
+]
+
+
+def get_file_type(content_type: str | None):
+    # file.content_type can theoretically be None
+    content_type = content_type or "application/octet-stream"
+
+    file_type = content_type.split("/")[0]
+
+    if file_type not in ALLOWED_FILE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Unsupported file type"
+        )
+
+    return file_type
+
+
+async def record_file(file_name: str, blob_name: str | None, file_type: str, url: str, size: int, digest: str | None = None):
+    # Files with a digest hold a reference on a content-addressed blob; the
+    # others own their blob outright.
+    await files.insert_one({
+        "file_name": file_name,
+        "blob_name": blob_name,
+        "digest": digest,
+        "file_type": file_type,
+        "file_url": url,
+        "file_size": size,
+        "file_exp": datetime.utcnow() + timedelta(days=5)
+    })
 
 
 @router.post("/file/upload")
@@ -17,43 +67,201 @@ async def upload_file_controller(file: UploadFile = File(...)):
                 detail="No file uploaded"
             )
 
-        file_data = await file.read()
+        file_type = get_file_type(file.content_type)
 
-        if not file_data:
+        started = time.perf_counter()
+        try:
+            digest, url, size = await blob_service.store_upload(file)
+        except UploadTooLarge as e:
+            raise HTTPException(
+                status_code=413,
+                detail=str(e)
+            )
+
+        if not size:
             raise HTTPException(
                 status_code=400,
                 detail="Empty file uploaded"
             )
 
-        # file.content_type can theoretically be None
-        content_type = file.content_type or "application/octet-stream"
+        metrics.upload_seconds.labels("file").observe(time.perf_counter() - started)
+        metrics.upload_bytes.labels("file").inc(size)
 
-        file_type = content_type.split("/")[0]
+        await record_file(file.filename, None, file_type, url, size, digest)
 
-        if file_type not in [
-            "image",
-            "video",
-            "audio",
-            "application"
-        ]:
-            raise HTTPException(
-                status_code=400,
-                detail="Unsupported file type"
-            )
+        return {
+            "message": "File uploaded successfully",
+            "file_url": url
+        }
+
+    except HTTPException:
+        raise
 
-        url = await upload_file(
-            file.filename,
-            file_data
+    except Exception as e:
+        logger.exception("upload_file failed")
+
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error uploading file: {str(e)}"
         )
 
-        files.insert_one({
-            "file_name": file.filename,
+
+# Resumable uploads: initiate a session, PUT its numbered parts (in any order,
+# concurrently, retrying any that fail), then complete or abort it. Each part
+# is staged as blocks of the final blob with ids derived from the part number,
+# so a retried part simply replaces the blocks of the failed attempt.
+class upload_session_request(BaseModel):
+    file_name: str
+    file_size: int
+    content_type: str | None = None
+    # Optional hex sha256 of the file; if the caller has uploaded those bytes
+    # before, the upload is skipped altogether.
+    sha256: str | None = None
+
+
+async def get_session(upload_id: str, user: dict):
+    try:
+        session = await upload_sessions.find_one({"_id": ObjectId(upload_id), "user_id": user["sub"]})
+    except Exception:
+        session = None
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    return session
+
+
+@router.post("/file/uploads")
+async def create_upload_session(body: upload_session_request, user: dict = Depends(user_auth_services.get_current_user)):
+    try:
+        file_type = get_file_type(body.content_type)
+
+        if body.file_size <= 0:
+            raise HTTPException(status_code=400, detail="Empty file uploaded")
+        if body.file_size > config.max_session_upload_size:
+            raise HTTPException(status_code=413, detail=f"File is larger than {config.max_session_upload_size} bytes")
+
+        # A claimed digest proves nothing about having the bytes, so only the
+        # caller's own earlier uploads are reused.
+        if body.sha256:
+            blob = await blob_service.acquire_own_blob(body.sha256.lower(), body.file_size, user["sub"])
+            if blob:
+                await record_file(body.file_name, None, file_type, blob["url"], blob["size"], blob["_id"])
+                return {
+                    "message": "File uploaded successfully",
+                    "file_url": blob["url"]
+                }
+
+        upload_id = ObjectId()
+        part_count = math.ceil(body.file_size / config.upload_part_size)
+        expires_at = datetime.utcnow() + timedelta(seconds=config.upload_session_ttl)
+
+        await upload_sessions.insert_one({
+            "_id": upload_id,
+            "user_id": user["sub"],
+            "file_name": body.file_name,
+            "blob_name": f"{upload_id}/{body.file_name}",
             "file_type": file_type,
-            "file_url": url,
-            "file_size": file.size,
-            "file_exp": datetime.utcnow() + timedelta(days=5)
+            "file_size": body.file_size,
+            "part_size": config.upload_part_size,
+            "part_count": part_count,
+            "parts": {},
+            "status": "open",
+            "expires_at": expires_at
         })
 
+        return {
+            "upload_id": str(upload_id),
+            "part_size": config.upload_part_size,
+            "part_count": part_count,
+            "expires_at": expires_at
+        }
+
+    except HTTPException:
+        raise
+
+    except Exception:
+        logger.exception("create_upload_session failed")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.put("/file/uploads/{upload_id}/parts/{part_number}")
+async def upload_part(upload_id: str, part_number: int, request: Request, user: dict = Depends(user_auth_services.get_current_user)):
+    try:
+        session = await get_session(upload_id, user)
+
+        if session["status"] != "open":
+            raise HTTPException(status_code=409, detail="Upload session is not open")
+        if not 1 <= part_number <= session["part_count"]:
+            raise HTTPException(status_code=400, detail="Invalid part number")
+
+        # Every part is exactly part_size except the last one.
+        expected = session["part_size"]
+        if part_number == session["part_count"]:
+            expected = session["file_size"] - session["part_size"] * (session["part_count"] - 1)
+
+        started = time.perf_counter()
+        try:
+            block_ids, size = await stage_blocks(session["blob_name"], read_chunks(request.stream()), expected, part_number)
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail=f"Part {part_number} must be {expected} bytes")
+
+        if size != expected:
+            raise HTTPException(status_code=400, detail=f"Part {part_number} must be {expected} bytes")
+
+        metrics.upload_seconds.labels("part").observe(time.perf_counter() - started)
+        metrics.upload_bytes.labels("part").inc(size)
+
+        await upload_sessions.update_one(
+            {"_id": session["_id"], "status": "open"},
+            {"$set": {
+                f"parts.{part_number}": block_ids,
+                "expires_at": datetime.utcnow() + timedelta(seconds=config.upload_session_ttl)
+            }}
+        )
+
+        return {"part_number": part_number, "size": size}
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.exception("upload_part failed")
+        raise HTTPException(status_code=500, detail=f"Error uploading part: {str(e)}")
+
+
+@router.post("/file/uploads/{upload_id}/complete")
+async def complete_upload_session(upload_id: str, user: dict = Depends(user_auth_services.get_current_user)):
+    try:
+        session = await get_session(upload_id, user)
+
+        missing = [n for n in range(1, session["part_count"] + 1) if str(n) not in session["parts"]]
+        if missing:
+            raise HTTPException(status_code=400, detail={"message": "Upload is incomplete", "missing_parts": missing})
+
+        # Claim the session so a concurrent complete/abort cannot race the commit.
+        session = await upload_sessions.find_one_and_update(
+            {"_id": session["_id"], "status": "open"},
+            {"$set": {"status": "completing"}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not session:
+            raise HTTPException(status_code=409, detail="Upload session is not open")
+
+        block_ids = [id for n in range(1, session["part_count"] + 1) for id in session["parts"][str(n)]]
+        try:
+            url = await commit_blocks(session["blob_name"], block_ids, session["file_name"])
+        except Exception:
+            await upload_sessions.update_one({"_id": session["_id"]}, {"$set": {"status": "open"}})
+            raise
+
+        # Session uploads own their blob and are never registered by digest:
+        # parts arrive out of order on any worker, so the server never sees
+        # the bytes in sequence to hash them, and reading the blob back just
+        # to hash it would cost as much egress as deduplication saves.
+        await record_file(session["file_name"], session["blob_name"], session["file_type"], url, session["file_size"])
+        await upload_sessions.delete_one({"_id": session["_id"]})
+
         return {
             "message": "File uploaded successfully",
             "file_url": url
@@ -63,9 +271,25 @@ async def upload_file_controller(file: UploadFile = File(...)):
         raise
 
     except Exception as e:
-        print("File upload error:", e)
+        logger.exception("complete_upload_session failed")
+        raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error uploading file: {str(e)}"
-        )
\ No newline at end of file
+
+@router.delete("/file/uploads/{upload_id}")
+async def abort_upload_session(upload_id: str, user: dict = Depends(user_auth_services.get_current_user)):
+    try:
+        session = await get_session(upload_id, user)
+
+        # Staged blocks that are never committed are discarded by the storage service.
+        result = await upload_sessions.delete_one({"_id": session["_id"], "status": "open"})
+        if not result.deleted_count:
+            raise HTTPException(status_code=409, detail="Upload session is not open")
+
+        return {"message": "Upload aborted"}
+
+    except HTTPException:
+        raise
+
+    except Exception:
+        logger.exception("abort_upload_session failed")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
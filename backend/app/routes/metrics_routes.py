@@ -0,0 +1,22 @@
+import logging
+
+from fastapi import APIRouter, Response
+
+from .. import metrics
+from ..services import chat_service
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    try:
+        # Collection metadata, not a scan, so scraping stays cheap.
+        metrics.queued_messages_backlog.set(await chat_service.queued_messages_collection.estimated_document_count())
+    except Exception:
+        logger.exception("queued_messages backlog failed")
+
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -1,11 +1,16 @@
-from fastapi import APIRouter, UploadFile, File, Form
+import logging
+from fastapi import APIRouter, UploadFile, File, Form, Query
 from fastapi import Depends, HTTPException
 from ..db import get_collection
 from ..services import user_auth_services
-from ..services import  user_auth_services
 from bson import ObjectId
-from app.services import clean_object_ids
-from ..azure_upload import upload_file
+from pymongo.errors import DuplicateKeyError
+from app.services import chat_list_service, blob_service, membership_service
+from ..azure_upload import UploadTooLarge
+from ..websocket import manager
+from .. import config
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 user_collection = get_collection('user')
@@ -29,24 +34,31 @@ async def edit_profile(username: str = Form(...),
             raise HTTPException(status_code=400, detail="Username already exists")
         
         profile_photo_url = user_data.get('profile_photo_url')  # Keep the existing profile photo if none is uploaded
+        update = { "username": username, "name": name }
 
         # Handle profile photo upload
         if profile_photo:
-            photo_data = await profile_photo.read()
-            profile_photo_url = await upload_file(profile_photo.filename, photo_data)
-        else:
-            profile_photo_url = user_data.get('profile_photo_url')
-       
-        await user_collection.update_one(
+            try:
+                digest, url, _ = await blob_service.store_upload(profile_photo, max_size=config.max_profile_photo_size, uploader=user['sub'])
+            except UploadTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            if url:
+                profile_photo_url = url
+                update.update(profile_photo_url=url, profile_photo_digest=digest)
+
+        # The document as it was before the update, for the digest being replaced.
+        previous = await user_collection.find_one_and_update(
             { "_id": user_data['_id'] },  # Find the user by ID
-            {
-                "$set": {
-                    "username": username,
-                    "name": name,
-                    "profile_photo_url": profile_photo_url  # Update profile photo URL
-                }
-            }
+            { "$set": update },
+            projection={ "profile_photo_digest": 1 }
         )
+        # store_upload took a reference for the new photo, so the previous photo's
+        # is dropped even when it is the same picture. Its blob is deleted once
+        # nothing references it.
+        if "profile_photo_digest" in update and previous:
+            await blob_service.release_blobs([previous.get('profile_photo_digest')])
+        user_auth_services.invalidate_user(user_data['_id'])
+        chat_list_service.update_partner(user_data['_id'], name=name, username=username, profile_photo_url=profile_photo_url)
 
         return {
             "success": True,
@@ -58,8 +70,11 @@ async def edit_profile(username: str = Form(...),
 
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("edit_profile error:", e)
+    except DuplicateKeyError:
+        # Someone took the username between the check above and the update.
+        raise HTTPException(status_code=400, detail="Username already exists")
+    except Exception:
+        logger.exception("edit_profile failed")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -75,8 +90,26 @@ async def check_username(username : str, user : dict = Depends(user_auth_service
         }
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("check user username: ", e)
+    except Exception:
+        logger.exception("check_username failed")
+        raise HTTPException(status_code=500, detail="Internal server Error")
+
+
+@router.get('/user/presence')
+async def get_presence(ids: str = Query(..., description="Comma-separated user ids"), user : dict = Depends(user_auth_services.get_current_user)):
+    try:
+        user_ids = list(dict.fromkeys(user_id for user_id in ids.split(",") if user_id))
+        if len(user_ids) > config.max_presence_batch:
+            raise HTTPException(status_code=400, detail=f"At most {config.max_presence_batch} ids per request")
+
+        # Only people the caller shares an approved chat with; other ids are left out.
+        user_ids = await membership_service.partners_among(user['sub'], user_ids)
+        return { "presence": await manager.presence(user_ids) }
+
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception:
+        logger.exception("get_presence failed")
         raise HTTPException(status_code=500, detail="Internal server Error")
 
 
@@ -96,10 +129,10 @@ async def get_profile(user : dict = Depends(user_auth_services.get_current_user)
             "profile_url" : user_data.get("profile_photo_url")
         }
     
-        return clean_object_ids(res)
+        return res
     
     except HTTPException as http_exc:
         raise http_exc
-    except Exception as e:
-        print("get_profile", e)
+    except Exception:
+        logger.exception("get_profile failed")
         raise HTTPException(status_code=500, detail="Internal server error.")
\ No newline at end of file
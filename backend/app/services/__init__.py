@@ -1,3 +1,23 @@
-from .user_auth_services import hash_password, create_access_token, verify_password, verify_token, get_current_user, create_username
-from .chat_service import genrate_key, queue_message, get_pending_messages
-from .record_cleaning_service import clean_key_document, clean_get_chats_doc, clean_object_ids
\ No newline at end of file
+from .user_auth_services import hash_password, create_access_token, verify_password, verify_token, get_current_user
+from .chat_service import queue_message, queue_messages, requeue_messages, reserve_sequence
+from .chat_service import iter_pending_batches, acknowledge_messages, acknowledge_through
+from .record_cleaning_service import clean_key_document, clean_get_chats_doc, clean_object_ids
+
+
+__all__ = [
+    "hash_password",
+    "create_access_token",
+    "verify_password",
+    "verify_token",
+    "get_current_user",
+    "queue_message",
+    "queue_messages",
+    "requeue_messages",
+    "reserve_sequence",
+    "iter_pending_batches",
+    "acknowledge_messages",
+    "acknowledge_through",
+    "clean_key_document",
+    "clean_get_chats_doc",
+    "clean_object_ids",
+]
@@ -0,0 +1,84 @@
+import secrets
+import string
+
+from pymongo.errors import DuplicateKeyError
+
+# Unique values (channel keys, usernames) are allocated by inserting the
+# document and letting the unique index arbitrate: no check-then-insert race,
+# and one round trip whenever the first candidate is free.
+
+KEY_CHARACTERS = string.ascii_letters + string.digits
+
+
+class allocation_failed(Exception):
+    pass
+
+
+def duplicate_field(error: DuplicateKeyError):
+    """Name of the field whose unique index rejected the insert, if known."""
+    details = error.details or {}
+    pattern = details.get("keyPattern") or details.get("keyValue") or {}
+    if pattern:
+        return next(iter(pattern))
+    # Older servers only report the index name in the message.
+    message = str(error)
+    for name, field in (("username", "username"), ("email", "email"), ("key", "key"), ("_id_", "_id")):
+        if f"index: {name}" in message:
+            return field
+    return None
+
+
+async def _try_insert(collection, document: dict, field: str, value):
+    """Inserts ``document`` with ``field=value``; False if that value is taken.
+
+    A duplicate on any other unique field is re-raised for the caller.
+    """
+    had_id = "_id" in document
+    document[field] = value
+    try:
+        await collection.insert_one(document)
+        return True
+    except DuplicateKeyError as e:
+        if not had_id:
+            # insert_one assigned an _id to the dict; don't reuse it.
+            document.pop("_id", None)
+        if duplicate_field(e) != field:
+            raise
+        return False
+
+
+def random_keys(count: int, length: int = 16):
+    return [''.join(secrets.choice(KEY_CHARACTERS) for _ in range(length)) for _ in range(count)]
+
+
+async def insert_with_key(collection, document: dict, field: str = "key", length: int = 16, attempts: int = 5):
+    """Inserts ``document`` with a fresh random key in ``field`` and returns the key."""
+    for key in random_keys(attempts, length):
+        if await _try_insert(collection, document, field, key):
+            return key
+    raise allocation_failed(f"no free {field} after {attempts} attempts")
+
+
+def username_base(name: str | None):
+    return (name or "user").lower().replace(" ", "") or "user"
+
+
+async def insert_with_username(collection, document: dict, name: str | None, batch_size: int = 10, attempts: int = 5):
+    """Inserts ``document`` with a username derived from ``name`` and returns it.
+
+    The bare name is tried first. If it is taken, a batch of suffixed
+    candidates is generated, the taken ones are filtered out with a single
+    query and the first free one is inserted; another user grabbing it in
+    between only moves on to the next candidate.
+    """
+    base = username_base(name)
+    if await _try_insert(collection, document, "username", base):
+        return base
+
+    for _ in range(attempts):
+        candidates = list(dict.fromkeys(base + ''.join(secrets.choice(string.digits) for _ in range(5)) for _ in range(batch_size)))
+        taken = set(await collection.distinct("username", {"username": {"$in": candidates}}))
+        for username in candidates:
+            if username not in taken and await _try_insert(collection, document, "username", username):
+                return username
+    raise allocation_failed(f"no free username for {base!r}")
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from ..db import get_collection
+from .. import config
+from ..azure_upload import upload_stream, delete_blob, UploadTooLarge
+
+# Content-addressed blobs: one document per sha256 digest with the blob that
+# holds those bytes and how many files/profile photos reference it. Every
+# stored copy gets a fresh blob name, so a blob being reaped can never be the
+# one a concurrent upload of the same content just wrote. ``uploaders`` lists
+# the users whose bytes the server has hashed to that digest; only they may
+# reuse the blob by quoting its digest without uploading.
+blobs_collection = get_collection('blobs')
+
+
+async def hash_upload(file, max_size: int, chunk_size: int = config.upload_chunk_size):
+    """Hashes an ``UploadFile`` (already spooled locally by Starlette) and rewinds it.
+
+    Returns ``(digest, size)``; raises ``UploadTooLarge`` past ``max_size``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise UploadTooLarge(f"File is larger than {max_size} bytes")
+        # hashlib releases the GIL on large buffers.
+        await asyncio.to_thread(digest.update, chunk)
+
+    await file.seek(0)
+    return digest.hexdigest(), size
+
+
+def _uploaded_by(uploader: str | None):
+    return {"$addToSet": {"uploaders": uploader}} if uploader else {}
+
+
+async def acquire_blob(digest: str, uploader: str | None = None):
+    """Adds a reference to an existing blob; returns its document, or None on a miss.
+
+    Only for a digest the server computed from the bytes it received; the
+    uploader (if known) is recorded as having them.
+    """
+    return await blobs_collection.find_one_and_update(
+        {"_id": digest},
+        {"$inc": {"refs": 1}, "$unset": {"released_at": ""}, **_uploaded_by(uploader)},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def acquire_own_blob(digest: str, size: int, user_id: str):
+    """Like ``acquire_blob`` for a digest the client claims, which proves
+    nothing: only a blob ``user_id`` has uploaded before is used."""
+    return await blobs_collection.find_one_and_update(
+        {"_id": digest, "size": size, "uploaders": user_id},
+        {"$inc": {"refs": 1}, "$unset": {"released_at": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def register_blob(digest: str, blob_name: str, url: str, size: int, uploader: str | None = None):
+    """Records a freshly uploaded blob with one reference.
+
+    If another upload of the same bytes registered first, that blob is used
+    and ours is deleted.
+    """
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": digest},
+        {
+            "$inc": {"refs": 1},
+            "$unset": {"released_at": ""},
+            "$setOnInsert": {"blob_name": blob_name, "url": url, "size": size, "created_at": datetime.utcnow()},
+            **_uploaded_by(uploader)
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if blob["blob_name"] != blob_name:
+        await delete_blob(blob_name)
+    return blob
+
+
+async def store_upload(file, max_size: int = config.max_upload_size, uploader: str | None = None):
+    """Stores an ``UploadFile`` by content, skipping the upload if the bytes are already stored.
+
+    Returns ``(digest, url, size)``; ``url`` is None for an empty file. The
+    caller owns one reference and must ``release_blobs`` it eventually.
+    """
+    digest, size = await hash_upload(file, max_size)
+    if not size:
+        return digest, None, 0
+
+    blob = await acquire_blob(digest, uploader)
+    if blob:
+        return digest, blob["url"], size
+
+    _, ext = os.path.splitext(file.filename or "")
+    blob_name = f"{digest}/{ObjectId()}{ext.lower()}"
+    url, _ = await upload_stream(blob_name, file, max_size)
+    blob = await register_blob(digest, blob_name, url, size, uploader)
+    return digest, blob["url"], size
+
+
+async def release_blobs(digests):
+    """Drops one reference per occurrence of each digest.
+
+    Blobs left unreferenced are only marked; the reaper deletes them once they
+    have stayed unreferenced for ``blob_release_grace`` seconds.
+    """
+    counts = {}
+    for digest in digests:
+        if digest:
+            counts[digest] = counts.get(digest, 0) + 1
+
+    for digest, count in counts.items():
+        await blobs_collection.update_one({"_id": digest}, {"$inc": {"refs": -count}})
+
+    if counts:
+        await blobs_collection.update_many(
+            {"_id": {"$in": list(counts)}, "refs": {"$lte": 0}, "released_at": {"$exists": False}},
+            {"$set": {"released_at": datetime.utcnow()}}
+        )
+
+
+async def released_blobs(before: datetime, limit: int):
+    return await blobs_collection.find(
+        {"released_at": {"$lt": before}, "refs": {"$lte": 0}},
+        {"blob_name": 1}
+    ).limit(limit).to_list(length=limit)
+
+
+async def forget_blobs(blobs: list, before: datetime):
+    """Deletes the documents of unreferenced blobs; returns the blob names that may now be removed.
+
+    A blob re-acquired since it was listed keeps its document (and its blob).
+    """
+    ids = [blob["_id"] for blob in blobs]
+    await blobs_collection.delete_many({"_id": {"$in": ids}, "refs": {"$lte": 0}, "released_at": {"$lt": before}})
+    kept = {blob["blob_name"] async for blob in blobs_collection.find({"_id": {"$in": ids}}, {"blob_name": 1})}
+    return [blob["blob_name"] for blob in blobs if blob["blob_name"] not in kept]
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+
+from .. import metrics
+
+
+class ttl_lru_cache:
+    """Bounded in-process cache: least recently used entries are evicted past
+    ``maxsize`` and every entry expires ``ttl`` seconds after it was stored.
+
+    Caches are per worker, so anything that changes the underlying record must
+    call ``invalidate`` here and rely on the TTL to bound staleness elsewhere.
+    Hits and misses are counted in ``cipherchats_cache_lookups_total`` under
+    ``name``.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._hits = metrics.cache_lookups.labels(name, "hit")
+        self._misses = metrics.cache_lookups.labels(name, "miss")
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses.inc()
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._misses.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits.inc()
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,278 @@
+import logging
+import base64
+import json
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from ..db import get_collection
+from .. import config
+from .cache_service import ttl_lru_cache
+from . import membership_service
+
+logger = logging.getLogger(__name__)
+
+channels_collection = get_collection('channels')
+
+# user_id -> chat_list, plus partner_id -> user_ids whose cached list shows that partner,
+# so a profile edit can patch every list it appears in. Per worker: approvals,
+# deletions and activity update the lists on the worker that handled them, and
+# other workers show the old list for up to chat_list_cache_ttl seconds.
+chat_lists = ttl_lru_cache(config.chat_list_cache_size, config.chat_list_cache_ttl, "chat_lists")
+partner_index = {}
+_last_touched = {}
+
+
+class chat_list:
+    """The part of a user's chat list loaded so far, newest activity first."""
+
+    def __init__(self):
+        self.entries = []
+        self.complete = False
+
+
+def _sort_key(entry):
+    return (entry["last_activity_at"] or "", entry["channel_id"])
+
+
+def encode_cursor(entry):
+    raw = json.dumps({"t": entry["last_activity_at"], "id": entry["channel_id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Raises ValueError for anything encode_cursor could not have produced."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key = {"last_activity_at": data["t"], "channel_id": data["id"]}
+    except (KeyError, TypeError) as e:
+        raise ValueError("malformed cursor") from e
+
+    if not isinstance(key["channel_id"], str) or not ObjectId.is_valid(key["channel_id"]):
+        raise ValueError("malformed cursor")
+    if key["last_activity_at"] is not None:
+        if not isinstance(key["last_activity_at"], str):
+            raise ValueError("malformed cursor")
+        datetime.fromisoformat(key["last_activity_at"])
+    return key
+
+
+def _after(key: dict):
+    """Filter for channels sorted after ``key`` in (last_activity_at desc, _id desc) order."""
+    channel_oid = ObjectId(key["channel_id"])
+    if key["last_activity_at"] is None:
+        return {"last_activity_at": None, "_id": {"$lt": channel_oid}}
+
+    last_activity_at = datetime.fromisoformat(key["last_activity_at"])
+    return {"$or": [
+        {"last_activity_at": {"$lt": last_activity_at}},
+        {"last_activity_at": last_activity_at, "_id": {"$lt": channel_oid}},
+        {"last_activity_at": None}
+    ]}
+
+
+def _to_entry(doc):
+    last_activity_at = doc.get("last_activity_at")
+    return {
+        "channel_id": str(doc["channel_id"]),
+        "partner_id": str(doc["partner_id"]),
+        "last_activity_at": last_activity_at.isoformat() if isinstance(last_activity_at, datetime) else None,
+        "partner_details": {
+            "_id": str(doc["partner_details"]["_id"]),
+            "name": doc["partner_details"].get("name"),
+            "username": doc["partner_details"].get("username"),
+            "profile_photo_url": doc["partner_details"].get("profile_photo_url")
+        }
+    }
+
+
+async def _fetch(user_oid: ObjectId, after: dict | None, limit: int):
+    # Keys nobody has joined yet have no partner_id and are not chats.
+    match = {
+        "partner_id": { "$exists": True },
+        "$or": [
+            { "partner_id": user_oid },
+            { "user_id": user_oid }
+        ]
+    }
+    if after is not None:
+        match = {"$and": [match, _after(after)]}
+
+    docs = await channels_collection.aggregate([
+        { "$match": match },
+        { "$sort": { "last_activity_at": -1, "_id": -1 } },
+        { "$limit": limit },
+        # Identify who the partner (the other person) is
+        {
+            "$addFields": {
+                "partner_id": {
+                    "$cond": [
+                        { "$eq": ["$user_id", user_oid] },
+                        "$partner_id",
+                        "$user_id"
+                    ]
+                },
+                "channel_id": "$_id"
+            }
+        },
+        {
+            "$lookup": {
+                "from": "user",
+                "localField": "partner_id",
+                "foreignField": "_id",
+                "as": "partner_details",
+            }
+        },
+        { "$unwind": "$partner_details" },
+        {
+            "$project": {
+                "_id": 0,
+                "channel_id": 1,
+                "partner_id": 1,
+                "last_activity_at": 1,
+                "partner_details._id": 1,
+                "partner_details.name": 1,
+                "partner_details.username": 1,
+                "partner_details.profile_photo_url": 1
+            }
+        }
+    ]).to_list(length=limit)
+
+    return [_to_entry(doc) for doc in docs]
+
+
+def _index(user_id: str, entry: dict):
+    partner_index.setdefault(entry["partner_id"], set()).add(user_id)
+
+
+async def _extend(user_id: str, chats: chat_list, wanted: int | None):
+    """Loads more of the list from Mongo until it holds ``wanted`` entries (all of them for None)."""
+    user_oid = ObjectId(user_id)
+    while not chats.complete and (wanted is None or len(chats.entries) < wanted):
+        limit = config.chat_list_page_size
+        if wanted is not None:
+            limit = max(wanted - len(chats.entries), limit)
+        after = chats.entries[-1] if chats.entries else None
+        page = await _fetch(user_oid, after, limit)
+        if len(page) < limit:
+            chats.complete = True
+
+        # One entry per partner, like the original $group on partner_id.
+        seen = {entry["partner_id"] for entry in chats.entries}
+        for entry in page:
+            if entry["partner_id"] not in seen:
+                seen.add(entry["partner_id"])
+                chats.entries.append(entry)
+                _index(user_id, entry)
+        if not page:
+            chats.complete = True
+
+
+def _cached(user_id: str):
+    chats = chat_lists.get(user_id)
+    if chats is None:
+        chats = chat_list()
+        chat_lists.set(user_id, chats)
+    return chats
+
+
+async def get_chat_page(user_id: str, limit: int | None = None, cursor: str | None = None):
+    """Returns ``(chats, next_cursor)``; without ``limit`` the whole list is returned."""
+    chats = _cached(user_id)
+    position = _sort_key(decode_cursor(cursor)) if cursor else None
+
+    def start_index():
+        if position is None:
+            return 0
+        return next((i for i, entry in enumerate(chats.entries) if _sort_key(entry) < position), len(chats.entries))
+
+    if limit is None:
+        await _extend(user_id, chats, None)
+        return chats.entries[start_index():], None
+
+    # The cached list may have expired since the cursor was handed out; load up to it again.
+    start = start_index()
+    while start == len(chats.entries) and not chats.complete:
+        await _extend(user_id, chats, len(chats.entries) + config.chat_list_page_size)
+        start = start_index()
+
+    await _extend(user_id, chats, start + limit + 1)
+    page = chats.entries[start:start + limit]
+    has_more = len(chats.entries) > start + limit or not chats.complete
+    return page, encode_cursor(page[-1]) if page and has_more else None
+
+
+def _move_to_front(user_id: str, entry: dict):
+    chats = chat_lists.get(user_id)
+    if chats is None:
+        return
+    chats.entries = [e for e in chats.entries if e["channel_id"] != entry["channel_id"]]
+    chats.entries.insert(0, entry)
+    _index(user_id, entry)
+
+
+async def add_chat(channel_id, owner: dict, partner: dict, last_activity_at: datetime):
+    """Puts a newly connected channel at the top of both members' cached lists."""
+    for user, other in ((owner, partner), (partner, owner)):
+        _move_to_front(str(user["_id"]), _to_entry({
+            "channel_id": channel_id,
+            "partner_id": other["_id"],
+            "last_activity_at": last_activity_at,
+            "partner_details": other
+        }))
+
+
+def remove_chat(channel_id, *user_ids):
+    for user_id in user_ids:
+        chats = chat_lists.get(str(user_id))
+        if chats is not None:
+            chats.entries = [e for e in chats.entries if e["channel_id"] != str(channel_id)]
+
+
+def update_partner(partner_id, **details):
+    """Patches a user's name/username/photo in every cached list that shows them."""
+    for user_id in partner_index.get(str(partner_id), set()):
+        chats = chat_lists.get(user_id)
+        if chats is None:
+            continue
+        for entry in chats.entries:
+            if entry["partner_id"] == str(partner_id):
+                entry["partner_details"] = {**entry["partner_details"], **details}
+
+
+async def touch(channel_id: str, sender_id: str, recipient_id: str):
+    """Records activity on a channel, writing to Mongo at most once per interval.
+
+    Ignored unless the sender and recipient are the channel's two members;
+    both ids come straight from the client.
+    """
+    try:
+        membership = await membership_service.get_membership(channel_id)
+        if membership is None or membership.other(sender_id) != ObjectId(recipient_id):
+            return
+    except (InvalidId, TypeError):
+        return
+
+    now = time.monotonic()
+    if now - _last_touched.get(channel_id, 0) < config.chat_activity_interval:
+        return
+    _last_touched[channel_id] = now
+    if len(_last_touched) > config.chat_list_cache_size:
+        _last_touched.clear()
+
+    last_activity_at = datetime.now()
+    try:
+        await channels_collection.update_one({"_id": ObjectId(channel_id)}, {"$set": {"last_activity_at": last_activity_at}})
+    except Exception:
+        logger.exception("touch failed")
+        return
+
+    for user_id, partner_id in ((sender_id, recipient_id), (recipient_id, sender_id)):
+        chats = chat_lists.get(user_id)
+        if chats is None:
+            continue
+        entry = next((e for e in chats.entries if e["channel_id"] == channel_id), None)
+        if entry is not None:
+            _move_to_front(user_id, {**entry, "last_activity_at": last_activity_at.isoformat()})
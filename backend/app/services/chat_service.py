@@ -1,36 +1,194 @@
-import secrets
-import string
+import logging
 from ..db import get_collection
+from .. import config
+from .. import metrics
 from datetime import datetime
-import json
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
 
-keys_collection = get_collection('keys')
 queued_messages_collection = get_collection('queued_messages')
+sequences_collection = get_collection('delivery_sequences')
+
+
+async def reserve_sequence(recipient_id, count=1):
+    """Reserves ``count`` delivery sequence numbers and returns the highest one."""
+    counter = await sequences_collection.find_one_and_update(
+        {'_id': recipient_id},
+        {'$inc': {'seq': count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq']
+
 
+# Notifications that only carry the latest state of a channel. A newer one
+# replaces whatever is still queued for the same recipient under the same key.
+def collapse_key(message):
+    channel_id = message.get('channel_id')
+    if message.get('event') == 'update_public_key':
+        return f"update_public_key:{channel_id}:{message.get('sender_id')}"
+    if message.get('type') == 'e2ee_status' or message.get('event') == 'e2ee_notification':
+        return f"e2ee:{channel_id}"
+    return None
 
-async def genrate_key(length=16):
+
+async def _replace_collapsed(message, key):
+    # Only replaces a notification queued no later than this one: a stale one
+    # coming back from a closed connection must not overwrite newer state.
+    message.pop('_id', None)
+    message['collapse_key'] = key
+    query = {'recipient_id': message['recipient_id'], 'collapse_key': key, 'queued_at': {'$lte': message['queued_at']}}
     try:
-        characters = string.ascii_letters + string.digits
-        while True:
-            key = ''.join(secrets.choice(characters) for _ in range(length))
-            exists = await keys_collection.find_one({key: key})
-            if not exists:
-                return key
-    except Exception as e:
-        print("genrate_key error:", e)
+        result = await queued_messages_collection.replace_one(query, message, upsert=True)
+    except DuplicateKeyError:
+        # Either a newer one is queued, or a concurrent upsert won; retry in case it was older.
+        result = await queued_messages_collection.replace_one(query, message)
+    if result.upserted_id is None:
+        # It replaced an older notification, or a newer one made it redundant.
+        metrics.queued_messages_dropped.labels("collapsed").inc()
+
+
+async def _store(messages):
+    plain = []
+    for message in messages:
+        # Requeued messages keep the time they were first queued, so they
+        # still expire and are still trimmed as the oldest. Over the bus it
+        # arrives as a string.
+        queued_at = message.get('queued_at')
+        if isinstance(queued_at, str):
+            message['queued_at'] = datetime.fromisoformat(queued_at)
+        elif queued_at is None:
+            message['queued_at'] = datetime.utcnow()
+        key = collapse_key(message)
+        if key is None:
+            plain.append(message)
+        else:
+            await _replace_collapsed(message, key)
+    if plain:
+        await queued_messages_collection.insert_many(plain, ordered=False)
+
+
+async def trim_queue(recipient_id):
+    """Drops the recipient's oldest queued messages past the count and size caps."""
+    cursor = queued_messages_collection.aggregate([
+        {'$match': {'recipient_id': recipient_id}},
+        {'$sort': {'queued_at': -1}},
+        {'$project': {'size': {'$bsonSize': '$$ROOT'}}}
+    ])
+
+    kept, kept_bytes, reason, dropped = 0, 0, None, []
+    async for doc in cursor:
+        if reason is None:
+            if kept >= config.max_queued_messages:
+                reason = "cap_count"
+            elif kept_bytes + doc['size'] > config.max_queued_bytes:
+                reason = "cap_size"
+        if reason is not None:
+            dropped.append(doc['_id'])
+            continue
+        kept += 1
+        kept_bytes += doc['size']
+
+    if dropped:
+        await queued_messages_collection.delete_many({'_id': {'$in': dropped}})
+        metrics.queued_messages_dropped.labels(reason).inc(len(dropped))
+        logger.warning("trimmed offline queue", extra={"recipient_id": recipient_id, "dropped": len(dropped), "reason": reason})
+
+
+async def _trim_if_due(recipient_id, first_seq, last_seq):
+    # Checked once every queue_trim_interval sequence numbers per recipient.
+    interval = config.queue_trim_interval
+    if last_seq // interval != (first_seq - 1) // interval:
+        await trim_queue(recipient_id)
 
 
 async def queue_message(message):
     try:
-        await queued_messages_collection.insert_one(message)
-    except Exception as e:
-        print("queue_message error:", e)
+        if 'seq' not in message:
+            message['seq'] = await reserve_sequence(message['recipient_id'])
+        await _store([message])
+        await _trim_if_due(message['recipient_id'], message['seq'], message['seq'])
+    except Exception:
+        logger.exception("queue_message failed")
+
+
+async def queue_messages(messages):
+    """Queues many messages with one sequence reservation per recipient and one insert_many.
+
+    Returns False if they could not be stored.
+    """
+    try:
+        unsequenced = {}
+        for message in messages:
+            if 'seq' not in message:
+                unsequenced.setdefault(message['recipient_id'], []).append(message)
+        reserved = {}
+        for recipient_id, group in unsequenced.items():
+            last = await reserve_sequence(recipient_id, len(group))
+            for seq, message in enumerate(group, last - len(group) + 1):
+                message['seq'] = seq
+            reserved[recipient_id] = (last - len(group) + 1, last)
+        if messages:
+            await _store(messages)
+        for recipient_id, (first, last) in reserved.items():
+            await _trim_if_due(recipient_id, first, last)
+        return True
+    except Exception:
+        logger.exception("queue_messages failed")
+        return False
+
+
+async def requeue_messages(messages):
+    """Puts messages that already carry a sequence number back in the queue."""
+    try:
+        if messages:
+            await _store(messages)
+    except Exception:
+        logger.exception("requeue_messages failed")
+
+
+def strip_storage_fields(message):
+    """Removes what the queue adds to a message before it goes back to a client.
+
+    ``queued_at`` stays, so a message that is requeued again keeps its age.
+    """
+    for field in ('_id', 'collapse_key'):
+        message.pop(field, None)
+    return message
+
+
+async def iter_pending_batches(recipient_id, after_seq=0, batch_size=config.pending_batch_size):
+    """Yields the recipient's queued messages after ``after_seq`` in sequence order, ``batch_size`` at a time.
+
+    Messages queued before sequence numbers existed have no ``seq`` and come first.
+    """
+    cursor = queued_messages_collection.find({
+        'recipient_id': recipient_id,
+        '$or': [{'seq': {'$gt': after_seq}}, {'seq': {'$exists': False}}]
+    }).sort([('seq', 1), ('_id', 1)]).batch_size(batch_size)
+
+    batch = []
+    async for message in cursor:
+        batch.append(message)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def acknowledge_messages(message_ids):
+    try:
+        await queued_messages_collection.delete_many({'_id': {'$in': message_ids}})
+    except Exception:
+        logger.exception("acknowledge_messages failed")
 
 
-async def get_pending_messages(recipient_id):
+async def acknowledge_through(recipient_id, seq):
+    """Drops every queued message the recipient has confirmed up to and including ``seq``."""
     try:
-        pending_messages = await queued_messages_collection.find({'recipient_id': recipient_id}).to_list()
-        return pending_messages
-    except Exception as e:
-        print("get_pending_messages error:", e)
-        return []
+        await queued_messages_collection.delete_many({'recipient_id': recipient_id, 'seq': {'$lte': seq}})
+    except Exception:
+        logger.exception("acknowledge_through failed")
@@ -0,0 +1,46 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class executor_overloaded(Exception):
+    pass
+
+
+class bounded_executor:
+    """Runs blocking calls on a fixed pool with a bounded queue.
+
+    At most ``workers`` calls run at once and ``max_queue`` more may wait;
+    anything beyond that fails immediately with ``executor_overloaded`` so a
+    burst is shed instead of piling up behind the pool.
+
+    Use ``processes=True`` for work that holds the GIL. Worker processes are
+    spawned, so the callables must be importable without importing the app.
+    """
+
+    def __init__(self, workers: int, max_queue: int, name: str, processes: bool = False):
+        self.workers = workers
+        self.limit = workers + max_queue
+        self.pending = 0
+        self.rejected = 0
+        if processes:
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    async def run(self, fn, *args):
+        if self.pending >= self.limit:
+            self.rejected += 1
+            raise executor_overloaded(f"{self.pending} calls already pending")
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {"workers": self.workers, "pending": self.pending, "rejected": self.rejected}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
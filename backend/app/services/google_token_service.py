@@ -0,0 +1,142 @@
+import logging
+import asyncio
+import re
+import time
+
+import httpx
+from cryptography import x509
+from jose import jwt, JWTError
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# Firebase ID tokens are RS256 JWTs signed with the securetoken service
+# account; its certificates are published as {kid: PEM} with a Cache-Control
+# max-age. They are fetched at startup and refreshed in the background so a
+# sign-in never waits on Google.
+
+
+class invalid_token(Exception):
+    pass
+
+
+async def fetch_google_certs(url: str = config.google_certs_url):
+    """Default key source: returns ``({kid: PEM}, max_age_seconds)``."""
+    async with httpx.AsyncClient(timeout=10) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+
+    match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+    return response.json(), int(match.group(1)) if match else None
+
+
+def static_key_source(certs: dict, max_age: int | None = None):
+    """A local stand-in for the certificate endpoint, e.g. for tests."""
+    async def source():
+        return certs, max_age
+    return source
+
+
+class google_key_cache:
+    """Signing keys for Firebase ID tokens, kept warm by a background task.
+
+    ``get`` never does network I/O: an unknown ``kid`` (Google rotated keys
+    before our refresh) schedules an early refresh and is rejected for now.
+    Concurrent refreshes share one fetch.
+    """
+
+    def __init__(self, source=fetch_google_certs, refresh_interval: float = config.google_certs_refresh,
+                 min_refresh_interval: float = config.google_certs_min_refresh):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.refreshed_at = 0.0
+        self._next_refresh = 0.0
+        self._refreshing = None
+        self._task = None
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception("google_key_cache warm-up failed")
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def refresh(self):
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        return self._refreshing
+
+    async def _refresh(self):
+        certs, max_age = await self.source()
+        # Parse once here instead of on every verification.
+        self.keys = {
+            kid: x509.load_pem_x509_certificate(pem.encode()).public_key()
+            for kid, pem in certs.items()
+        }
+        self.refreshed_at = time.monotonic()
+        interval = self.refresh_interval if max_age is None else min(max_age * 0.8, self.refresh_interval)
+        self._next_refresh = self.refreshed_at + max(interval, self.min_refresh_interval)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(max(self._next_refresh - time.monotonic(), self.min_refresh_interval))
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("google_key_cache refresh failed")
+
+    def get(self, kid: str):
+        key = self.keys.get(kid)
+        if key is None and time.monotonic() - self.refreshed_at > self.min_refresh_interval:
+            self.refresh()
+        return key
+
+
+google_keys = google_key_cache()
+
+
+def _decode(token: str, key, project_id: str):
+    return jwt.decode(
+        token,
+        key,
+        algorithms=["RS256"],
+        audience=project_id,
+        issuer=f"https://securetoken.google.com/{project_id}",
+    )
+
+
+async def verify_id_token(token: str, project_id: str, keys: google_key_cache = google_keys):
+    """Verifies a Firebase ID token locally; returns its claims with ``uid`` set like firebase_admin does."""
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except JWTError as e:
+        raise invalid_token(str(e))
+
+    key = keys.get(kid)
+    if key is None:
+        raise invalid_token("Unknown signing key")
+
+    try:
+        # Signature checks are CPU work; keep them off the event loop.
+        claims = await asyncio.to_thread(_decode, token, key, project_id)
+    except JWTError as e:
+        raise invalid_token(str(e))
+
+    if not claims.get("sub") or claims.get("auth_time", 0) > time.time() + 60:
+        raise invalid_token("Invalid subject or auth_time")
+
+    claims["uid"] = claims["sub"]
+    return claims
@@ -0,0 +1,120 @@
+from bson import ObjectId
+
+from ..db import get_collection
+from .. import config
+from .cache_service import ttl_lru_cache
+
+channels_collection = get_collection('channels')
+
+# channel_id -> channel_membership, and the unordered member pair -> channel_id
+# for the routes that address a chat by the other user's id. Per worker, so
+# approve_request/delete_chat/delete_key invalidate locally and the TTL bounds
+# staleness on other workers. Channels still waiting for a partner are not
+# cached: their approval may happen on another worker. Neither is the E2EE
+# flag, which either member can toggle from any worker; see is_e2ee().
+memberships = ttl_lru_cache(config.membership_cache_size, config.membership_cache_ttl, "memberships")
+pairs = ttl_lru_cache(config.membership_cache_size, config.membership_cache_ttl, "membership_pairs")
+
+
+class channel_membership:
+    """Who is in a channel: the owner and, once a request was approved, the partner."""
+
+    def __init__(self, doc: dict):
+        self.channel_id = doc["_id"]
+        self.owner_id = doc["user_id"]
+        self.partner_id = doc.get("partner_id")
+
+    def is_member(self, user_id):
+        return ObjectId(user_id) in (self.owner_id, self.partner_id)
+
+    def other(self, user_id):
+        """The other member, or None if ``user_id`` is not in the channel (or it has no partner yet)."""
+        user_id = ObjectId(user_id)
+        if user_id == self.owner_id:
+            return self.partner_id
+        if user_id == self.partner_id:
+            return self.owner_id
+        return None
+
+
+def _pair_key(a, b):
+    return frozenset((str(a), str(b)))
+
+
+# Fields channel_membership is built from.
+_PROJECTION = {"user_id": 1, "partner_id": 1}
+
+
+def _remember(doc: dict):
+    membership = channel_membership(doc)
+    if membership.partner_id is not None:
+        memberships.set(str(membership.channel_id), membership)
+        pairs.set(_pair_key(membership.owner_id, membership.partner_id), str(membership.channel_id))
+    return membership
+
+
+async def get_membership(channel_id):
+    """Returns the channel's membership, or None if it does not exist."""
+    membership = memberships.get(str(channel_id))
+    if membership is not None:
+        return membership
+
+    doc = await channels_collection.find_one({"_id": ObjectId(channel_id)}, _PROJECTION)
+    return _remember(doc) if doc else None
+
+
+async def find_between(user_id, partner_id):
+    """Returns the membership of the chat between two users, or None."""
+    channel_id = pairs.get(_pair_key(user_id, partner_id))
+    if channel_id is not None:
+        membership = await get_membership(channel_id)
+        if membership is not None and membership.other(user_id) == ObjectId(partner_id):
+            return membership
+
+    doc = await channels_collection.find_one({
+        "$or": [
+            {"user_id": ObjectId(user_id), "partner_id": ObjectId(partner_id)},
+            {"user_id": ObjectId(partner_id), "partner_id": ObjectId(user_id)}
+        ]
+    }, _PROJECTION)
+    return _remember(doc) if doc else None
+
+
+async def partners_among(user_id, candidate_ids):
+    """The ids in ``candidate_ids`` that share an approved channel with ``user_id``.
+
+    Pairs already cached are answered from memory, the rest with one query.
+    """
+    user_oid = ObjectId(user_id)
+    partners, unknown = set(), []
+    for candidate in candidate_ids:
+        if not ObjectId.is_valid(candidate):
+            continue
+        if pairs.get(_pair_key(user_oid, candidate)) is not None:
+            partners.add(candidate)
+        else:
+            unknown.append(ObjectId(candidate))
+
+    if unknown:
+        async for doc in channels_collection.find({
+            "$or": [
+                {"user_id": user_oid, "partner_id": {"$in": unknown}},
+                {"partner_id": user_oid, "user_id": {"$in": unknown}}
+            ]
+        }, _PROJECTION):
+            partners.add(str(_remember(doc).other(user_oid)))
+
+    return [candidate for candidate in candidate_ids if candidate in partners]
+
+
+async def is_e2ee(channel_id):
+    """Whether the chat is end-to-end encrypted, read from Mongo every time."""
+    doc = await channels_collection.find_one({"_id": ObjectId(channel_id)}, {"is_e2ee": 1})
+    return doc.get("is_e2ee") if doc else None
+
+
+def invalidate(channel_id):
+    membership = memberships.get(str(channel_id))
+    memberships.invalidate(str(channel_id))
+    if membership is not None and membership.partner_id is not None:
+        pairs.invalidate(_pair_key(membership.owner_id, membership.partner_id))
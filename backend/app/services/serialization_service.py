@@ -0,0 +1,33 @@
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# orjson handles dict/list/str/int/float/bool/None and naive or aware datetimes
+# (ISO 8601, the same text datetime.isoformat() gives) natively; anything else
+# goes through _default. Subclasses of the native types, like bson's Int64,
+# are serialized as their base type.
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    """Encodes Mongo documents to JSON in a single pass: ObjectId as its hex
+    string, datetime as ISO 8601."""
+    return orjson.dumps(content, default=_default, option=_OPTIONS)
+
+
+class fast_json_response(JSONResponse):
+    """The app's default response class.
+
+    Routes that return documents straight from Mongo should return an instance
+    of it themselves: FastAPI only skips ``jsonable_encoder`` (which rejects
+    ObjectId) for Response objects.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
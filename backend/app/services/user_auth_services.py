@@ -1,4 +1,5 @@
-from passlib.context import CryptContext
+import logging
+from passlib.hash import bcrypt as password_hasher
 import os
 from datetime import timedelta, datetime
 from jose import JWTError, jwt
@@ -7,32 +8,53 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from bson import ObjectId
 from ..db import get_collection
-import secrets
-import string
+from .. import config
+from .cache_service import ttl_lru_cache
+from .executor_service import bounded_executor, executor_overloaded
+import time
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 secret_key = os.getenv('SECRET_KEY')
 algorithm = os.getenv('ALGORITHM')
 user_collection = get_collection('user')
 
+token_cache = ttl_lru_cache(config.token_cache_size, config.token_cache_ttl, "tokens")
+user_cache = ttl_lru_cache(config.user_cache_size, config.user_cache_ttl, "users")
+
+# bcrypt takes ~100-300ms per call and, with passlib's os_crypt backend,
+# holds the GIL, so it runs in worker processes rather than on the loop.
+password_executor = bounded_executor(config.password_workers, config.password_queue_size, "password", processes=True)
+
 
-def hash_password(password: str):
+async def _run_password_work(fn, *args):
     try:
-        return pwd_context.hash(password)
+        return await password_executor.run(fn, *args)
+    except executor_overloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-in attempts, try again shortly",
+            headers={"Retry-After": str(config.password_retry_after)},
+        )
+
+
+async def hash_password(password: str):
+    try:
+        return await _run_password_work(password_hasher.hash, password)
     except Exception as e:
-        print("hash_password error:", e)
+        logger.exception("hash_password failed")
         raise e
 
 
-def verify_password(password: str, hash_password: str):
+async def verify_password(password: str, hash_password: str):
     try:
-        return pwd_context.verify(password, hash_password)
+        return await _run_password_work(password_hasher.verify, password, hash_password)
     except Exception as e:
-        print("verify_password error:", e)
+        logger.exception("verify_password failed")
         raise e
 
 
@@ -48,14 +70,20 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         encoded_jwt = jwt.encode(to_encode, key=secret_key, algorithm=algorithm)
         return encoded_jwt
     except Exception as e:
-        print("create_access_token error:", e)
+        logger.exception("create_access_token failed")
         raise e
 
 
 def verify_token(token: str):
     try:
+        cached = token_cache.get(token)
+        if cached is not None:
+            return dict(cached)
+
         payload = jwt.decode(token, secret_key, algorithms=[algorithm])
-        return payload
+        # Never serve a token from cache past its own expiry.
+        token_cache.set(token, payload, payload['exp'] - time.time() if 'exp' in payload else None)
+        return dict(payload)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,44 +91,35 @@ def verify_token(token: str):
             headers={"WWW-Authenticate": "Bearer"},
         )
     except Exception as e:
-        print("verify_token error:", e)
+        logger.exception("verify_token failed")
         raise e
 
 
-async def create_username(name: str):
-    try:
-        username = name.lower()
-        username = username.replace(" ", "")
-        old_username = username
-
-        characters = string.digits
-
-        while True:
-            exists = await user_collection.find_one({"username": username})
-
-            if not exists:
-                return username
-            else:
-                username = old_username
-                key = ''.join(secrets.choice(characters) for _ in range(5))
-                username = username + key
-    except Exception as e:
-        print("create_username error:", e)
-
-
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = verify_token(token)
         return payload
-    except Exception as e:
-        print("get_current_user error:", e)
+    except Exception:
+        logger.exception("get_current_user failed")
 
 
 async def get_user_by_id(id: str):
     try:
+        cached = user_cache.get(str(id))
+        if cached is not None:
+            return dict(cached)
+
         user_collection = get_collection('user')
         data = await user_collection.find_one({"_id": ObjectId(id)}, {"_id", "email", "name", "username", "profile_photo_url", "role"})
+        if data is not None:
+            user_cache.set(str(id), data)
+            return dict(data)
         return data
-    except Exception as e:
-        print("get_user_by_id error:", e)
+    except Exception:
+        logger.exception("get_user_by_id failed")
         return None
+
+
+def invalidate_user(id):
+    """Drops the cached profile of a user whose document just changed."""
+    user_cache.invalidate(str(id))
@@ -1 +1,7 @@
-from .chat_websocket import router as websocket_router, manager
\ No newline at end of file
+from .chat_websocket import router as websocket_router, manager
+
+
+__all__ = [
+    "websocket_router",
+    "manager",
+]
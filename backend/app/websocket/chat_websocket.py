@@ -1,10 +1,21 @@
+import logging
 from fastapi import WebSocket, APIRouter
 from typing import Dict
+import asyncio
+import time
+from datetime import datetime, timezone
 from ..db import get_collection
-from ..services import user_auth_services
-from bson import ObjectId
-import json
-from ..services import user_auth_services,chat_service, clean_object_ids
+from ..services import user_auth_services, chat_service, chat_list_service
+from .delivery_bus import create_delivery_bus
+from .pending_drain import pending_drain
+from .connection import client_connection
+from .typing_coalescer import typing_coalescer
+from .rate_limit import token_bucket
+from .wire_format import negotiate, compact_message
+from .. import config
+from .. import metrics
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -14,15 +25,76 @@ channels_collection = get_collection('channels')
 
 class connection_manager:
 
-    def __init__(self):
-        self.active_connections : Dict[str, WebSocket] = {}
+    def __init__(self, bus=None):
+        self.active_connections : Dict[str, client_connection] = {}
+        self.bus = bus or create_delivery_bus()
+        self._heartbeat = None
+
+    async def start(self):
+        await self.bus.start(self.deliver_from_bus)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        await self.bus.stop()
+
+    async def _heartbeat_loop(self):
+        """Pings every socket each interval and drops the ones that have sent
+        nothing (not even a pong) for the idle timeout: a half-open TCP
+        connection otherwise looks online until a send fails."""
+        while True:
+            await asyncio.sleep(config.presence_ping_interval)
+            try:
+                idle_before = time.monotonic() - config.presence_idle_timeout
+                for user_id, connection in list(self.active_connections.items()):
+                    if connection.last_inbound < idle_before:
+                        connection.evict("idle timeout", code=1001)
+                    else:
+                        connection.ping()
+                await self.bus.touch_many(list(self.active_connections))
+            except Exception:
+                logger.exception("heartbeat failed")
+
+    async def presence(self, user_ids: list):
+        """``user_id -> {"online": bool, "last_seen": ISO 8601 (UTC) or None}``."""
+        presence = await self.bus.presence_many(user_ids)
+        for entry in presence.values():
+            if entry["last_seen"] is not None:
+                entry["last_seen"] = datetime.fromtimestamp(entry["last_seen"], timezone.utc).isoformat()
+        return presence
+
+    async def connect(self, websocket : WebSocket, id: str, resume_from: int | None = None):
+        codec = negotiate(websocket)
+        await websocket.accept(subprotocol=codec.subprotocol)
+        connection = client_connection(websocket, id, resume_from, codec=codec)
+        connection.on_evict = self.evict
+        await connection.open()
+        self.active_connections[id] = connection
+        metrics.ws_connections.set(len(self.active_connections))
+        await self.bus.register(id)
+        return connection
+
+    async def disconnect(self, id, connection : client_connection = None):
+        # A newer socket for the same user may already have replaced this one.
+        if connection is not None and self.active_connections.get(id) is not connection:
+            await self.redeliver(await connection.close())
+            return
+        connection = self.active_connections.pop(id, None)
+        metrics.ws_connections.set(len(self.active_connections))
+        await self.bus.unregister(id)
+        if connection is not None:
+            await self.redeliver(await connection.close())
 
-    async def connect(self, websocket : WebSocket, id: str):
-        await websocket.accept()
-        self.active_connections[id] = websocket
+    async def redeliver(self, messages: list):
+        """Sends what a closed connection still owed to wherever its user is now:
+        a newer connection, another worker or the offline queue. Each of those
+        stamps a new seq, above anything the client acked since reconnecting."""
+        if messages:
+            await self.send_messages_to_users(messages)
 
-    def disconnect(self, id):
-        self.active_connections.pop(id, None)
+    async def evict(self, connection : client_connection):
+        await self.disconnect(connection.user_id, connection)
 
     async def send_message(self, message, websocket: WebSocket):
         await websocket.send_json({
@@ -30,49 +102,196 @@ class connection_manager:
         })
 
     async def send_e2ee_activation_notification(self, recipient_id: str, isE2ee : bool, channel_id : str, sender_id : str):
-        if recipient_id in self.active_connections:
-            recipient_socket = self.active_connections[recipient_id]
-            await recipient_socket.send_json({ "event" : "e2ee_notification", "isE2ee" : isE2ee, "channel_id" : channel_id, "type" : "e2ee", "sender_id" : sender_id })
-        else:
-            await chat_service.queue_message(sender_id, recipient_id, { "isE2ee" : isE2ee, "channel_id" : channel_id }, 'e2ee')
+        await self.send_message_to_user({ "event" : "e2ee_notification", "isE2ee" : isE2ee, "channel_id" : channel_id, "type" : "e2ee", "sender_id" : sender_id, "recipient_id" : recipient_id }, sender_id, recipient_id)
 
     async def send_message_to_user(self, message: str, sender_id: str, recipient_id: str):
         
         if recipient_id in self.active_connections:
-            
-            recipient_socket = self.active_connections[recipient_id]
-            await recipient_socket.send_json(message)
+            await self.deliver_local(message, recipient_id)
+            return
+
+        # The recipient may be connected to another worker; hand it over directly
+        # instead of parking it in Mongo.
+        worker_id = await self.bus.locate(recipient_id)
+        if worker_id and worker_id != self.bus.worker_id:
+            if await self.bus.publish(worker_id, {"message": message, "sender_id": sender_id, "recipient_id": recipient_id}):
+                return
+
+        await self.queue_for_later(message)
+
+    async def send_messages_to_users(self, messages: list):
+        """Delivers many messages at once: one frame per online recipient and
+        a single insert for everyone offline.
+
+        Returns ``recipient_id -> "delivered" | "forwarded" | "queued" | "failed"``.
+        """
+        groups = {}
+        for message in messages:
+            groups.setdefault(message["recipient_id"], []).append(message)
+
+        outcomes, offline = {}, []
+        for recipient_id, group in groups.items():
+            if recipient_id in self.active_connections:
+                outcomes[recipient_id] = "delivered" if await self.deliver_local_many(group, recipient_id) else "queued"
+                continue
+
+            worker_id = await self.bus.locate(recipient_id)
+            if worker_id and worker_id != self.bus.worker_id:
+                if await self.bus.publish(worker_id, {"messages": group, "sender_id": group[0].get("sender_id"), "recipient_id": recipient_id}):
+                    outcomes[recipient_id] = "forwarded"
+                    continue
+
+            offline.extend(group)
+            outcomes[recipient_id] = "queued"
+
+        if offline and not await chat_service.queue_messages(offline):
+            for message in offline:
+                outcomes[message["recipient_id"]] = "failed"
+        return outcomes
+
+    async def deliver_from_bus(self, envelope: dict):
+        recipient_id = envelope["recipient_id"]
+        if "messages" in envelope:
+            if recipient_id in self.active_connections:
+                await self.deliver_local_many(envelope["messages"], recipient_id)
+            else:
+                await chat_service.queue_messages(envelope["messages"])
+        elif recipient_id in self.active_connections:
+            await self.deliver_local(envelope["message"], recipient_id)
         else:
-            if(message.get("event") == None or message.get("event") != "typing"):
-                await chat_service.queue_message(message)
+            # The user left between the presence lookup and the hand-over.
+            await self.queue_for_later(envelope["message"])
+
+    async def deliver_local(self, message: dict, recipient_id: str):
+        connection = self.active_connections[recipient_id]
+        try:
+            await connection.send(message)
+        except Exception as e:
+            # A dead recipient socket must not take the sender's loop down with it.
+            logger.warning("deliver_local failed", extra={"user_id": recipient_id, "error": repr(e)})
+            await self.queue_for_later(message)
+            await self.disconnect(recipient_id, connection)
+
+    async def deliver_local_many(self, messages: list, recipient_id: str):
+        """Returns False if the messages went to the offline queue instead."""
+        connection = self.active_connections[recipient_id]
+        try:
+            await connection.send_many(messages)
+            return True
+        except Exception as e:
+            logger.warning("deliver_local_many failed", extra={"user_id": recipient_id, "error": repr(e)})
+            await chat_service.queue_messages(messages)
+            await self.disconnect(recipient_id, connection)
+            return False
+
+    async def queue_for_later(self, message: dict):
+        # Typing indicators are only meaningful live.
+        if message.get("event") not in ("typing", "stop_typing"):
+            await chat_service.queue_message(message)
 
 manager = connection_manager()
 
+
+async def relay_batch(connection : client_connection, data : dict):
+    """Relays a ``{"event": "batch", "messages": [...]}`` envelope and answers
+    with a ``batch_result`` frame holding one result per item, in order."""
+    items = data.get("messages")
+    if not isinstance(items, list):
+        items = []
+
+    results, accepted = [], []
+    for index, item in enumerate(items):
+        if index >= config.ws_max_batch_size:
+            results.append({"status": "rejected", "error": "batch too large"})
+        elif not isinstance(item, dict) or not item.get("message_type") or not item.get("channel_id") or not item.get("recipient_id"):
+            results.append({"status": "rejected", "error": "invalid message"})
+        else:
+            results.append(None)
+            accepted.append((index, compact_message(item, connection.user_id)))
+
+    touched = set()
+    for _, message in accepted:
+        if message["channel_id"] not in touched:
+            touched.add(message["channel_id"])
+            await chat_list_service.touch(message["channel_id"], connection.user_id, message["recipient_id"])
+
+    outcomes = await manager.send_messages_to_users([message for _, message in accepted]) if accepted else {}
+    for index, message in accepted:
+        results[index] = {"message_id": message.get("message_id"), "status": outcomes[message["recipient_id"]]}
+
+    await connection.send_frame({"event": "batch_result", "batch_id": data.get("batch_id"), "results": results})
+
+
+def parse_resume(value: str | None):
+    """The ``resume`` query parameter as a seq, or None when absent; ValueError if malformed."""
+    if value is None:
+        return None
+    seq = int(value)
+    if seq < 0:
+        raise ValueError("resume must not be negative")
+    return seq
+
+
 @router.websocket('/ws/chat')
 async def chat_websocket(websocket : WebSocket):
 
     token = websocket.query_params.get("token")
     user = await user_auth_services.get_current_user(token)
-    print(f"User connected: {user['sub']}")
-    await manager.connect(websocket, user['sub'])
     try:
+        resume = parse_resume(websocket.query_params.get("resume"))
+    except ValueError:
+        logger.warning("closing connection: invalid resume", extra={"user_id": user['sub']})
+        await websocket.close(code=1008)
+        return
+    logger.info("user connected", extra={"user_id": user['sub']})
+    connection = await manager.connect(websocket, user['sub'], resume)
+    drain = pending_drain(connection)
+    drain_task = asyncio.create_task(drain.run())
 
-        pending_messages = await chat_service.get_pending_messages(user['sub'])
-        for message in pending_messages:
-            id = message['_id']
-            message.pop('_id', None)  # Remove _id from the message before sending
-            await websocket.send_json(clean_object_ids(message))
-            queued_messages_collection.delete_one({ "_id" : ObjectId(id) })
+    async def forward_typing(event, recipient_id, channel_id):
+        await manager.send_message_to_user({"event": event, "sender_id": user['sub'], "recipient_id": recipient_id, "channel_id": channel_id}, user['sub'], recipient_id)
+
+    typing = typing_coalescer(forward_typing)
+    bucket = token_bucket()
+    try:
 
         while True:
-            data = await websocket.receive_text()
-            data = json.loads(data)
+            data = await connection.codec.read(websocket)
+            connection.last_inbound = time.monotonic()
+            metrics.ws_frames_in.inc()
+
+            delay = bucket.reserve()
+            if delay:
+                if bucket.throttled_for() > config.ws_throttle_grace:
+                    logger.warning("closing connection: inbound rate limit exceeded", extra={"user_id": user['sub']})
+                    await websocket.close(code=1008)
+                    raise ConnectionError("inbound rate limit exceeded")
+                await asyncio.sleep(delay)
+
+            data = connection.codec.decode(data)
             
-            if(data.get("message_type")):
-                await manager.send_message_to_user({"message_id": data.get('message_id'), "channel_id": data['channel_id'], "sender_id" : user['sub'], "recipient_id" :  data['recipient_id'], "type": data.get('type'), "sub_type": data.get('sub_type'), "message": data.get('message'), "message_type": data.get('message_type'), "file_name": data.get('file_name'), "file_url": data.get('file_url'), "timestamp" : data.get('timestamp'), "file_exp" : data.get('file_exp'), "file_size": data.get('file_size'), "replied_message_id": data.get('replied_message_id')}, user['sub'], data['recipient_id'])
+            if(data.get("event") == "pong"):
+                continue
+            elif(data.get("event") == "ack"):
+                seq = data.get("seq")
+                # A malformed ack is ignored rather than tearing the socket down.
+                if isinstance(seq, int) and not isinstance(seq, bool):
+                    connection.acknowledge(seq)
+                    await drain.acknowledge(seq)
+            elif(data.get("message_type")):
+                await chat_list_service.touch(data['channel_id'], user['sub'], data['recipient_id'])
+                await manager.send_message_to_user(compact_message(data, user['sub']), user['sub'], data['recipient_id'])
+            elif data.get("event") == "batch":
+                await relay_batch(connection, data)
+            elif data.get("event") == "typing":
+                await typing.typing(data['recipient_id'], data['channel_id'])
+            elif data.get("event") == "stop_typing":
+                await typing.stop_typing(data['recipient_id'], data['channel_id'])
             elif data.get("event"):
                 await manager.send_message_to_user({"event": data.get("event"), "sender_id": user['sub'], "recipient_id": data['recipient_id'], "channel_id": data['channel_id']}, user['sub'], data['recipient_id'])
 
     except Exception as err:
-        manager.disconnect(user['sub'])
-        print(f"User disconnected", err)
+        drain_task.cancel()
+        await manager.disconnect(user['sub'], connection)
+        await typing.close()
+        logger.info("user disconnected", extra={"user_id": user['sub'], "reason": repr(err)})
@@ -0,0 +1,255 @@
+import logging
+import asyncio
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from fastapi import WebSocket
+
+from .. import config
+from .. import metrics
+from ..services import chat_service
+from .wire_format import json_codec
+
+logger = logging.getLogger(__name__)
+
+# Frames that only matter while the socket is up and are never queued for later.
+EPHEMERAL_EVENTS = ("typing", "stop_typing", "batch_result", "ping")
+
+
+class client_connection:
+    """A user's websocket together with the delivery state kept for it.
+
+    Nothing writes to the socket directly: frames go into a bounded
+    ``outbound`` queue that a dedicated writer task drains, so a slow
+    recipient never stalls the sender that produced the message. Repeated
+    ``typing`` events still waiting in the queue are coalesced. A connection
+    whose queue reaches the high-water mark, or whose send times out, is
+    evicted: the socket is closed and whatever it still owed the client goes
+    back to the offline queue.
+
+    Clients that connect with ``resume=<seq>`` speak the acknowledged protocol:
+    every message (other than ``typing``) is stamped with a per-recipient
+    ``seq`` and kept in ``unacked`` until the client sends
+    ``{"event": "ack", "seq": n}`` for it or anything later. Whatever is still
+    unacked when the socket goes away is handed back by ``close`` for
+    redelivery, so a failed send never loses a message. While the offline
+    queue is being replayed, live messages are held back so the client sees
+    them in order.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, resume_from: int | None = None,
+                 high_water: int = config.outbound_high_water, send_timeout: float = config.send_timeout,
+                 codec=None):
+        self.websocket = websocket
+        self.codec = codec or json_codec()
+        self.user_id = user_id
+        self.acks = resume_from is not None
+        self.resume_from = resume_from or 0
+        self.unacked = OrderedDict()
+        self.replaying = self.acks
+        self.outbound = deque()
+        self.high_water = high_water
+        self.send_timeout = send_timeout
+        self.closed = False
+        self.on_evict = None
+        self.last_inbound = time.monotonic()
+        self.last_send = None
+        self._held = []
+        self._typing = set()
+        self._ready = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._writer = None
+        self._in_flight = None
+        self._next_seq = 1
+        self._last_reserved = 0
+        self._reserve_lock = asyncio.Lock()
+
+    async def open(self):
+        if self.acks:
+            await self._reserve_block()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _reserve_block(self):
+        last = await chat_service.reserve_sequence(self.user_id, config.sequence_block_size)
+        self._next_seq = last - config.sequence_block_size + 1
+        self._last_reserved = last
+
+    async def _assign_seq(self):
+        if self._next_seq > self._last_reserved:
+            async with self._reserve_lock:
+                if self._next_seq > self._last_reserved:
+                    await self._reserve_block()
+        seq = self._next_seq
+        self._next_seq += 1
+        return seq
+
+    async def send(self, message: dict):
+        if self.closed:
+            raise ConnectionError("connection closed")
+        self.last_send = datetime.utcnow()
+
+        if not self.acks or message.get("event") == "typing":
+            self._enqueue(message)
+            return
+
+        self._check_held(1)
+        message = {**message, "seq": await self._assign_seq()}
+        self.unacked[message["seq"]] = message
+        if len(self.unacked) > config.max_unacked_messages:
+            await self._spill_oldest()
+
+        if self.replaying:
+            self._held.append(message)
+            return
+        self._enqueue(message)
+
+    async def send_many(self, messages: list):
+        """Sends several messages as one ``{"event": "batch"}`` frame.
+
+        Acking clients get a sequence number per message, exactly as with
+        ``send``. Older clients get one frame per message, as during replay.
+        """
+        if self.closed:
+            raise ConnectionError("connection closed")
+        self.last_send = datetime.utcnow()
+
+        if not self.acks:
+            for message in messages:
+                self._enqueue(message)
+            return
+
+        self._check_held(len(messages))
+        # Every seq is assigned before any message counts as sent: if reserving
+        # one fails, the caller queues the whole batch and close() must not
+        # hand part of it back a second time.
+        stamped = [{**message, "seq": await self._assign_seq()} for message in messages]
+        for message in stamped:
+            self.unacked[message["seq"]] = message
+        if len(self.unacked) > config.max_unacked_messages:
+            await self._spill_oldest()
+
+        if self.replaying:
+            self._held.extend(stamped)
+            return
+        self._enqueue({"event": "batch", "messages": stamped})
+
+    def _check_held(self, count: int):
+        # Replay can take a while on a deep queue; don't buffer live traffic without bound.
+        if self.replaying and len(self._held) + count > config.max_held_messages:
+            self.evict("too many messages held during replay")
+            raise ConnectionError("connection closed")
+
+    def ping(self):
+        """Queues a heartbeat; the client answers with ``{"event": "pong"}``."""
+        if not self.closed:
+            self._enqueue({"event": "ping"})
+
+    async def send_frame(self, frame: dict):
+        """Queues a bulk frame, waiting for the writer to catch up instead of evicting."""
+        await self._writable.wait()
+        if self.closed:
+            raise ConnectionError("connection closed")
+        self._enqueue(frame)
+
+    def _enqueue(self, frame: dict):
+        if frame.get("event") == "typing":
+            key = (frame.get("sender_id"), frame.get("channel_id"))
+            if key in self._typing:
+                return
+            self._typing.add(key)
+
+        self.outbound.append(frame)
+        self._ready.set()
+        if len(self.outbound) >= self.high_water // 2:
+            self._writable.clear()
+        if len(self.outbound) >= self.high_water:
+            self.evict("outbound queue full")
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self.outbound:
+                    self._ready.clear()
+                    await self._ready.wait()
+
+                frame = self._in_flight = self.outbound.popleft()
+                if frame.get("event") == "typing":
+                    self._typing.discard((frame.get("sender_id"), frame.get("channel_id")))
+                if len(self.outbound) < self.high_water // 2:
+                    self._writable.set()
+
+                await asyncio.wait_for(self.codec.write(self.websocket, frame), self.send_timeout)
+                metrics.ws_frames_out.inc()
+                self._in_flight = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.evict(f"send failed: {e!r}")
+
+    def evict(self, reason: str, code: int = 1013):
+        if self.closed:
+            return
+        logger.warning("evicting connection", extra={"user_id": self.user_id, "reason": reason})
+        self.closed = True
+        self._writable.set()
+        asyncio.create_task(self._close_socket(code))
+        if self.on_evict:
+            asyncio.create_task(self.on_evict(self))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def finish_replay(self):
+        while self._held:
+            await self._writable.wait()
+            if self.closed:
+                return
+            self._enqueue(self._held.pop(0))
+        self.replaying = False
+
+    def acknowledge(self, seq: int):
+        while self.unacked and next(iter(self.unacked)) <= seq:
+            self.unacked.popitem(last=False)
+
+    async def _spill_oldest(self):
+        # The client is not keeping up with acks; park half of what it owes us
+        # in Mongo. It is replayed on the next reconnect and the client drops
+        # anything it already has by seq. Spilled messages keep their seq: only
+        # the current connection spills, and its seqs are the newest reserved.
+        spill = [self.unacked.popitem(last=False)[1] for _ in range(len(self.unacked) // 2)]
+        await chat_service.requeue_messages([dict(message) for message in spill])
+
+    async def close(self):
+        """Stops the writer and returns the messages the client may not have received.
+
+        They come back without their ``seq``. By the time a stale socket is
+        closed the user may have reconnected and acked past it, so whoever
+        redelivers them has to stamp them afresh. Messages that were never
+        queued get ``queued_at`` set to the last send on this connection, which
+        is no later than any message produced after it went stale.
+        """
+        self.closed = True
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._writer = None
+
+        if self.acks:
+            # Batch frames are still in Mongo until acked; only live messages need saving.
+            owed = list(self.unacked.values())
+            self.unacked.clear()
+        else:
+            # The frame being written when the socket died may not have arrived.
+            if self._in_flight is not None:
+                self.outbound.appendleft(self._in_flight)
+            owed = list(self.outbound)
+        self._in_flight = None
+        self.outbound.clear()
+        return [
+            {"queued_at": self.last_send, **{field: value for field, value in message.items() if field != "seq"}}
+            for message in owed if message.get("event") not in EPHEMERAL_EVENTS
+        ]
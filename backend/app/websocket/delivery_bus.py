@@ -0,0 +1,235 @@
+import logging
+import asyncio
+import json
+import time
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_KEY = "cipherchats:presence"
+LAST_SEEN_KEY = "cipherchats:last_seen"
+DELIVERY_CHANNEL = "cipherchats:deliver:{}"
+
+# Only removes the presence entry if it still points at the worker asking for it,
+# so a reconnect that already landed on another worker is not erased.
+_HDEL_IF_EQUAL = """
+if redis.call('hget', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('hdel', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class in_memory_bus:
+    """Delivery bus for a single process: every user is either here or offline."""
+
+    def __init__(self, worker_id: str = config.worker_id):
+        self.worker_id = worker_id
+        self.presence = {}
+        self.last_seen = {}
+
+    async def start(self, on_delivery):
+        pass
+
+    async def stop(self):
+        self.presence.clear()
+
+    async def register(self, user_id: str):
+        self.presence[user_id] = self.worker_id
+        self.last_seen[user_id] = time.time()
+
+    async def unregister(self, user_id: str):
+        self.presence.pop(user_id, None)
+        self.last_seen[user_id] = time.time()
+
+    async def locate(self, user_id: str):
+        return self.presence.get(user_id)
+
+    async def touch_many(self, user_ids: list):
+        now = time.time()
+        for user_id in user_ids:
+            self.last_seen[user_id] = now
+
+    async def presence_many(self, user_ids: list):
+        return {
+            user_id: {"online": user_id in self.presence, "last_seen": self.last_seen.get(user_id)}
+            for user_id in user_ids
+        }
+
+    async def publish(self, worker_id: str, envelope: dict):
+        # There is no other worker to hand the message to.
+        return False
+
+
+class broker_bus:
+    """Delivery bus backed by a pub/sub broker shared by every worker.
+
+    Each worker writes ``user_id -> worker_id`` into a shared presence hash and
+    listens on its own delivery channel. Senders look the recipient up in the
+    presence map and publish straight to the owning worker's channel.
+
+    Workers also refresh ``user_id -> last seen (epoch seconds)`` for their
+    users on every heartbeat. A presence entry whose last-seen time is older
+    than the idle timeout belongs to a worker that died without cleaning up,
+    and is reported offline.
+    """
+
+    def __init__(self, broker, worker_id: str = config.worker_id):
+        self.broker = broker
+        self.worker_id = worker_id
+        self._on_delivery = None
+
+    async def start(self, on_delivery):
+        self._on_delivery = on_delivery
+        await self.broker.subscribe(DELIVERY_CHANNEL.format(self.worker_id), self._handle)
+
+    async def stop(self):
+        await self.broker.unsubscribe(DELIVERY_CHANNEL.format(self.worker_id))
+        await self.broker.close()
+
+    async def _handle(self, payload: str):
+        try:
+            await self._on_delivery(json.loads(payload))
+        except Exception:
+            logger.exception("delivery_bus handle failed")
+
+    async def register(self, user_id: str):
+        await self.broker.hset(PRESENCE_KEY, user_id, self.worker_id)
+        await self.broker.hset(LAST_SEEN_KEY, user_id, str(time.time()))
+
+    async def unregister(self, user_id: str):
+        await self.broker.hdel_if_equal(PRESENCE_KEY, user_id, self.worker_id)
+        await self.broker.hset(LAST_SEEN_KEY, user_id, str(time.time()))
+
+    async def locate(self, user_id: str):
+        return await self.broker.hget(PRESENCE_KEY, user_id)
+
+    async def touch_many(self, user_ids: list):
+        if user_ids:
+            now = str(time.time())
+            await self.broker.hset_many(LAST_SEEN_KEY, {user_id: now for user_id in user_ids})
+
+    async def presence_many(self, user_ids: list):
+        if not user_ids:
+            return {}
+        workers = await self.broker.hmget(PRESENCE_KEY, user_ids)
+        seen = await self.broker.hmget(LAST_SEEN_KEY, user_ids)
+        stale_before = time.time() - config.presence_idle_timeout
+
+        presence = {}
+        for user_id, worker_id, last_seen in zip(user_ids, workers, seen):
+            last_seen = float(last_seen) if last_seen is not None else None
+            presence[user_id] = {
+                "online": worker_id is not None and last_seen is not None and last_seen >= stale_before,
+                "last_seen": last_seen
+            }
+        return presence
+
+    async def publish(self, worker_id: str, envelope: dict):
+        receivers = await self.broker.publish(DELIVERY_CHANNEL.format(worker_id), json.dumps(envelope, default=str))
+        if not receivers:
+            # The owning worker is gone; drop its stale presence entry so the
+            # next message goes straight to the offline queue.
+            await self.broker.hdel_if_equal(PRESENCE_KEY, envelope["recipient_id"], worker_id)
+            return False
+        return True
+
+
+class redis_broker:
+    """Broker client for ``broker_bus`` on top of Redis hashes and pub/sub."""
+
+    def __init__(self, url: str = config.redis_url):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._pubsub = self._redis.pubsub()
+        self._hdel_if_equal = self._redis.register_script(_HDEL_IF_EQUAL)
+        self._reader = None
+
+    async def hset(self, key: str, field: str, value: str):
+        await self._redis.hset(key, field, value)
+
+    async def hget(self, key: str, field: str):
+        return await self._redis.hget(key, field)
+
+    async def hset_many(self, key: str, mapping: dict):
+        await self._redis.hset(key, mapping=mapping)
+
+    async def hmget(self, key: str, fields: list):
+        return await self._redis.hmget(key, fields)
+
+    async def hdel_if_equal(self, key: str, field: str, value: str):
+        await self._hdel_if_equal(keys=[key], args=[field, value])
+
+    async def publish(self, channel: str, payload: str):
+        return await self._redis.publish(channel, payload)
+
+    async def subscribe(self, channel: str, handler):
+        await self._pubsub.subscribe(channel)
+        self._reader = asyncio.create_task(self._read(handler))
+
+    async def unsubscribe(self, channel: str):
+        await self._pubsub.unsubscribe(channel)
+
+    async def _read(self, handler):
+        async for message in self._pubsub.listen():
+            if message["type"] == "message":
+                await handler(message["data"])
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+
+class local_broker:
+    """In-process stand-in for ``redis_broker``.
+
+    Several ``broker_bus`` instances sharing one ``local_broker`` behave like
+    separate workers talking through Redis, which is what tests need.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.subscribers = {}
+
+    async def hset(self, key: str, field: str, value: str):
+        self.hashes.setdefault(key, {})[field] = value
+
+    async def hget(self, key: str, field: str):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hset_many(self, key: str, mapping: dict):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    async def hmget(self, key: str, fields: list):
+        entries = self.hashes.get(key, {})
+        return [entries.get(field) for field in fields]
+
+    async def hdel_if_equal(self, key: str, field: str, value: str):
+        entries = self.hashes.get(key, {})
+        if entries.get(field) == value:
+            del entries[field]
+
+    async def publish(self, channel: str, payload: str):
+        handlers = self.subscribers.get(channel, [])
+        for handler in handlers:
+            asyncio.create_task(handler(payload))
+        return len(handlers)
+
+    async def subscribe(self, channel: str, handler):
+        self.subscribers.setdefault(channel, []).append(handler)
+
+    async def unsubscribe(self, channel: str):
+        self.subscribers.pop(channel, None)
+
+    async def close(self):
+        pass
+
+
+def create_delivery_bus():
+    if config.delivery_bus_backend == "redis":
+        return broker_bus(redis_broker())
+    return in_memory_bus()
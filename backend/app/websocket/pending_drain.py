@@ -0,0 +1,79 @@
+import logging
+import asyncio
+from collections import deque
+
+from .. import config
+from ..services import chat_service
+from .connection import client_connection
+
+logger = logging.getLogger(__name__)
+
+
+class pending_drain:
+    """Replays a user's offline queue to their socket in batches.
+
+    Acking clients get one ``{"event": "batch"}`` frame per batch and resume
+    from the ``seq`` they last confirmed. Queued documents are removed only
+    when an ack covers them, with one ``delete_many`` per ack, and at most
+    ``window`` batches are unconfirmed at any time, so memory stays bounded
+    however deep the queue is. Older clients get one frame per message and
+    each batch is deleted as soon as it has been handed to the connection's
+    writer.
+    """
+
+    def __init__(self, connection: client_connection, window: int = config.pending_batch_window):
+        self.connection = connection
+        self.window = window
+        self.replayed_through = connection.resume_from
+        self.acked_through = connection.resume_from
+        self._inflight = deque()
+        self._acked = asyncio.Event()
+
+    async def run(self):
+        connection = self.connection
+        try:
+            if connection.acks:
+                # The client already has everything up to its resume point.
+                await chat_service.acknowledge_through(connection.user_id, connection.resume_from)
+
+            async for messages in chat_service.iter_pending_batches(connection.user_id, after_seq=connection.resume_from):
+                message_ids = [message['_id'] for message in messages]
+                unsequenced_ids = [message['_id'] for message in messages if 'seq' not in message]
+                for message in messages:
+                    chat_service.strip_storage_fields(message)
+
+                if not connection.acks:
+                    for message in messages:
+                        await connection.send_frame(message)
+                    await chat_service.acknowledge_messages(message_ids)
+                    continue
+
+                while len(self._inflight) >= self.window:
+                    self._acked.clear()
+                    await self._acked.wait()
+
+                await connection.send_frame({"event": "batch", "messages": messages})
+                if unsequenced_ids:
+                    # Queued before sequence numbers existed; nothing can ack them.
+                    await chat_service.acknowledge_messages(unsequenced_ids)
+
+                sequenced = [message['seq'] for message in messages if 'seq' in message]
+                if sequenced:
+                    self.replayed_through = max(self.replayed_through, sequenced[-1])
+                    self._inflight.append(self.replayed_through)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("pending_drain failed")
+
+        await connection.finish_replay()
+
+    async def acknowledge(self, seq: int):
+        through = min(seq, self.replayed_through)
+        if through > self.acked_through:
+            await chat_service.acknowledge_through(self.connection.user_id, through)
+            self.acked_through = through
+
+        while self._inflight and self._inflight[0] <= seq:
+            self._inflight.popleft()
+        self._acked.set()
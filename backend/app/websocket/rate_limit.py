@@ -0,0 +1,38 @@
+import time
+
+from .. import config
+
+
+class token_bucket:
+    """Inbound frame budget for one connection: ``rate`` frames a second,
+    with bursts of up to ``burst``.
+
+    ``reserve`` always takes a token, going into debt when the bucket is
+    empty, and returns how long the caller should wait before acting on the
+    frame. The websocket loop sleeps that long before reading again, which
+    pushes back on the client through TCP instead of dropping its frames.
+    ``throttled_for`` says how long the bucket has been continuously empty.
+    """
+
+    def __init__(self, rate: float = config.ws_frame_rate, burst: int = config.ws_frame_burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.empty_since = None
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            self.empty_since = None
+            return 0.0
+        if self.empty_since is None:
+            self.empty_since = now
+        return -self.tokens / self.rate
+
+    def throttled_for(self) -> float:
+        return 0.0 if self.empty_since is None else time.monotonic() - self.empty_since
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from .. import config
+
+
+class _typing_state:
+    __slots__ = ("recipient_id", "last_forwarded", "last_seen", "timer")
+
+    def __init__(self, recipient_id: str, now: float):
+        self.recipient_id = recipient_id
+        self.last_forwarded = now
+        self.last_seen = now
+        self.timer = None
+
+
+class typing_coalescer:
+    """Collapses one sender's typing notifications, per channel.
+
+    Clients send ``typing`` on every keystroke. The first one in a channel is
+    forwarded, after which at most one more goes out per ``window`` seconds.
+    ``stop_typing`` is forwarded only while the sender is shown as typing, and
+    is sent on the sender's behalf once no ``typing`` has arrived for
+    ``timeout`` seconds or when the connection closes.
+
+    ``forward(event, recipient_id, channel_id)`` does the actual send.
+    """
+
+    def __init__(self, forward, window: float = config.typing_window, timeout: float = config.typing_timeout):
+        self.forward = forward
+        self.window = window
+        self.timeout = timeout
+        self._active = {}
+        self._tasks = set()
+
+    async def typing(self, recipient_id: str, channel_id: str):
+        now = time.monotonic()
+        state = self._active.get(channel_id)
+        if state is not None and state.recipient_id == recipient_id:
+            state.last_seen = now
+            if now - state.last_forwarded < self.window:
+                return
+            state.last_forwarded = now
+        else:
+            if state is not None:
+                await self._stop(channel_id, state)
+            state = self._active[channel_id] = _typing_state(recipient_id, now)
+            self._arm(channel_id, self.timeout)
+
+        await self.forward("typing", recipient_id, channel_id)
+
+    async def stop_typing(self, recipient_id: str, channel_id: str):
+        state = self._active.get(channel_id)
+        if state is not None and state.recipient_id == recipient_id:
+            await self._stop(channel_id, state)
+
+    async def close(self):
+        for channel_id, state in list(self._active.items()):
+            await self._stop(channel_id, state)
+        for task in self._tasks:
+            task.cancel()
+
+    async def _stop(self, channel_id: str, state: _typing_state):
+        # An expiry task can run after the client already stopped, or after
+        # typing() replaced the state for another recipient; leave those alone.
+        if self._active.get(channel_id) is not state:
+            return
+        del self._active[channel_id]
+        if state.timer is not None:
+            state.timer.cancel()
+        await self.forward("stop_typing", state.recipient_id, channel_id)
+
+    def _arm(self, channel_id: str, delay: float):
+        # One timer per channel, pushed back lazily instead of on every keystroke.
+        self._active[channel_id].timer = asyncio.get_running_loop().call_later(delay, self._expire, channel_id)
+
+    def _expire(self, channel_id: str):
+        state = self._active.get(channel_id)
+        if state is None:
+            return
+        idle = time.monotonic() - state.last_seen
+        if idle < self.timeout:
+            self._arm(channel_id, self.timeout - idle)
+            return
+
+        state.timer = None
+        task = asyncio.create_task(self._stop(channel_id, state))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
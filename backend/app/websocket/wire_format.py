@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import msgpack
+import orjson
+from bson import ObjectId
+from fastapi import WebSocket
+
+from ..services.serialization_service import dumps
+
+# Subprotocols a client may offer in Sec-WebSocket-Protocol, most compact first.
+# Clients that offer none get JSON text frames, as before.
+MSGPACK_SUBPROTOCOL = "cipherchats.msgpack.v1"
+JSON_SUBPROTOCOL = "cipherchats.json.v1"
+
+# Fields a chat message may carry besides channel, sender and recipient.
+MESSAGE_FIELDS = (
+    "message_id", "type", "sub_type", "message", "message_type", "file_name", "file_url",
+    "timestamp", "file_exp", "file_size", "replied_message_id"
+)
+
+
+def compact_message(data: dict, sender_id: str) -> dict:
+    """The message to relay for an inbound frame, without the fields it left empty."""
+    message = {"channel_id": data["channel_id"], "sender_id": sender_id, "recipient_id": data["recipient_id"]}
+    for field in MESSAGE_FIELDS:
+        value = data.get(field)
+        if value is not None:
+            message[field] = value
+    return message
+
+
+class json_codec:
+    """JSON in text frames; permessage-deflate (negotiated by the server) compresses them."""
+
+    def __init__(self, subprotocol: str | None = None):
+        self.subprotocol = subprotocol
+
+    async def read(self, websocket: WebSocket):
+        return await websocket.receive_text()
+
+    def decode(self, raw) -> dict:
+        return orjson.loads(raw)
+
+    async def write(self, websocket: WebSocket, frame: dict):
+        await websocket.send_text(dumps(frame).decode())
+
+
+def _msgpack_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not MessagePack serializable: {type(value).__name__}")
+
+
+class msgpack_codec:
+    """MessagePack in binary frames."""
+
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def __init__(self):
+        self._packer = msgpack.Packer(default=_msgpack_default, use_bin_type=True)
+
+    async def read(self, websocket: WebSocket):
+        return await websocket.receive_bytes()
+
+    def decode(self, raw) -> dict:
+        return msgpack.unpackb(raw, raw=False)
+
+    async def write(self, websocket: WebSocket, frame: dict):
+        await websocket.send_bytes(self._packer.pack(frame))
+
+
+def negotiate(websocket: WebSocket):
+    """Picks the codec for the first subprotocol the client offered that we speak."""
+    for subprotocol in websocket.scope.get("subprotocols") or ():
+        if subprotocol == MSGPACK_SUBPROTOCOL:
+            return msgpack_codec()
+        if subprotocol == JSON_SUBPROTOCOL:
+            return json_codec(JSON_SUBPROTOCOL)
+    return json_codec()
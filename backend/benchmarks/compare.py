@@ -0,0 +1,69 @@
+"""Compares two load_test result files and exits non-zero on a regression.
+
+A scenario regresses when its p95 or p99 latency grows, or its throughput
+drops, by more than ``--threshold`` percent; so does the event-loop lag p99.
+
+    cd backend && python -m benchmarks.compare benchmarks/results/abc123.json benchmarks/results/def456.json
+"""
+import argparse
+import json
+import sys
+
+# (metric, True if higher is better)
+METRICS = (("p95_ms", False), ("p99_ms", False), ("throughput_per_s", True))
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    rows, regressions = [], []
+
+    def check(name, metric, before, after, higher_is_better):
+        delta = change(before, after)
+        worse = delta is not None and (-delta if higher_is_better else delta) > threshold
+        rows.append((name, metric, before, after, delta, worse))
+        if worse:
+            regressions.append(f"{name}.{metric}")
+
+    for name, result in candidate["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            check(name, metric, base.get(metric), result.get(metric), higher_is_better)
+
+    if baseline.get("event_loop_lag") and candidate.get("event_loop_lag"):
+        check("event_loop_lag", "p99_ms", baseline["event_loop_lag"]["p99_ms"], candidate["event_loop_lag"]["p99_ms"], False)
+
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed change in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    for name, metric, before, after, delta, worse in rows:
+        delta = "n/a" if delta is None else f"{delta:+.1f}%"
+        print(f"{name:16} {metric:18} {before!s:>10} {after!s:>10} {delta:>9}{'  REGRESSION' if worse else ''}")
+
+    if regressions:
+        print(f"regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
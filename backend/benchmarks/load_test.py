@@ -0,0 +1,382 @@
+"""Load test for the REST and websocket hot paths.
+
+Drives a running server (or one it starts itself with ``--spawn``) with:
+
+- ``ws``: pairs of /ws/chat clients exchanging messages, with clients
+  dropping off and resuming so part of the traffic goes through
+  queued_messages; latency is send -> receive on the partner's socket;
+- ``get_chats``, ``get_keys_data``, ``signin`` and ``upload``: concurrent
+  request loops against each endpoint.
+
+Every run writes p50/p95/p99 latency and throughput per scenario, plus the
+server's event-loop lag (from its /metrics histogram), to a JSON file named
+after the current commit, so ``benchmarks.compare`` can diff two runs.
+
+``--spawn`` starts uvicorn against MONGO_URL (default: a local mongod) with a
+throwaway database, dropped again on exit, and Azurite
+(``UseDevelopmentStorage=true``) as the blob store, so nothing touches real
+data:
+
+    cd backend && python -m benchmarks.load_test --spawn --clients 50 --duration 30
+
+Add ``--in-memory`` to need neither: the server then runs on mongomock
+(``pip install mongomock-motor``) and keeps blobs in memory. The numbers
+say more about mongomock than about MongoDB, so use it to smoke-test the
+hot paths and compare runs against each other, not against production.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+from websockets.asyncio.client import connect
+
+SCENARIOS = ("ws", "get_chats", "get_keys_data", "signin", "upload")
+PASSWORD = "load-test-password"
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class recorder:
+    """Latencies (seconds) and error count for one scenario."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def summary(self, seconds: float):
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        return {
+            "count": len(self.latencies),
+            "errors": self.errors,
+            "throughput_per_s": round(len(self.latencies) / seconds, 1) if seconds else 0.0,
+            "p50_ms": ms(percentile(self.latencies, 0.50)),
+            "p95_ms": ms(percentile(self.latencies, 0.95)),
+            "p99_ms": ms(percentile(self.latencies, 0.99)),
+        }
+
+
+class test_user:
+    def __init__(self, index: int, run_id: str):
+        self.username = f"lt_{run_id}_{index}"
+        self.email = f"{self.username}@example.com"
+        self.token = None
+        self.user_id = None
+        self.partner = None
+        self.channel_id = None
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+async def setup_users(http: httpx.AsyncClient, count: int, run_id: str):
+    """Signs up ``count`` users and pairs them into approved chats."""
+    users = [test_user(i, run_id) for i in range(count - count % 2)]
+
+    async def signup(user):
+        response = await http.post("/auth/signup", json={
+            "email": user.email, "password": PASSWORD, "username": user.username, "name": user.username
+        })
+        response.raise_for_status()
+        user.token = response.json()["access_token"]
+        profile = await http.get("/user/profile", headers=user.headers)
+        user.user_id = profile.json()["_id"]
+
+    await asyncio.gather(*(signup(user) for user in users))
+
+    async def pair(owner, joiner):
+        created = (await http.post("/chat/create", json={"note": "load test"}, headers=owner.headers)).json()
+        (await http.post("/chat/join", json={"key": created["key"]}, headers=joiner.headers)).raise_for_status()
+        keys = (await http.get("/get_keys_data", headers=owner.headers)).json()["keys_data"]
+        request_id = next(
+            request["_id"] for key in keys if key["key"]["_id"] == created["channel_id"] for request in key["requests"]
+        )
+        (await http.patch(f"/approve-request/{request_id}", headers=owner.headers)).raise_for_status()
+        owner.partner, joiner.partner = joiner, owner
+        owner.channel_id = joiner.channel_id = created["channel_id"]
+        # Leave an open key behind too, so get_keys_data has something to page.
+        await http.post("/chat/create", json={"note": "spare"}, headers=owner.headers)
+
+    await asyncio.gather(*(pair(users[i], users[i + 1]) for i in range(0, len(users), 2)))
+    return users
+
+
+class ws_client:
+    """One user's socket: sends to its partner, acks what it receives, and
+    drops off now and then to exercise the offline queue."""
+
+    def __init__(self, user: test_user, ws_url: str, sent: dict, stats: recorder, rate: float, churn: float):
+        self.user = user
+        self.ws_url = ws_url
+        self.sent = sent
+        self.stats = stats
+        self.rate = rate
+        self.churn = churn
+        self.last_seq = 0
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                url = f"{self.ws_url}/ws/chat?token={self.user.token}&resume={self.last_seq}"
+                async with connect(url, max_size=None) as socket:
+                    online_for = random.expovariate(self.churn) if self.churn else float("inf")
+                    reader = asyncio.create_task(self._read(socket))
+                    try:
+                        await self._send(socket, stop, time.perf_counter() + online_for)
+                    finally:
+                        reader.cancel()
+            except Exception:
+                self.stats.errors += 1
+            if not stop.is_set():
+                await asyncio.sleep(random.uniform(0.5, 2.0))
+
+    async def _send(self, socket, stop: asyncio.Event, until: float):
+        while not stop.is_set() and time.perf_counter() < until:
+            message_id = uuid.uuid4().hex
+            self.sent[message_id] = time.perf_counter()
+            await socket.send(json.dumps({
+                "message_id": message_id,
+                "channel_id": self.user.channel_id,
+                "recipient_id": self.user.partner.user_id,
+                "message_type": "text",
+                "type": "message",
+                "message": "x" * 120,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }))
+            await asyncio.sleep(random.expovariate(self.rate))
+
+    async def _read(self, socket):
+        async for raw in socket:
+            frame = json.loads(raw)
+            if frame.get("event") == "ping":
+                await socket.send(json.dumps({"event": "pong"}))
+                continue
+
+            messages = frame["messages"] if frame.get("event") == "batch" else [frame]
+            for message in messages:
+                sent_at = self.sent.pop(message.get("message_id"), None)
+                if sent_at is not None:
+                    self.stats.latencies.append(time.perf_counter() - sent_at)
+                if message.get("seq", 0) > self.last_seq:
+                    self.last_seq = message["seq"]
+            if self.last_seq:
+                await socket.send(json.dumps({"event": "ack", "seq": self.last_seq}))
+
+
+async def http_loop(stop: asyncio.Event, stats: recorder, request):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = await request()
+            if response.status_code >= 400:
+                stats.errors += 1
+                continue
+            stats.latencies.append(time.perf_counter() - started)
+        except Exception:
+            stats.errors += 1
+
+
+def http_scenarios(http: httpx.AsyncClient, users: list, upload_size: int):
+    payload = os.urandom(upload_size)
+
+    def any_user():
+        return random.choice(users)
+
+    return {
+        "get_chats": lambda: http.get("/chat/get_chats", headers=any_user().headers),
+        "get_keys_data": lambda: http.get("/get_keys_data", headers=any_user().headers),
+        "signin": lambda: http.post("/auth/signin", json={"identifier": any_user().username, "password": PASSWORD}),
+        # Random content each time so uploads are not deduplicated away.
+        "upload": lambda: http.post("/file/upload", files={
+            "file": (f"{uuid.uuid4().hex}.bin", payload[:-16] + os.urandom(16), "application/octet-stream")
+        }),
+    }
+
+
+async def loop_lag_buckets(http: httpx.AsyncClient):
+    """Cumulative bucket counts of the server's event-loop lag histogram."""
+    try:
+        text = (await http.get("/metrics")).text
+    except Exception:
+        return {}
+    buckets = {}
+    for line in text.splitlines():
+        if line.startswith("cipherchats_event_loop_lag_seconds_bucket"):
+            bound = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float(bound)] = float(line.rsplit(" ", 1)[1])
+    return buckets
+
+
+def lag_quantiles(before: dict, after: dict):
+    """p50/p95/p99 (upper bucket bounds) of the lag observed between two scrapes."""
+    delta = sorted((bound, after[bound] - before.get(bound, 0)) for bound in after)
+    if not delta or not delta[-1][1]:
+        return None
+
+    total = delta[-1][1]
+
+    def quantile(q):
+        for bound, count in delta:
+            if count >= q * total:
+                return None if bound == float("inf") else round(bound * 1000, 2)
+
+    return {"samples": int(total), "p50_ms": quantile(0.5), "p95_ms": quantile(0.95), "p99_ms": quantile(0.99)}
+
+
+def mongo_url(in_memory: bool):
+    return "mongomock://" if in_memory else os.getenv("MONGO_URL", "mongodb://localhost:27017")
+
+
+def database_name(run_id: str):
+    return f"cipherchat_load_{run_id}"
+
+
+def spawn_server(port: int, run_id: str, in_memory: bool = False):
+    env = {
+        **os.environ,
+        "MONGO_URL": mongo_url(in_memory),
+        "MONGO_DB": database_name(run_id),
+        "BLOB_STORE": "memory" if in_memory else "azure",
+        "AZURE_STORAGE_CONNECTION_STRING": os.getenv("AZURE_STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true"),
+        "AZURE_STORAGE_CONTAINER_NAME": os.getenv("AZURE_STORAGE_CONTAINER_NAME", "loadtest"),
+        "SECRET_KEY": os.getenv("SECRET_KEY", "load-test-secret"),
+        "ALGORITHM": os.getenv("ALGORITHM", "HS256"),
+        "ACCESS_TOKEN_EXPIRE_DAY": "1",
+        "FILE_REAPER": "false",
+        "LOG_LEVEL": "WARNING",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+        env=env, cwd=Path(__file__).resolve().parent.parent
+    )
+
+
+def drop_database(run_id: str):
+    """Drops the throwaway database of a spawned run (mongomock's goes with the server)."""
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_url(False), serverSelectionTimeoutMS=5000)
+    try:
+        client.drop_database(database_name(run_id))
+    except Exception as e:
+        print(f"could not drop {database_name(run_id)}: {e!r}", file=sys.stderr)
+    finally:
+        client.close()
+
+
+async def wait_until_up(http: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await http.get("/metrics")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.25)
+    raise RuntimeError("server did not come up")
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    server = spawn_server(args.port, run_id, args.in_memory) if args.spawn else None
+    base_url = f"http://127.0.0.1:{args.port}" if args.spawn else args.base_url
+    ws_url = base_url.replace("http", "ws", 1)
+
+    limits = httpx.Limits(max_connections=args.concurrency * len(SCENARIOS))
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as http:
+            await wait_until_up(http)
+            users = await setup_users(http, max(args.clients, 2), run_id)
+
+            scenarios = set(args.scenarios.split(","))
+            stats = {name: recorder() for name in SCENARIOS if name in scenarios}
+            stop = asyncio.Event()
+            tasks = []
+
+            if "ws" in stats:
+                sent = {}
+                for user in users:
+                    client = ws_client(user, ws_url, sent, stats["ws"], args.message_rate, args.churn)
+                    tasks.append(asyncio.create_task(client.run(stop)))
+
+            for name, request in http_scenarios(http, users, args.upload_size).items():
+                if name in stats:
+                    tasks += [asyncio.create_task(http_loop(stop, stats[name], request)) for _ in range(args.concurrency)]
+
+            lag_before = await loop_lag_buckets(http)
+            started = time.perf_counter()
+            await asyncio.sleep(args.duration)
+            stop.set()
+            elapsed = time.perf_counter() - started
+            await asyncio.wait(tasks, timeout=10)
+            for task in tasks:
+                task.cancel()
+            lag_after = await loop_lag_buckets(http)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            if not args.in_memory:
+                drop_database(run_id)
+
+    return {
+        "commit": current_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "params": {
+            "clients": len(users), "duration": args.duration, "concurrency": args.concurrency,
+            "message_rate": args.message_rate, "churn": args.churn, "upload_size": args.upload_size,
+            "scenarios": sorted(stats)
+        },
+        "results": {name: record.summary(elapsed) for name, record in stats.items()},
+        "event_loop_lag": lag_quantiles(lag_before, lag_after),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="start a server against a throwaway database")
+    parser.add_argument("--in-memory", action="store_true", help="with --spawn: mongomock and an in-memory blob store")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=50, help="websocket users (paired into chats)")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=10, help="request loops per HTTP scenario")
+    parser.add_argument("--message-rate", type=float, default=2, help="messages per second per client")
+    parser.add_argument("--churn", type=float, default=0.1, help="disconnects per second per client")
+    parser.add_argument("--upload-size", type=int, default=64 * 1024)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", help="defaults to benchmarks/results/<commit>.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = Path(args.output or Path(__file__).parent / "results" / f"{report['commit']}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report["results"], indent=2))
+    print(f"event loop lag: {report['event_loop_lag']}")
+    print(f"written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Response encoding cost for typical chat payloads.
+
+Times the helpers routes used to build responses (``json_util`` round trips
+and ``clean_object_ids``, followed by the JSON render every response pays)
+against ``serialization_service.dumps``, on a page of keys with joining
+requests, a get_chat response and a batch of queued messages.
+
+    cd backend && python -m benchmarks.serialization --repeat 200
+"""
+import argparse
+import json
+import time
+import timeit
+from datetime import datetime, timedelta
+
+from bson import ObjectId, json_util
+
+from app.services.record_cleaning_service import clean_object_ids
+from app.services.serialization_service import dumps
+
+
+def keys_page(keys: int = 50, requests_per_key: int = 3):
+    owner = ObjectId()
+    created_at = datetime.now()
+    return {
+        "keys_data": [
+            {
+                "key": {
+                    "_id": ObjectId(),
+                    "key": f"k{i:015d}",
+                    "user_id": owner,
+                    "note": "shared with the team",
+                    "created_at": (created_at - timedelta(minutes=i)).isoformat()
+                },
+                "requests": [
+                    {
+                        "_id": ObjectId(),
+                        "user_id": ObjectId(),
+                        "user_data": {
+                            "username": f"user_{i}_{j}",
+                            "profile_photo_url": f"https://example.blob.core.windows.net/photos/{i}_{j}.png"
+                        }
+                    }
+                    for j in range(requests_per_key)
+                ]
+            }
+            for i in range(keys)
+        ],
+        "next_cursor": None
+    }
+
+
+def chat_details():
+    return {
+        "sender_details": {
+            "_id": ObjectId(),
+            "name": "Ada Lovelace",
+            "username": "ada",
+            "email": "ada@example.com",
+            "role": "user",
+            "profile_photo_url": "https://example.blob.core.windows.net/photos/ada.png"
+        },
+        "channel_id": ObjectId(),
+        "isE2ee": True
+    }
+
+
+def pending_batch(messages: int = 100):
+    sender, recipient, channel = str(ObjectId()), str(ObjectId()), str(ObjectId())
+    return {
+        "event": "batch",
+        "messages": [
+            {
+                "seq": i,
+                "sender_id": sender,
+                "recipient_id": recipient,
+                "channel_id": channel,
+                "type": "text",
+                "message": "x" * 120,
+                "timestamp": datetime.now().isoformat()
+            }
+            for i in range(messages)
+        ]
+    }
+
+
+def json_util_round_trip(payload):
+    return json.dumps(json.loads(json_util.dumps(payload))).encode()
+
+
+def cleaned(payload):
+    return json.dumps(clean_object_ids(payload)).encode()
+
+
+ENCODERS = {
+    "json_util": json_util_round_trip,
+    "clean_object_ids": cleaned,
+    "serialization_service": dumps,
+}
+
+PAYLOADS = {
+    "keys_page": keys_page,
+    "get_chat": chat_details,
+    "pending_batch": pending_batch,
+}
+
+
+def run(repeat: int):
+    results = []
+    for payload_name, build in PAYLOADS.items():
+        payload = build()
+        for encoder_name, encode in ENCODERS.items():
+            # ObjectIds become {"$oid": ...} under json_util, so sizes differ slightly.
+            size = len(encode(payload))
+            best = min(timeit.repeat(lambda: encode(payload), number=repeat, repeat=5))
+            results.append({
+                "payload": payload_name,
+                "encoder": encoder_name,
+                "bytes": size,
+                "us_per_op": round(best / repeat * 1e6, 1),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for result in run(args.repeat):
+        print(result)
+    print({"seconds": round(time.perf_counter() - started, 2)})
+
+
+if __name__ == "__main__":
+    main()
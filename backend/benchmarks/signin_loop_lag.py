@@ -0,0 +1,68 @@
+"""Event-loop lag during a burst of concurrent sign-ins.
+
+Runs the same bcrypt verifications twice, once inline on the event loop (how
+signin used to call passlib) and once through ``verify_password`` (the
+password executor), while a ticker measures how late the loop wakes up.
+
+    cd backend && python -m benchmarks.signin_loop_lag --signins 40
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.services import user_auth_services
+from app.services.user_auth_services import password_hasher
+
+TICK = 0.005
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(max(time.perf_counter() - started - TICK, 0) * 1000)
+
+
+async def run(mode: str, signins: int, password_hash: str):
+    async def inline():
+        return password_hasher.verify("correct horse", password_hash)
+
+    async def offloaded():
+        return await user_auth_services.verify_password("correct horse", password_hash)
+
+    signin = inline if mode == "inline" else offloaded
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    await asyncio.sleep(TICK * 4)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(signin() for _ in range(signins)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    lags.sort()
+    return {
+        "mode": mode,
+        "signins": signins,
+        "rejected": sum(isinstance(r, Exception) for r in results),
+        "seconds": round(elapsed, 3),
+        "lag_p50_ms": round(statistics.median(lags), 2),
+        "lag_p99_ms": round(lags[int(len(lags) * 0.99) - 1], 2),
+        "lag_max_ms": round(lags[-1], 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signins", type=int, default=40)
+    args = parser.parse_args()
+
+    password_hash = password_hasher.hash("correct horse")
+    for mode in ("inline", "executor"):
+        print(await run(mode, args.signins, password_hash))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
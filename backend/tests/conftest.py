@@ -0,0 +1,33 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The app reads these at import time. MongoDB is mongomock and blobs stay in
+# memory, so the tests need neither service.
+os.environ.setdefault("AZURE_STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true")
+os.environ.setdefault("AZURE_STORAGE_CONTAINER_NAME", "files")
+os.environ.setdefault("DELIVERY_BUS", "memory")
+os.environ["MONGO_URL"] = "mongomock://"
+os.environ["BLOB_STORE"] = "memory"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def empty_database():
+    """Every test starts with empty collections (indexes stay) and no blobs."""
+    yield
+
+    from app.db import get_collection, get_client
+    from app.db.connection import mongodb_name
+    from app.azure_upload import container_client
+
+    async def empty():
+        for name in await get_client()[mongodb_name].list_collection_names():
+            await get_collection(name).delete_many({})
+
+    asyncio.run(empty())
+    container_client.blobs.clear()
+    container_client.blocks.clear()
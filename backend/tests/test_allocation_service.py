@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from app.db import ensure_indexes, verify_unique_indexes, get_collection
+from app.services import allocation_service
+
+
+def test_insert_with_key_retries_a_taken_key(monkeypatch):
+    monkeypatch.setattr(allocation_service, "random_keys", lambda count, length=16: ["taken", "free"])
+
+    async def scenario():
+        await ensure_indexes()
+        channels = get_collection("channels")
+        await channels.insert_one({"key": "taken"})
+
+        document = {"note": "mine"}
+        assert await allocation_service.insert_with_key(channels, document) == "free"
+        assert (await channels.find_one({"note": "mine"}))["key"] == "free"
+
+    asyncio.run(scenario())
+
+
+def test_insert_with_key_gives_up(monkeypatch):
+    monkeypatch.setattr(allocation_service, "random_keys", lambda count, length=16: ["taken"] * count)
+
+    async def scenario():
+        await ensure_indexes()
+        channels = get_collection("channels")
+        await channels.insert_one({"key": "taken"})
+
+        with pytest.raises(allocation_service.allocation_failed):
+            await allocation_service.insert_with_key(channels, {"note": "mine"})
+        assert await channels.count_documents({}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_insert_with_username_falls_back_to_a_suffix():
+    async def scenario():
+        await ensure_indexes()
+        users = get_collection("user")
+        await users.insert_one({"email": "first@example.com", "username": "ada"})
+
+        username = await allocation_service.insert_with_username(users, {"email": "second@example.com"}, "Ada")
+        assert username.startswith("ada") and len(username) == len("ada") + 5
+        assert (await users.find_one({"email": "second@example.com"}))["username"] == username
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_on_another_field_is_raised():
+    async def scenario():
+        await ensure_indexes()
+        users = get_collection("user")
+        await users.insert_one({"email": "taken@example.com", "username": "someone"})
+
+        with pytest.raises(DuplicateKeyError):
+            await allocation_service.insert_with_username(users, {"email": "taken@example.com"}, "Ada")
+
+    asyncio.run(scenario())
+
+
+def test_startup_refuses_missing_unique_index():
+    async def scenario():
+        await ensure_indexes()
+        await verify_unique_indexes()
+
+        await get_collection("user").drop_index("username_unique")
+        try:
+            with pytest.raises(RuntimeError, match="user.username"):
+                await verify_unique_indexes()
+        finally:
+            await ensure_indexes()
+
+    asyncio.run(scenario())
@@ -0,0 +1,97 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+from starlette.datastructures import UploadFile
+
+from app.azure_upload import container_client
+from app.db import get_collection
+from app.routes.user_routes import edit_profile
+from app.services import blob_service
+
+
+def upload(data: bytes, filename: str = "photo.png"):
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def test_same_bytes_share_one_blob():
+    async def scenario():
+        first = await blob_service.store_upload(upload(b"same bytes"), uploader="a")
+        second = await blob_service.store_upload(upload(b"same bytes"), uploader="b")
+
+        assert first == second
+        assert len(container_client.blobs) == 1
+        blob = await blob_service.blobs_collection.find_one({"_id": first[0]})
+        assert blob["refs"] == 2
+        assert sorted(blob["uploaders"]) == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_claimed_digest_only_reuses_own_uploads():
+    async def scenario():
+        digest, _, size = await blob_service.store_upload(upload(b"private"), uploader="owner")
+
+        assert await blob_service.acquire_own_blob(digest, size, "someone else") is None
+        assert await blob_service.acquire_own_blob(digest, size + 1, "owner") is None
+        assert (await blob_service.acquire_own_blob(digest, size, "owner"))["refs"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_unreferenced_blob_is_forgotten_after_grace():
+    async def scenario():
+        digest, _, _ = await blob_service.store_upload(upload(b"short lived"))
+        await blob_service.store_upload(upload(b"short lived"))
+
+        await blob_service.release_blobs([digest])
+        later = datetime.utcnow() + timedelta(seconds=1)
+        assert await blob_service.released_blobs(later, 10) == []
+
+        await blob_service.release_blobs([digest])
+        released = await blob_service.released_blobs(later, 10)
+        assert [blob["_id"] for blob in released] == [digest]
+
+        assert await blob_service.forget_blobs(released, later) == [released[0]["blob_name"]]
+        assert await blob_service.blobs_collection.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_reacquired_blob_is_not_forgotten():
+    async def scenario():
+        digest, _, _ = await blob_service.store_upload(upload(b"comes back"))
+        await blob_service.release_blobs([digest])
+        later = datetime.utcnow() + timedelta(seconds=1)
+        released = await blob_service.released_blobs(later, 10)
+
+        # Uploaded again between listing and forgetting.
+        await blob_service.store_upload(upload(b"comes back"))
+        assert await blob_service.forget_blobs(released, later) == []
+        assert (await blob_service.blobs_collection.find_one({"_id": digest}))["refs"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_profile_photo_replacement_releases_the_old_photo():
+    async def scenario():
+        users = get_collection("user")
+        user_id = (await users.insert_one({"email": "p@example.com", "username": "p", "name": "P", "role": "user"})).inserted_id
+        user = {"sub": str(user_id)}
+
+        await edit_profile(username="p", name="P", profile_photo=upload(b"old photo"), user=user)
+        old_digest = (await users.find_one({"_id": user_id}))["profile_photo_digest"]
+
+        # A profile edit without a photo keeps the photo and its digest.
+        await edit_profile(username="p", name="Renamed", profile_photo=None, user=user)
+        assert (await users.find_one({"_id": user_id}))["profile_photo_digest"] == old_digest
+
+        await edit_profile(username="p", name="Renamed", profile_photo=upload(b"new photo"), user=user)
+        new_digest = (await users.find_one({"_id": user_id}))["profile_photo_digest"]
+        assert new_digest != old_digest
+
+        old = await blob_service.blobs_collection.find_one({"_id": old_digest})
+        assert old["refs"] == 0 and "released_at" in old
+        assert (await blob_service.blobs_collection.find_one({"_id": new_digest}))["refs"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app import config
+from app.db import get_collection
+from app.services import chat_list_service
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    yield
+    chat_list_service.chat_lists.clear()
+    chat_list_service.partner_index.clear()
+
+
+async def chats_for(owner_id, count: int):
+    """``count`` approved channels, newest activity first, plus one never used."""
+    users, channels = get_collection("user"), get_collection("channels")
+    now = datetime.utcnow().replace(microsecond=0)
+    channel_ids = []
+    for n in range(count + 1):
+        partner_id = (await users.insert_one({"email": f"p{n}@example.com", "username": f"p{n}", "name": f"P{n}"})).inserted_id
+        last_activity_at = now - timedelta(minutes=n) if n < count else None
+        result = await channels.insert_one({"user_id": owner_id, "partner_id": partner_id, "last_activity_at": last_activity_at})
+        channel_ids.append(str(result.inserted_id))
+    # A key nobody has joined is not a chat.
+    await channels.insert_one({"user_id": owner_id, "key": "unused"})
+    return channel_ids
+
+
+def test_cursor_pages_through_the_whole_list(monkeypatch):
+    monkeypatch.setattr(config, "chat_list_page_size", 2)
+
+    async def scenario():
+        owner_id = ObjectId()
+        expected = await chats_for(owner_id, 5)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = await chat_list_service.get_chat_page(str(owner_id), 2, cursor)
+            seen += [chat["channel_id"] for chat in page]
+            if cursor is None:
+                break
+        assert seen == expected
+
+        # The cursor still works once the cached list has expired.
+        first, cursor = await chat_list_service.get_chat_page(str(owner_id), 2)
+        chat_list_service.chat_lists.clear()
+        rest, _ = await chat_list_service.get_chat_page(str(owner_id), 10, cursor)
+        assert [chat["channel_id"] for chat in first + rest] == expected
+
+    asyncio.run(scenario())
+
+
+def encoded(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encoded([1, 2]),
+    encoded({"t": None}),
+    encoded({"id": str(ObjectId())}),
+    encoded({"t": None, "id": "not an id"}),
+    encoded({"t": 5, "id": str(ObjectId())}),
+    encoded({"t": "yesterday", "id": str(ObjectId())}),
+])
+def test_malformed_cursor_is_a_value_error(cursor):
+    with pytest.raises(ValueError):
+        asyncio.run(chat_list_service.get_chat_page(str(ObjectId()), 2, cursor))
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from app import config
+from app.services import chat_service
+from app.websocket.chat_websocket import connection_manager, parse_resume
+from app.websocket.delivery_bus import in_memory_bus
+
+
+class fake_websocket:
+    def __init__(self):
+        self.scope = {}
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        pass
+
+
+class fake_store:
+    """Stands in for the delivery_sequences counter and the offline queue."""
+
+    def __init__(self):
+        self.seq = 0
+        self.queued = []
+
+    async def reserve_sequence(self, recipient_id, count=1):
+        self.seq += count
+        return self.seq
+
+    async def queue_messages(self, messages):
+        for message in messages:
+            if "seq" not in message:
+                message["seq"] = await self.reserve_sequence(message["recipient_id"])
+        self.queued.extend(messages)
+        return True
+
+
+def message(text):
+    return {"channel_id": "c", "sender_id": "s", "recipient_id": "u", "message_type": "text", "message": text}
+
+
+def test_stale_connection_redelivers_with_fresh_seqs(monkeypatch):
+    store = fake_store()
+    monkeypatch.setattr(chat_service, "reserve_sequence", store.reserve_sequence)
+    monkeypatch.setattr(chat_service, "queue_messages", store.queue_messages)
+
+    async def scenario():
+        manager = connection_manager(in_memory_bus())
+        old = await manager.connect(fake_websocket(), "u", resume_from=0)
+        await manager.send_message_to_user(message("to old"), "s", "u")
+        stale_seq = next(iter(old.unacked))
+
+        # The user reconnects before the old socket is noticed as dead.
+        new = await manager.connect(fake_websocket(), "u", resume_from=0)
+        await manager.send_message_to_user(message("to new"), "s", "u")
+        newest_seq = max(new.unacked)
+        assert newest_seq > stale_seq
+
+        await manager.disconnect("u", old)
+        # The old connection's message moved to the new one, after what it already sent.
+        assert [m["message"] for m in new.unacked.values()] == ["to new", "to old"]
+        assert max(new.unacked) > newest_seq
+
+        # Once the user is gone everything lands in the offline queue above
+        # every seq the client could have acked.
+        client_last_seq = max(new.unacked)
+        await manager.disconnect("u", new)
+        assert [m["message"] for m in store.queued] == ["to new", "to old"]
+        assert all(m["seq"] > client_last_seq for m in store.queued)
+
+    asyncio.run(scenario())
+
+
+def test_close_returns_owed_messages_without_seq(monkeypatch):
+    store = fake_store()
+    monkeypatch.setattr(chat_service, "reserve_sequence", store.reserve_sequence)
+    monkeypatch.setattr(config, "sequence_block_size", 10)
+
+    async def scenario():
+        manager = connection_manager(in_memory_bus())
+        connection = await manager.connect(fake_websocket(), "u", resume_from=0)
+        await connection.send(message("one"))
+        await connection.send({"event": "stop_typing", "sender_id": "s", "recipient_id": "u", "channel_id": "c"})
+        owed = await connection.close()
+        assert owed == [{**message("one"), "queued_at": connection.last_send}]
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_is_queued_once(monkeypatch):
+    store = fake_store()
+    monkeypatch.setattr(config, "sequence_block_size", 2)
+    monkeypatch.setattr(chat_service, "queue_messages", store.queue_messages)
+
+    async def reserve_once(recipient_id, count=1):
+        if store.seq:
+            raise ConnectionError("mongo unavailable")
+        return await store.reserve_sequence(recipient_id, count)
+
+    monkeypatch.setattr(chat_service, "reserve_sequence", reserve_once)
+
+    async def scenario():
+        manager = connection_manager(in_memory_bus())
+        await manager.connect(fake_websocket(), "u", resume_from=0)
+        # The block holds two seqs, so the third needs a reservation that fails.
+        assert not await manager.deliver_local_many([message("1"), message("2"), message("3")], "u")
+        assert [m["message"] for m in store.queued] == ["1", "2", "3"]
+
+    asyncio.run(scenario())
+
+
+def test_parse_resume():
+    assert parse_resume(None) is None
+    assert parse_resume("0") == 0
+    assert parse_resume("42") == 42
+    for bad in ("", "abc", "1.5", "-1"):
+        with pytest.raises(ValueError):
+            parse_resume(bad)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+
+from app import config
+from app.services import chat_service
+from app.websocket.chat_websocket import connection_manager
+from app.websocket.delivery_bus import broker_bus, local_broker, PRESENCE_KEY, LAST_SEEN_KEY, DELIVERY_CHANNEL
+from test_connection import fake_websocket, message
+
+
+async def settle():
+    # local_broker hands payloads over in tasks; let them and the write loops run.
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def workers(broker):
+    return connection_manager(broker_bus(broker, "w1")), connection_manager(broker_bus(broker, "w2"))
+
+
+def test_message_reaches_user_on_another_worker():
+    async def scenario():
+        broker = local_broker()
+        first, second = workers(broker)
+        await first.bus.start(first.deliver_from_bus)
+        await second.bus.start(second.deliver_from_bus)
+
+        socket = fake_websocket()
+        await second.connect(socket, "u")
+        await first.send_message_to_user(message("hello"), "s", "u")
+        await settle()
+
+        assert [json.loads(frame)["message"] for frame in socket.sent] == ["hello"]
+        assert await chat_service.queued_messages_collection.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_dead_worker_presence_is_dropped_and_message_queued():
+    async def scenario():
+        broker = local_broker()
+        first, second = workers(broker)
+        await first.bus.start(first.deliver_from_bus)
+        await second.bus.start(second.deliver_from_bus)
+        await second.connect(fake_websocket(), "u")
+
+        # The worker dies without unregistering anyone: its channel goes quiet,
+        # its presence entry stays.
+        await broker.unsubscribe(DELIVERY_CHANNEL.format("w2"))
+        assert (await first.bus.presence_many(["u"]))["u"]["online"]
+
+        # ... until its heartbeats are older than the idle timeout.
+        broker.hashes[LAST_SEEN_KEY]["u"] = str(time.time() - config.presence_idle_timeout - 1)
+        assert not (await first.bus.presence_many(["u"]))["u"]["online"]
+
+        # A send finds nobody listening, drops the entry and queues the message.
+        await first.send_message_to_user(message("while away"), "s", "u")
+        assert "u" not in broker.hashes[PRESENCE_KEY]
+        queued = await chat_service.queued_messages_collection.find({"recipient_id": "u"}).to_list(None)
+        assert [m["message"] for m in queued] == ["while away"]
+
+    asyncio.run(scenario())
+
+
+def test_unregister_keeps_a_newer_registration():
+    async def scenario():
+        broker = local_broker()
+        first, second = workers(broker)
+        old = await first.connect(fake_websocket(), "u")
+        # The user reconnects to the other worker before the first notices.
+        await second.connect(fake_websocket(), "u")
+
+        await first.disconnect("u", old)
+        assert await first.bus.locate("u") == "w2"
+
+        await second.disconnect("u")
+        assert await first.bus.locate("u") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+from starlette.datastructures import UploadFile
+
+from app import config
+from app.azure_upload import container_client
+from app.background_tasks.file_deletion import expired_file_reaper, acquire_lease, file_collection
+from app.services import blob_service
+
+
+def test_lease_has_one_holder_until_it_expires():
+    async def scenario():
+        assert await acquire_lease("test", "a", ttl=60)
+        assert not await acquire_lease("test", "b", ttl=60)
+        # Renewing is fine; an expired lease goes to whoever asks next.
+        assert await acquire_lease("test", "a", ttl=-1)
+        assert await acquire_lease("test", "b", ttl=60)
+        assert not await acquire_lease("test", "a", ttl=60)
+
+    asyncio.run(scenario())
+
+
+def stored(name: str):
+    container_client.blobs[name] = b"bytes"
+    return f"http://memory.invalid/{container_client.name}/{name}"
+
+
+def test_reap_removes_expired_files_and_their_unused_blobs():
+    async def scenario():
+        now = datetime.utcnow()
+        past, future = now - timedelta(days=1), now + timedelta(days=1)
+        digest, url, _ = await blob_service.store_upload(UploadFile(file=io.BytesIO(b"shared"), filename="s.bin"))
+
+        await file_collection.insert_many([
+            {"blob_name": "gone.bin", "file_url": stored("gone.bin"), "file_exp": past},
+            # Same name uploaded again later: the blob must stay.
+            {"blob_name": "reused.bin", "file_url": stored("reused.bin"), "file_exp": past},
+            {"blob_name": "reused.bin", "file_url": stored("reused.bin"), "file_exp": future},
+            # Written before blob_name was recorded.
+            {"file_url": stored("legacy.bin"), "file_exp": past},
+            {"blob_name": None, "digest": digest, "file_url": url, "file_exp": past},
+        ])
+
+        reaper = expired_file_reaper(holder="test")
+        # mongomock's bulk_write rejects pymongo's UpdateOne, so the backfill is
+        # skipped; the legacy file is still found through its URL.
+        reaper._backfilled = True
+        await reaper.reap(now)
+
+        shared_blob = (await blob_service.blobs_collection.find_one({"_id": digest}))["blob_name"]
+        assert sorted(container_client.blobs) == sorted([shared_blob, "reused.bin"])
+        assert [file["blob_name"] for file in await file_collection.find().to_list(None)] == ["reused.bin"]
+        assert (await blob_service.blobs_collection.find_one({"_id": digest}))["refs"] == 0
+
+        # Once the grace period is over, the shared blob goes too.
+        await reaper.reap(now + timedelta(seconds=config.blob_release_grace + 1))
+        assert sorted(container_client.blobs) == ["reused.bin"]
+
+    asyncio.run(scenario())
+
+
+def test_reap_stops_when_the_lease_is_lost():
+    async def scenario():
+        now = datetime.utcnow()
+        await file_collection.insert_many([
+            {"blob_name": f"{n}.bin", "file_url": stored(f"{n}.bin"), "file_exp": now - timedelta(days=1)} for n in range(3)
+        ])
+        assert await acquire_lease("file_reaper", "other", ttl=60)
+
+        # Every batch renews the lease; another live holder ends the run after the first.
+        await expired_file_reaper(holder="test", batch_size=1).reap(now)
+        assert await file_collection.count_documents({}) == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from app.db import get_collection
+from app.routes.chat_routes import get_e2ee_status
+from app.services import membership_service
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    yield
+    membership_service.memberships.clear()
+    membership_service.pairs.clear()
+
+
+def test_pending_channel_is_not_cached():
+    async def scenario():
+        channels = get_collection("channels")
+        owner_id, partner_id = ObjectId(), ObjectId()
+        channel_id = (await channels.insert_one({"user_id": owner_id, "key": "k"})).inserted_id
+
+        assert (await membership_service.get_membership(channel_id)).partner_id is None
+        # Approved on another worker: seen on the next lookup, not after the TTL.
+        await channels.update_one({"_id": channel_id}, {"$set": {"partner_id": partner_id}})
+        assert (await membership_service.get_membership(channel_id)).partner_id == partner_id
+        assert membership_service.memberships.get(str(channel_id)) is not None
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_drops_membership_and_pair():
+    async def scenario():
+        channels = get_collection("channels")
+        owner_id, partner_id = ObjectId(), ObjectId()
+        channel_id = (await channels.insert_one({"user_id": owner_id, "partner_id": partner_id})).inserted_id
+
+        assert (await membership_service.find_between(partner_id, owner_id)).channel_id == channel_id
+        assert await membership_service.partners_among(str(owner_id), [str(partner_id)]) == [str(partner_id)]
+
+        await channels.delete_one({"_id": channel_id})
+        membership_service.invalidate(channel_id)
+        assert await membership_service.get_membership(channel_id) is None
+        assert await membership_service.find_between(owner_id, partner_id) is None
+        assert await membership_service.partners_among(str(owner_id), [str(partner_id)]) == []
+
+    asyncio.run(scenario())
+
+
+def test_e2ee_status_is_not_served_from_the_cache():
+    async def scenario():
+        channels = get_collection("channels")
+        owner_id, partner_id = ObjectId(), ObjectId()
+        channel_id = (await channels.insert_one({"user_id": owner_id, "partner_id": partner_id, "is_e2ee": False})).inserted_id
+        user = {"sub": str(owner_id)}
+
+        assert await get_e2ee_status(str(partner_id), user=user) == {"isE2ee": False}
+        # Toggled through another worker, which cannot invalidate this one's cache.
+        await channels.update_one({"_id": channel_id}, {"$set": {"is_e2ee": True}})
+        assert membership_service.memberships.get(str(channel_id)) is not None
+        assert await get_e2ee_status(str(partner_id), user=user) == {"isE2ee": True}
+
+    asyncio.run(scenario())
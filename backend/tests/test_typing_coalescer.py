@@ -0,0 +1,45 @@
+import asyncio
+
+from app.websocket.typing_coalescer import typing_coalescer
+
+
+def recorder():
+    events = []
+
+    async def forward(event, recipient_id, channel_id):
+        events.append((event, recipient_id))
+
+    return events, forward
+
+
+def expire_now(coalescer, channel_id):
+    coalescer._active[channel_id].last_seen -= coalescer.timeout
+    coalescer._expire(channel_id)
+
+
+def test_expiry_after_stop_typing_is_a_no_op():
+    async def scenario():
+        events, forward = recorder()
+        coalescer = typing_coalescer(forward, window=0, timeout=5)
+        await coalescer.typing("a", "c")
+        expire_now(coalescer, "c")
+        await coalescer.stop_typing("a", "c")
+        await asyncio.gather(*coalescer._tasks)
+        assert events == [("typing", "a"), ("stop_typing", "a")]
+
+    asyncio.run(scenario())
+
+
+def test_expiry_leaves_the_next_recipient_typing():
+    async def scenario():
+        events, forward = recorder()
+        coalescer = typing_coalescer(forward, window=0, timeout=5)
+        await coalescer.typing("a", "c")
+        expire_now(coalescer, "c")
+        await coalescer.typing("b", "c")
+        await asyncio.gather(*coalescer._tasks)
+        assert events == [("typing", "a"), ("stop_typing", "a"), ("typing", "b")]
+        assert coalescer._active["c"].recipient_id == "b"
+        await coalescer.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import axiosInstance from './axiosInstance';
+
+const PARALLEL_PARTS = 4;
+const PART_RETRIES = 3;
+
+type UploadSession = {
+  upload_id: string;
+  part_size: number;
+  part_count: number;
+};
+
+// Uploads a large file through the resumable session API: parts are sent
+// concurrently and a failed part is retried on its own instead of restarting
+// the whole transfer.
+export async function uploadInParts(file: File): Promise<string> {
+  const { data: session } = await axiosInstance.post<UploadSession>('file/uploads', {
+    file_name: file.name,
+    file_size: file.size,
+    content_type: file.type,
+  });
+
+  const uploadPart = async (partNumber: number) => {
+    const start = (partNumber - 1) * session.part_size;
+    const body = file.slice(start, Math.min(start + session.part_size, file.size));
+
+    for (let attempt = 1; ; attempt++) {
+      try {
+        await axiosInstance.put(`file/uploads/${session.upload_id}/parts/${partNumber}`, body, {
+          headers: { 'Content-Type': 'application/octet-stream' },
+        });
+        return;
+      } catch (error) {
+        if (attempt >= PART_RETRIES) throw error;
+        await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+      }
+    }
+  };
+
+  let nextPart = 1;
+  const worker = async () => {
+    while (nextPart <= session.part_count) {
+      await uploadPart(nextPart++);
+    }
+  };
+
+  try {
+    await Promise.all(Array.from({ length: Math.min(PARALLEL_PARTS, session.part_count) }, worker));
+    const { data } = await axiosInstance.post(`file/uploads/${session.upload_id}/complete`);
+    return data.file_url;
+  } catch (error) {
+    axiosInstance.delete(`file/uploads/${session.upload_id}`).catch(() => {});
+    throw error;
+  }
+}
@@ -1,5 +1,6 @@
 import { useState, useRef, useEffect } from 'react';
 import axiosInstance from '../../../axiosInstance';
+import { uploadInParts } from '../../../multipartUpload';
 import { Image as ImageIcon, Send, File, Headphones, FileVideo, X, Reply, Paperclip } from 'lucide-react';
 import { useWebSocket } from '../../../websocketContext';
 import { Message } from '../../../interfaces/Message';
@@ -48,11 +49,16 @@ export default function ChatInput({ userId, handleMessage, channel_id, replyingM
 
       setFiles(prev => prev.map((f, idx) => idx === i ? { ...f, uploading: true } : f));
 
-      const formData = new FormData();
-      formData.append('file', file.file);
-
       try {
-        const response = await axiosInstance.post('file/upload', formData);
+        let file_url: string;
+        if (file.file.type.startsWith('video/') || file.file.type.startsWith('audio/')) {
+          file_url = await uploadInParts(file.file);
+        } else {
+          const formData = new FormData();
+          formData.append('file', file.file);
+          const response = await axiosInstance.post('file/upload', formData);
+          file_url = response.data.file_url;
+        }
         console.log('File uploaded successfully:', file.file.size);
         handleMessage('file',
           file.file.type.startsWith('image/') ? 'image'
@@ -60,7 +66,7 @@ export default function ChatInput({ userId, handleMessage, channel_id, replyingM
               : file.file.type.startsWith('audio/') ? 'audio'
                 : 'file',
           file.file.name,
-          response.data.file_url,
+          file_url,
           file.file.size);
 
         setFiles(prev => prev.map((f, idx) => idx === i ? { ...f, uploading: false } : f));
@@ -34,9 +34,15 @@ const KeysPage = ({onCreateChannel}
     useEffect(() => {
         const fetchKeys = async () => {
             try{
-                const response = await axiosInstance.get('/get_keys_data');
-                console.log("Fetched keys:", response.data.keys_data);
-                setKeysData(response.data.keys_data);
+                // Keys come back a page at a time; show each page as it arrives.
+                let cursor: string | null = null;
+                let loaded: KeysData[] = [];
+                do {
+                    const response: any = await axiosInstance.get('/get_keys_data', { params: cursor ? { cursor } : {} });
+                    loaded = [...loaded, ...response.data.keys_data];
+                    setKeysData(loaded);
+                    cursor = response.data.next_cursor;
+                } while (cursor);
             }catch (error) {
                 console.error("Error fetching keys:", error);
             }
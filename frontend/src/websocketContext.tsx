@@ -7,12 +7,25 @@ import { Message, sendingMessage } from "./interfaces/Message";
 
 class eventEmitter extends EventEmitter {}
 
+// Highest delivery seq this user has received, so reconnects resume after it.
+const lastSeqKey = () => {
+  try {
+    const token = localStorage.getItem('access_token') || '';
+    return `last_seq:${JSON.parse(atob(token.split('.')[1])).sub}`;
+  } catch {
+    return 'last_seq';
+  }
+};
+
+const getLastSeq = () => Number(localStorage.getItem(lastSeqKey()) || 0);
+
 function useMessageHandler(){
     const messageQueue = useRef<any[]>([])
     const isProcessingMessageQueue = useRef(false)
     const activeChannel = useRef(null)
     const messageEmmiter = useRef(new eventEmitter())
     const usersMap = useRef(new Map())
+    const ackTimer = useRef<ReturnType<typeof setTimeout> | null>(null)
 
     const handleMessageQueue = async () => {
 
@@ -107,8 +120,39 @@ function useMessageHandler(){
 
     const handleSocketMessages = async (event: any) => {
         const receivedMessage = JSON.parse(event.data);
+
+        // Server heartbeat: answer so the connection is not dropped as idle.
+        if (receivedMessage.event === "ping") {
+          event.target.send(JSON.stringify({ event: "pong" }));
+          return;
+        }
         console.log("Received message:", receivedMessage);
-        messageQueue.current.push(receivedMessage);
+
+        // Offline messages are replayed several to a frame.
+        const incoming = receivedMessage.event === "batch" ? receivedMessage.messages : [receivedMessage];
+        let lastSeq = getLastSeq();
+        let received = false;
+
+        for (const message of incoming) {
+          if (message.seq !== undefined) {
+            if (message.seq <= lastSeq) continue; // already delivered before a reconnect
+            lastSeq = message.seq;
+            received = true;
+          }
+          messageQueue.current.push(message);
+        }
+
+        if (received) {
+          localStorage.setItem(lastSeqKey(), String(lastSeq));
+          // One ack covers everything up to lastSeq, so coalesce them.
+          if (ackTimer.current) clearTimeout(ackTimer.current);
+          const socket = event.target;
+          ackTimer.current = setTimeout(() => {
+            if (socket.readyState === WebSocket.OPEN) {
+              socket.send(JSON.stringify({ event: "ack", seq: getLastSeq() }));
+            }
+          }, 250);
+        }
     
         if (!isProcessingMessageQueue.current) {
           await handleMessageQueue();
@@ -247,7 +291,7 @@ export const WebSocketProvider = ({ children }: PropsWithChildren<{}>) => {
   useEffect(() => {
     const url = import.meta.env.VITE_WEBSOCKET_URL;
     const token = localStorage.getItem('access_token')
-    connect(`${url}/ws/chat?token=${token}`);
+    connect(`${url}/ws/chat?token=${token}&resume=${getLastSeq()}`);
 
     return () => {
       disconnect(); // Clean up on unmount